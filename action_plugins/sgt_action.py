@@ -0,0 +1,43 @@
+# coding=utf-8
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import importlib.util
+import os
+import sys
+
+from ansible.plugins.action import ActionBase
+from ansible.plugins.loader import module_utils_loader
+
+
+def _controller():
+    name = "ansible.module_utils.sgt_controller"
+
+    if name not in sys.modules:
+        path = module_utils_loader.find_plugin("sgt_controller", mod_type=".py") or \
+            os.path.join(os.path.dirname(__file__), os.pardir, "module_utils", "sgt_controller.py")
+        spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        sys.modules[name] = module
+
+    return sys.modules[name]
+
+
+class ActionModule(ActionBase):
+    # Shared by every action_plugins/sgt_*.py, which only pick it up through
+    # the action loader (plugins are loaded by file, not imported as a package)
+
+    TRANSFERS_FILES = False
+    _supports_check_mode = True
+
+    #Modules that read files on the target (sgt_upload) set it
+    reads_target_files = False
+
+    def run(self, tmp=None, task_vars=None):
+        result = super(ActionModule, self).run(tmp, task_vars)
+        del tmp
+
+        result.update(_controller().run_action(self, task_vars, reads_target_files=self.reads_target_files))
+        return result
@@ -0,0 +1,8 @@
+# coding=utf-8
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+from ansible.plugins.loader import action_loader
+
+ActionModule = action_loader.get("sgt_action", class_only=True)
@@ -0,0 +1,11 @@
+# coding=utf-8
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+from ansible.plugins.loader import action_loader
+
+
+class ActionModule(action_loader.get("sgt_action", class_only=True)):
+
+    reads_target_files = True
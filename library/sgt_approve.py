@@ -3,7 +3,8 @@
 
 from __future__ import (absolute_import, division, print_function)
 from ansible.module_utils.basic import AnsibleModule
-import requests
+from ansible.module_utils.sgt_client import get_client, sgt_argument_spec
+from ansible.module_utils.sgt_parallel import parallel_map
 import json
 import os
 from datetime import datetime
@@ -78,14 +79,12 @@ def info_approver(number_id, approver_name, **module_args):
     endpoint = module_args["sn_base"] + module_args["sn_uri"] 
     params={
         "sysparm_query": "sysapproval.number="+str(number_id)+"^approver.user_name="+str(approver_name)+"^state=requested",
-        "sysparm_fields": "sys_id,state,sysapproval.number,state,approver,u_requested_for",
-        "sysparm_display_value": "true"
+        "sysparm_fields": "sys_id,state,sysapproval.number,approver,u_requested_for"
     }
 
     try:
-        response = requests.get(
+        response = get_client(**module_args).get(
             url=endpoint,
-            auth=(module_args["sn_user"], module_args["sn_pass"]),
             params=params,
             timeout=module_args["timeout"]
         )
@@ -98,9 +97,6 @@ def info_approver(number_id, approver_name, **module_args):
 def approve(number_id, approve_id, **module_args):
     response = None
     endpoint = module_args["sn_base"] + module_args["sn_uri"] + "/" + approve_id
-    params={
-        "sysparm_display_value": "true"
-    }
     data={
         "state": "approved"
     }
@@ -109,10 +105,8 @@ def approve(number_id, approve_id, **module_args):
         data["work_notes"] = module_args["work_notes"]
 
     try:
-        response = requests.put(
+        response = get_client(**module_args).put(
             url=endpoint,
-            auth=(module_args["sn_user"], module_args["sn_pass"]),
-            params=params,
             data=json.dumps(data),
             timeout=module_args["timeout"]
         )
@@ -122,14 +116,84 @@ def approve(number_id, approve_id, **module_args):
 
     return response
 
+def pending_approvals(number_list, approver_name, **module_args):
+    endpoint = module_args["sn_base"] + module_args["sn_uri"]
+    q = []
+
+    if number_list:
+        q.append("sysapproval.numberIN" + ",".join(number_list))
+    if approver_name:
+        q.append("approver.user_name=" + str(approver_name))
+    q.append("state=requested")
+
+    params={
+        "sysparm_query": "^".join(q),
+        "sysparm_fields": "sys_id,state,sysapproval.number,approver,approver.user_name,u_requested_for",
+        "sysparm_exclude_reference_link": "true"
+    }
+
+    return list(get_client(**module_args).iter_records(endpoint, params=params, timeout=module_args["timeout"]))
+
+def approve_many(number_list, approver_name, **module_args):
+    # One query finds every pending approval of the records (and/or approver),
+    # then the approvals are sent concurrently
+    results = []
+
+    try:
+        approvals = pending_approvals(number_list, approver_name, **module_args)
+    except Exception as e:
+        return [{"number": None, "status_code": None, "result": {"mensaje": "ERROR, could not get pending approvals: " + str(e)}}]
+
+    workers = max(module_args["approve_workers"], 1)
+    module_args["pool_maxsize"] = max(module_args.get("pool_maxsize") or 10, workers)
+
+    def approve_one(approval):
+        number_id = approval.get("sysapproval.number")
+        response = approve(number_id, approval["sys_id"], **module_args)
+        item = {
+            "number":       number_id,
+            "approver":     approval.get("approver.user_name") or approval.get("approver"),
+            "sys_id":       approval["sys_id"],
+            "status_code":  None
+        }
+
+        if isinstance(response, dict):
+            item["result"] = response
+        else:
+            item["status_code"] = response.status_code
+            try:
+                item["result"] = response.json().get("result", response.text)
+            except ValueError:
+                item["result"] = response.text
+
+        return item
+
+    results = parallel_map(approve_one, approvals, workers, **module_args)
+
+    found = set(r["number"] for r in results)
+    for number_id in number_list or []:
+        if number_id not in found:
+            results.append({"number": number_id, "status_code": None, "result": "No pending approvals found"})
+
+    return results
+
 def validateOptions(module):
     
     if module.params["state"] == "approve":
-        response = info_approver(module.params["number"], module.params["approver"], **module.params).json()
+        response = info_approver(module.params["number"], module.params["approver"], **module.params)
+
+        #Request errors and failed lookups are reported as they are
+        if isinstance(response, dict) or response.status_code != 200:
+            return response
+
+        try:
+            records = response.json().get("result", [])
+        except ValueError:
+            return {"mensaje": "ERROR, approval could not get information: " + str(module.params["number"]) + ": " + response.text}
+
         approver_id = ""
-        
-        if len(response["result"]) > 0:
-            approver_id = response["result"][0]["sys_id"]
+        if len(records) > 0:
+            approver_id = records[0]["sys_id"]
             
         return approve(module.params["number"], approver_id, **module.params)
 
@@ -146,7 +210,7 @@ def run_module():
         #Generals
         "sn_user": {"required": True, "type": "str"},
         "sn_pass": {"required": True, "type": "str", "no_log": True},
-        "sn_base": {"required": True, "type": "str", "default":"https://santandertest.service-now.com"},
+        "sn_base": {"required": False, "type": "str", "default":"https://santandertest.service-now.com"},
         "sn_uri":  {"required": False, "type": "str", "default": "/api/now/v2/table/sysapproval_approver"},
         "timeout": {"required": False, "type": "int", "default": 300},
         "filter":  {"required": False, "type": "bool", "default": True},
@@ -156,9 +220,15 @@ def run_module():
         "number":{ "type": "str" },
         "approver": {"type":"str"},
 
+        #For approving many records at once
+        "numbers": {"type": "list", "elements": "str"},
+        "approve_workers": {"type": "int", "default": 4},
+
         
 }
 
+    module_args.update(sgt_argument_spec())
+
     result = dict(
         changed=False,
         original_message="",
@@ -174,14 +244,41 @@ def run_module():
         required_together=[
             ('sn_user', 'sn_pass','sn_base'),
         ],
+        required_one_of=[
+            ('number', 'numbers', 'approver'),
+        ],
+        mutually_exclusive=[
+            ('number', 'numbers'),
+        ],
     )
 
+    #Requests, retries and backoff time of every call made by this run
+    result["http_stats"] = get_client(**module.params).stats
+
     if module.check_mode:
         module.exit_json(**result)
+    elif not module.params["number"]:
+        results = approve_many(module.params["numbers"], module.params["approver"], **module.params)
+        approved = [r for r in results if r["status_code"] in (200, 201)]
+        result["message"] = results
+        result["changed"] = len(approved) > 0
+
+        if all(r["status_code"] in (200, 201) or r["result"] == "No pending approvals found" for r in results):
+            module.exit_json(**result)
+        else:
+            module.fail_json(msg="Some approvals could not be executed", **result)
     else:
         response = validateOptions(module)
 
-    result["message"] = json.loads(response.text)
+    #Request errors come back as {"mensaje": ...} instead of a response
+    if isinstance(response, dict):
+        result["message"] = response
+        module.fail_json(msg="Response generic error", **result)
+
+    try:
+        result["message"] = json.loads(response.text)
+    except ValueError:
+        result["message"] = response.text
 
     if response.status_code == 200 or response.status_code == 201:
  
@@ -0,0 +1,143 @@
+#!/usr/bin/python
+# coding=utf-8
+
+from __future__ import (absolute_import, division, print_function)
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.sgt_client import get_client, sgt_argument_spec
+from ansible.module_utils.sgt_outbox import SgtOutbox, OutboxBusy, flush
+
+
+###DOCUMENTATION = r'''
+###---
+###module: sgt_outbox
+###
+###short_description: Envia a Service Now las escrituras guardadas en el outbox
+###
+###version_added: "1.0.0"
+###
+###description: sgt_task_update, sgt_release_delegate y sgt_upload con outbox
+###    always u on_failure guardan sus escrituras en cache_dir (outbox.db). Este
+###    modulo las envia en orden y por lotes, juntando las actualizaciones de un
+###    mismo registro en una sola.
+###
+###options:
+###    state:
+###        description:
+###            - flush. Envia las escrituras pendientes de sn_base y sn_user
+###            - status. Cuenta las escrituras por estado (pending, done, failed)
+###            - purge. Borra las escrituras de purge_states
+###        required: false
+###        type: str
+###    batch_size:
+###        description: Escrituras por llamada a la Batch API
+###        required: false
+###        type: int
+###    max_entries:
+###        description: Maximo de escrituras a enviar en un flush
+###        required: false
+###        type: int
+###
+###author:
+###    - Marco Rea (@x25241)
+###'''
+###
+###EXAMPLES = r'''
+###- name: Send the ServiceNow writes queued during the deployment
+###  sgt_outbox:
+###    sn_user: "{{ snow_specs.pre.user }}"
+###    sn_pass: "{{ snow_specs.pre.pass }}"
+###    sn_base: https://santandertest.service-now.com
+###  retries: 10
+###  delay: 60
+###  register: outbox
+###  until: outbox.outbox.pending == 0
+###'''
+###
+###RETURN = r'''
+###message:
+###    description: entries, writes (after merging), done, failed y stopped (motivo
+###        por el que el flush se detuvo, el resto queda para el siguiente)
+###    type: dict
+###outbox:
+###    description: Escrituras por estado tras la accion
+###    type: dict
+###'''
+
+def outbox_counts(**module_args):
+    counts = SgtOutbox(module_args["cache_dir"]).counts(module_args["sn_base"], module_args["sn_user"])
+    return dict((state, counts.get(state, 0)) for state in ("pending", "done", "failed"))
+
+def run_module():
+
+    module_args = {
+        "state": {
+            "default": "flush",
+            "choices": ["flush", "status", "purge"]
+        },
+        "sn_user": {"required": True, "type": "str"},
+        "sn_pass": {"required": True, "type": "str", "no_log": True},
+        "sn_base": {"required": True, "type": "str"},
+        "timeout": {"required": False, "type": "int", "default": 300},
+
+        #For flushing
+        "batch_size": {"type": "int", "default": 50},
+        "batch_uri": {"type": "str", "default": "/api/now/v1/batch"},
+        "max_entries": {"type": "int"},
+        "lookup_workers": {"type": "int", "default": 4},
+
+        #For purging
+        "purge_states": {"type": "list", "elements": "str", "default": ["done"]},
+    }
+
+    module_args.update(sgt_argument_spec())
+
+    result = dict(
+        changed=False,
+        original_message="",
+        message=""
+    )
+
+    module = AnsibleModule(
+        argument_spec=module_args,
+        supports_check_mode=True
+    )
+
+    #Requests, retries and backoff time of every call made by this run
+    result["http_stats"] = get_client(**module.params).stats
+
+    if module.check_mode or module.params["state"] == "status":
+        result["outbox"] = outbox_counts(**module.params)
+        if module.params["state"] == "status":
+            result["message"] = SgtOutbox(module.params["cache_dir"]).failed(module.params["sn_base"], module.params["sn_user"])
+        module.exit_json(**result)
+
+    if module.params["state"] == "purge":
+        result["message"] = {"purged": SgtOutbox(module.params["cache_dir"]).purge(
+            module.params["sn_base"], module.params["sn_user"], module.params["purge_states"])}
+        result["changed"] = result["message"]["purged"] > 0
+        result["outbox"] = outbox_counts(**module.params)
+        module.exit_json(**result)
+
+    try:
+        report = flush(**module.params)
+    except OutboxBusy as e:
+        #Another flush is draining the same outbox, nothing to do here
+        result["message"] = {"stopped": str(e)}
+        result["outbox"] = outbox_counts(**module.params)
+        module.exit_json(**result)
+
+    result["message"] = report
+    result["changed"] = report["done"] > 0 or report["failed"] > 0
+    result["outbox"] = outbox_counts(**module.params)
+
+    #Writes the instance rejected are kept as failed, see state: status
+    if report["failed"]:
+        module.fail_json(msg="Some queued writes were rejected by the instance", **result)
+
+    module.exit_json(**result)
+
+def main():
+    run_module()
+
+if __name__ == '__main__':
+    main()
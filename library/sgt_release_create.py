@@ -3,7 +3,10 @@
 
 from __future__ import (absolute_import, division, print_function)
 from ansible.module_utils.basic import AnsibleModule
-import requests
+from ansible.module_utils.sgt_client import get_client, sgt_argument_spec
+from ansible.module_utils.sgt_cache import lookup_sys_id, remember_response
+from ansible.module_utils.sgt_record import sparse_update
+from ansible.module_utils.sgt_reference import resolve_references
 import json
 import os
 from datetime import datetime
@@ -115,13 +118,12 @@ def info(release_number, **module_args):
     endpoint = module_args["sn_base"] + module_args["sn_uri"] 
     params={
         "sysparm_query": "number="+str(release_number),
-        "sysparm_display_value": "true"
+        "sysparm_fields": "sys_id"
     }
 
     try:
-        response = requests.get(
+        response = get_client(**module_args).get(
             url=endpoint,
-            auth=(module_args["sn_user"], module_args["sn_pass"]),
             params=params,
             timeout=module_args["timeout"]
         )
@@ -134,10 +136,8 @@ def info(release_number, **module_args):
 
     return response
 
-def create(**module_args):
-    response = None
-    endpoint = module_args["sn_base"] + module_args["sn_uri"] 
-    data={
+def release_payload(**module_args):
+    return {
         "parent":                           module_args["parent"],
         "assignment_group":                 module_args["group"],
         "u_requested_group":                module_args["requested_group"],
@@ -156,10 +156,18 @@ def create(**module_args):
         
     }
 
+def create(**module_args):
+    response = None
+    endpoint = module_args["sn_base"] + module_args["sn_uri"] 
+    payloads, errors = resolve_references([release_payload(**dict(module_args, risk=module_args["risk"] or "Low"))], "rm_release", **module_args)
+    data = payloads[0]
+
+    if errors[0]:
+        return {"mensaje": "ERROR, release could not create: " + "; ".join(errors[0])}
+
     try:
-        response = requests.post(
+        response = get_client(**module_args).post(
             url=endpoint,
-            auth=(module_args["sn_user"], module_args["sn_pass"]),
             #params=params,
             data=json.dumps(data),
             timeout=module_args["timeout"]
@@ -169,42 +177,51 @@ def create(**module_args):
         response = {"mensaje": "ERROR, release could not create: " + str(e)}
         #log("ERROR, no se pudo crear la release: " + str(e))
 
+    remember_response(response, **module_args)
+
     return response
 
 def update(release_number, **module_args):
 
-    response_info = info(release_number, **module_args).json()
-    release_id = ""
-    #old_state = ""
-    
-    if len(response_info["result"]) > 0:
-       release_id = response_info["result"][0]["sys_id"]
-       #old_state  = response_info["result"][0]["state"]
+    def fetch():
+        response = info(release_number, **module_args)
+        if isinstance(response, dict):
+            raise IOError(response["mensaje"])
+        if response.status_code != 200:
+            raise IOError("ERROR, release could not get information: "+str(release_number)+": status "+str(response.status_code))
+        records = response.json().get("result", [])
+        if len(records) > 0:
+            return records[0]["sys_id"]
+        return ""
 
-    response = None
-    endpoint = module_args["sn_base"] + module_args["sn_uri"] + "/" + release_id
-    data=module_args
+    try:
+        release_id = lookup_sys_id(release_number, fetch, **module_args)
+    except (IOError, ValueError) as e:
+        return {"mensaje": str(e)}, {}
+
+    if not release_id:
+        return {"mensaje": "ERROR, release could not update, not found: " + str(release_number)}, {}
+
+    endpoint = module_args["sn_base"] + module_args["sn_uri"]
+    payloads, errors = resolve_references([release_payload(**module_args)], "rm_release", **module_args)
+    data = payloads[0]
+    data["work_notes"] = module_args["work_notes"]
+
+    if errors[0]:
+        return {"mensaje": "ERROR, release could not update: " + "; ".join(errors[0])}, {}
 
     try:
-        response = requests.post(
-            url=endpoint,
-            auth=(module_args["sn_user"], module_args["sn_pass"]),
-            #params=params,
-            data=json.dumps(data),
-            timeout=module_args["timeout"]
-        )
+        return sparse_update(endpoint, release_id, data, **module_args)
 
     except Exception as e:
-        response = {"mensaje": "ERROR, release could not update: " + str(e)}
-
-    return response
+        return {"mensaje": "ERROR, release could not update: " + str(e)}, {}
 
 def validateOptions(module):
     
     if module.params["state"] == "present" or module.params["state"] == "create":
         return create(**module.params)
     elif "" != module.params["release"] or module.params["state"] == "update":
-        return update(module.params["release"], **module.params) 
+        return update(module.params["release"], **module.params)[0]
 
 def run_module():
     
@@ -218,7 +235,7 @@ def run_module():
         #Generales
         "sn_user": {"required": True, "type": "str"},
         "sn_pass": {"required": True, "type": "str", "no_log": True},
-        "sn_base": {"required": True, "type": "str", "default":"https://santandertest.service-now.com"},
+        "sn_base": {"required": False, "type": "str", "default":"https://santandertest.service-now.com"},
         "sn_uri":  {"required": False, "type": "str", "default": "/api/now/v2/table/rm_release"},
         "timeout": {"required": False, "type": "int", "default": 300},
         #"filter":  {"required": False, "type": "bool", "default": True},
@@ -233,7 +250,8 @@ def run_module():
         "group":{ "type": "str" },
         "requested_group":{ "type": "str" },
         "reason":{ "type": "str" },
-        "risk":{ "type": "str", "default": "Low" },
+        #Low when creating; updates only write it when given
+        "risk":{ "type": "str" },
         "short_description":{ "type": "str" },
         "description":{ "type": "str" },
         "justification": { "type": "str" },
@@ -248,6 +266,8 @@ def run_module():
         
 }
 
+    module_args.update(sgt_argument_spec())
+
     result = dict(
         changed=False,
         original_message="",
@@ -265,12 +285,31 @@ def run_module():
         ],
     )
 
+    #Requests, retries and backoff time of every call made by this run
+    result["http_stats"] = get_client(**module.params).stats
+
     if module.check_mode:
         module.exit_json(**result)
+    elif module.params["state"] == "update":
+        response, diff = update(module.params["release"], **module.params)
+        result["updated_fields"] = sorted(diff)
+
+        #Nothing differs from the instance, no write was made
+        if not diff and not isinstance(response, dict) and response.status_code == 200:
+            result["message"] = response.json()["result"]
+            module.exit_json(**result)
     else:
         response = validateOptions(module)
 
-    result["message"] = json.loads(response.text)
+    #Request errors come back as {"mensaje": ...} instead of a response
+    if isinstance(response, dict):
+        result["message"] = response
+        module.fail_json(msg="Response generic error", **result)
+
+    try:
+        result["message"] = json.loads(response.text)
+    except ValueError:
+        result["message"] = response.text
 
     if response.status_code == 200 or response.status_code == 201:
  
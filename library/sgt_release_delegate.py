@@ -3,7 +3,9 @@
 
 from __future__ import (absolute_import, division, print_function)
 from ansible.module_utils.basic import AnsibleModule
-import requests
+from ansible.module_utils.sgt_client import get_client, sgt_argument_spec
+from ansible.module_utils.sgt_record import correlation_key, create_once
+from ansible.module_utils.sgt_outbox import through_outbox
 import json
 import os
 from datetime import datetime
@@ -73,14 +75,18 @@ from datetime import datetime
 ###    sample: 'goodbye'
 ###'''
 
+def delegated_test_key(release_number, **module_args):
+    if module_args.get("correlation_key"):
+        return module_args["correlation_key"]
+    if module_args.get("idempotent"):
+        return correlation_key(release_number, module_args["short_description"], module_args["cycle"])
+    return None
+
 def create_delegated_test(release_number, **module_args):
-    response = None
+    # Returns (response, existed) like sgt_task_create.create
+    key = delegated_test_key(release_number, **module_args)
     endpoint = module_args["sn_base"] + module_args["sn_uri"] 
 
-    params={
-        "sysparm_display_value": "true"
-    }
-
     data={
         "u_parent":                         release_number,        
         "u_short_description":              module_args["short_description"],
@@ -89,25 +95,34 @@ def create_delegated_test(release_number, **module_args):
         "u_test_result":                    module_args["test_result"]        
     }
 
-    try:
-        response = requests.post(
-            url=endpoint,
-            auth=(module_args["sn_user"], module_args["sn_pass"]),
-            params=params,
-            data=json.dumps(data),
-            timeout=module_args["timeout"]
-        )
+    #existed is set by create_once when the key is found on the instance
+    existed = [False]
 
-    except Exception as e:
-        response = {"mensaje": "ERROR, delegated task could not created: " + str(e)}
+    def send():
+        try:
+            if key:
+                response, existed[0] = create_once(endpoint, data, key, module_args["correlation_field"], **module_args)
+                return response
+            return get_client(**module_args).post(
+                url=endpoint,
+                data=json.dumps(data),
+                timeout=module_args["timeout"]
+            )
+        except Exception as e:
+            return {"mensaje": "ERROR, delegated task could not created: " + str(e)}
 
+    entry = {"method": "POST", "uri": module_args["sn_uri"], "body": data}
+    if key:
+        entry.update({"body": dict(data, **{module_args["correlation_field"]: key}), "key": key, "key_field": module_args["correlation_field"]})
 
-    return response
+    response = through_outbox(send, "sgt_release_delegate", entry, **module_args)
+
+    return response, existed[0]
 
 def validateOptions(module):
     
-    if module.params["state"] == "delegate_test":
-        module.params["sn_uri"] = "/api/now/v2/table/u_delegated_test"
+    #upload was the old name of the only action of this module
+    if module.params["state"] in ("delegate_test", "upload"):
         return create_delegated_test(module.params["release"], **module.params)
 
 
@@ -115,28 +130,40 @@ def run_module():
     
     module_args = {
         "state": {
-            "default": "upload",
+            "default": "delegate_test",
             "choices": [
-                "upload"
+                "delegate_test", "upload"
             ]
         },
         #Generals
         "sn_user": {"required": True, "type": "str"},
         "sn_pass": {"required": True, "type": "str", "no_log": True},
-        "sn_base": {"required": True, "type": "str", "default":"https://santandertest.service-now.com"},
+        "sn_base": {"required": False, "type": "str", "default":"https://santandertest.service-now.com"},
         "sn_uri":  {"required": False, "type": "str", "default": "/api/now/v2/table/u_delegated_test"},
         "timeout": {"required": False, "type": "int", "default": 300},
         "filter":  {"required": False, "type": "bool", "default": True},
 
         
-        #Para upload file
+        #Para delegated test
         "release":{ "type": "str" }, 
+        "short_description":{ "type": "str" },
+        "description":{ "type": "str" },
         "cycle": {"type":"str", "default": "1"},
         "test_result": {"type":"str", "default": "OK" },
 
+        #Idempotent creates: a test with the same correlation key is not created again
+        "idempotent": {"type": "bool", "default": False},
+        "correlation_key": {"type": "str"},
+        "correlation_field": {"type": "str", "default": "correlation_id"},
+
+        #Writes journaled in cache_dir and sent later by sgt_outbox
+        "outbox": {"type":"str", "default":"never", "choices": ["never", "always", "on_failure"]},
+
         
 }
 
+    module_args.update(sgt_argument_spec())
+
     result = dict(
         changed=False,
         original_message="",
@@ -147,19 +174,37 @@ def run_module():
         argument_spec=module_args,
         supports_check_mode=False,
         required_if=[
-            ('state', 'upload', ('release', 'sn_user', 'sn_pass','sn_base','release'), False),
+            ('state', 'delegate_test', ('release', 'sn_user', 'sn_pass','sn_base'), False),
+            ('state', 'upload', ('release', 'sn_user', 'sn_pass','sn_base'), False),
         ],
         required_together=[
             ('sn_user', 'sn_pass','sn_base'),
         ],
     )
 
+    #Requests, retries and backoff time of every call made by this run
+    result["http_stats"] = get_client(**module.params).stats
+
     if module.check_mode:
         module.exit_json(**result)
     else:
-        response = validateOptions(module)
+        response, result["existing"] = validateOptions(module)
+
+    #Journaled writes are acknowledged, sgt_outbox sends them
+    if isinstance(response, dict) and "queued" in response:
+        result["message"] = response
+        result["changed"] = True
+        module.exit_json(**result)
 
-    result["message"] = json.loads(response.text)
+    #Request errors come back as {"mensaje": ...} instead of a response
+    if isinstance(response, dict):
+        result["message"] = response
+        module.fail_json(msg="Response generic error", **result)
+
+    try:
+        result["message"] = json.loads(response.text)
+    except ValueError:
+        result["message"] = response.text
 
     if response.status_code == 200 or response.status_code == 201:
  
@@ -167,7 +212,7 @@ def run_module():
 
         if "number" in resp["result"] or "sys_id" in resp["result"]:
             result['message'] = resp["result"]
-            result['changed'] = True
+            result['changed'] = not result["existing"]
         else:
             result['message'] = "Action could not be executed: "+module.params["state"]
             result['changed'] = False
@@ -3,9 +3,15 @@
 
 from __future__ import (absolute_import, division, print_function)
 from ansible.module_utils.basic import AnsibleModule
-import requests
+from ansible.module_utils.sgt_client import get_client, sgt_argument_spec
+from ansible.module_utils.sgt_cache import lookup_sys_id, remember_sys_ids
+from ansible.module_utils.sgt_choice import label_records, load_choices
+from ansible.module_utils.sgt_parallel import run_parallel
+from ansible.module_utils.sgt_record import lookup_numbers
+from ansible.module_utils.sgt_task import task_choices
 import json
 import os
+import time
 from datetime import datetime
 
 
@@ -73,33 +79,38 @@ from datetime import datetime
 ###    sample: 'goodbye'
 ###'''
 
+RELEASE_FIELDS = (
+    "sys_id", "number", "state", "company", "parent", "assignment_group", "u_requested_group",
+    "u_reason", "u_risk", "short_description", "description", "u_justification",
+    "u_implementation_plan", "u_preproduction_proposed_date", "u_start_date", "u_end_date",
+    "u_backout_plan", "u_risk_and_impact_analysis", "u_test_plan"
+)
+
+#States of rm_release (those of planned_task), used when sys_choice can not be read
+RELEASE_CHOICES = {
+    "state": {"-5": "Pending", "1": "Open", "2": "Work in Progress", "3": "Closed Complete", "4": "Closed Incomplete", "7": "Closed Skipped"}
+}
+
+OVERVIEW_TASK_FIELDS = ("number", "short_description", "state", "u_state_to_resolve", "assignment_group", "assigned_to", "order")
+OVERVIEW_APPROVAL_FIELDS = ("state", "approver.user_name", "sys_updated_on")
+OVERVIEW_ATTACHMENT_FIELDS = ("file_name", "content_type", "size_bytes", "sys_created_on")
+
+def release_fields(**module_args):
+    if module_args.get("fields"):
+        return list(module_args["fields"])
+    if module_args["filter"]:
+        return list(RELEASE_FIELDS)
+    return None
+
 def show_values(response, other_values, **module_args):
     
     content_json = response.json()
+    fields = release_fields(**module_args)
 
-    if module_args["filter"] and response.status_code in [200,201]:
+    if fields and response.status_code in [200,201] and len(content_json["result"]) > 0:
+        record = content_json["result"][0]
         new_values = {
-            "result":{
-                "sys_id": content_json["result"]["sys_id"],
-                "number": content_json["result"]["number"],
-                "state": content_json["result"]["state"],
-                "company": content_json["result"]["company"],
-                "parent": content_json["result"]["parent"],
-                "assignment_group": content_json["result"]["assignment_group"],
-                "u_requested_group": content_json["result"]["u_requested_group"],
-                "u_reason": content_json["result"]["u_reason"],
-                "u_risk": content_json["result"]["u_risk"],
-                "short_description": content_json["result"]["short_description"],
-                "description": content_json["result"]["description"],
-                "u_justification": content_json["result"]["u_justification"],
-                "u_implementation_plan": content_json["result"]["u_implementation_plan"],
-                "u_preproduction_proposed_date": content_json["result"]["u_preproduction_proposed_date"],
-                "u_start_date": content_json["result"]["u_start_date"],
-                "u_end_date": content_json["result"]["u_end_date"],
-                "u_backout_plan": content_json["result"]["u_backout_plan"],
-                "u_risk_and_impact_analysis": content_json["result"]["u_risk_and_impact_analysis"],
-                "u_test_plan": content_json["result"]["u_test_plan"]
-            }
+            "result": dict((field, record.get(field)) for field in fields)
         }
 
         new_values["result"].update(other_values)
@@ -114,18 +125,32 @@ def info(release_number, **module_args):
     response = None
     endpoint = module_args["sn_base"] + module_args["sn_uri"] 
     params={
-        "sysparm_query": "number="+str(release_number),
-        "sysparm_display_value": "true"
+        "sysparm_query": "number="+str(release_number)
     }
+    fields = release_fields(**module_args)
+
+    #Only the columns that are returned are asked to the instance
+    if fields:
+        params["sysparm_fields"] = ",".join(fields)
+        params["sysparm_exclude_reference_link"] = "true"
+
+    #Display values are expensive on the instance, by default only the choice
+    #labels are put back here
+    if module_args["display_value"]:
+        params["sysparm_display_value"] = "true"
 
     try:
-        response = requests.get(
+        response = get_client(**module_args).get(
             url=endpoint,
-            auth=(module_args["sn_user"], module_args["sn_pass"]),
             params=params,
             timeout=module_args["timeout"]
         )
 
+        if not module_args["display_value"] and response.status_code == 200:
+            content_json = response.json()
+            label_records(content_json["result"], load_choices("rm_release", RELEASE_CHOICES, **module_args))
+            response._content = json.dumps(content_json).encode('utf8')
+
         new_values = show_values(response, { "old_state": "" }, **module_args)
         response._content = json.dumps(new_values).encode('utf8') 
 
@@ -134,10 +159,110 @@ def info(release_number, **module_args):
 
     return response
 
+def info_many(release_list, **module_args):
+    endpoint = module_args["sn_base"] + module_args["sn_uri"]
+    params = {}
+    fields = release_fields(**module_args)
+
+    if fields:
+        params["sysparm_fields"] = ",".join(fields)
+        params["sysparm_exclude_reference_link"] = "true"
+    if module_args["display_value"]:
+        params["sysparm_display_value"] = "true"
+
+    records = lookup_numbers(endpoint, release_list, params, **module_args)
+    found = [r for r in records.values() if r and "mensaje" not in r]
+
+    if found and not module_args["display_value"]:
+        label_records(found, load_choices("rm_release", RELEASE_CHOICES, **module_args))
+
+    for number, record in records.items():
+        if fields and record and "mensaje" not in record:
+            records[number] = dict((field, record.get(field)) for field in fields)
+            records[number]["old_state"] = ""
+
+    return records
+
+def overview(release_number, **module_args):
+    # Release, tasks, approvals and attachments are read concurrently over the
+    # same pooled session, each with only the fields shown. Returns one
+    # document with the time each read took; a failed read holds its error.
+    module_args["pool_maxsize"] = max(module_args.get("pool_maxsize") or 10, 4)
+    client = get_client(**module_args)
+    timeout = module_args["timeout"]
+
+    def read_release():
+        fields = release_fields(**module_args)
+        params = {"sysparm_query": "number="+str(release_number), "sysparm_limit": "1", "sysparm_exclude_reference_link": "true"}
+        if fields:
+            params["sysparm_fields"] = ",".join(fields + [f for f in ("sys_id", "number") if f not in fields])
+
+        records = list(client.iter_records(module_args["sn_base"] + module_args["sn_uri"], params=params, max_records=1, timeout=timeout))
+        remember_sys_ids(records, **module_args)
+        return label_records(records, load_choices("rm_release", RELEASE_CHOICES, **module_args))[0] if records else None
+
+    def read_tasks():
+        params = {"sysparm_query": "top_task.number="+str(release_number), "sysparm_fields": ",".join(OVERVIEW_TASK_FIELDS), "sysparm_exclude_reference_link": "true"}
+        records = list(client.iter_records(module_args["sn_base"] + module_args["tasks_uri"], params=params, timeout=timeout))
+        return label_records(records, task_choices(**module_args))
+
+    def read_approvals():
+        params = {"sysparm_query": "sysapproval.number="+str(release_number), "sysparm_fields": ",".join(OVERVIEW_APPROVAL_FIELDS)}
+        records = list(client.iter_records(module_args["sn_base"] + module_args["approvals_uri"], params=params, timeout=timeout))
+        return label_records(records, load_choices("sysapproval_approver", **module_args))
+
+    def read_attachments():
+        #Attachments hang from the release sys_id, known beforehand when cached
+        def fetch():
+            params = {"sysparm_query": "number="+str(release_number), "sysparm_fields": "sys_id", "sysparm_limit": "1"}
+            records = client.get(module_args["sn_base"] + module_args["sn_uri"], params=params, timeout=timeout).json()["result"]
+            return records[0]["sys_id"] if records else ""
+
+        release_id = lookup_sys_id(release_number, fetch, **module_args)
+        if not release_id:
+            return []
+
+        response = client.get(
+            module_args["sn_base"] + module_args["attachments_uri"],
+            params={"sysparm_query": "table_name=rm_release^table_sys_id="+release_id, "sysparm_fields": ",".join(OVERVIEW_ATTACHMENT_FIELDS)},
+            timeout=timeout
+        )
+        response.raise_for_status()
+        return response.json()["result"]
+
+    def timed(part):
+        name, read = part
+        start = time.time()
+        try:
+            value = read()
+        except Exception as e:
+            value = {"mensaje": "ERROR, "+name+" of release could not get information: "+str(release_number)+": " + str(e)}
+        return name, value, round(time.time() - start, 3)
+
+    start = time.time()
+    parts = run_parallel(timed, [
+        ("release", read_release),
+        ("tasks", read_tasks),
+        ("approvals", read_approvals),
+        ("attachments", read_attachments)
+    ], 4)
+
+    document = dict((name, value) for name, value, elapsed in parts)
+    document["timings"] = dict((name, elapsed) for name, value, elapsed in parts)
+    document["timings"]["total"] = round(time.time() - start, 3)
+
+    return document
+
 def validateOptions(module):
+
+    if module.params["state"] == "overview":
+        return overview(module.params["release"], **module.params)
     
+    if module.params["state"] == "info" and module.params["releases"]:
+        return info_many(module.params["releases"], **module.params)
+
     if module.params["state"] == "info":
-        return info(**module.params)
+        return info(module.params["release"], **module.params)
 
 def run_module():
     
@@ -145,13 +270,13 @@ def run_module():
         "state": {
             "default": "info",
             "choices": [
-                "info"
+                "info", "overview"
             ]
         },
         #Generals
         "sn_user": {"required": True, "type": "str"},
         "sn_pass": {"required": True, "type": "str", "no_log": True},
-        "sn_base": {"required": True, "type": "str", "default":"https://santandertest.service-now.com"},
+        "sn_base": {"required": False, "type": "str", "default":"https://santandertest.service-now.com"},
         "sn_uri":  {"required": False, "type": "str", "default": "/api/now/v2/table/rm_release"},
         "timeout": {"required": False, "type": "int", "default": 300},
         "filter":  {"required": False, "type": "bool", "default": True},
@@ -159,10 +284,23 @@ def run_module():
         
         #For info
         "release":{ "type": "str" },
+        "fields": {"type": "list", "elements": "str"},
+        "display_value": {"type": "bool", "default": False},
+
+        #Many releases at once, read with numberIN queries
+        "releases": {"type": "list", "elements": "str"},
+        "lookup_workers": {"type": "int", "default": 4},
+
+        #For overview
+        "tasks_uri": {"type": "str", "default": "/api/now/v2/table/rm_task"},
+        "approvals_uri": {"type": "str", "default": "/api/now/v2/table/sysapproval_approver"},
+        "attachments_uri": {"type": "str", "default": "/api/now/attachment"},
 
         
 }
 
+    module_args.update(sgt_argument_spec())
+
     result = dict(
         changed=False,
         original_message="",
@@ -173,19 +311,53 @@ def run_module():
         argument_spec=module_args,
         supports_check_mode=False,
         required_if=[
-            ('state', 'info', ('release', 'sn_user', 'sn_pass','sn_base','release'), False),
+            ('state', 'info', ('sn_user', 'sn_pass','sn_base'), False),
+            ('state', 'info', ('release', 'releases'), True),
+            ('state', 'overview', ('release', 'sn_user', 'sn_pass','sn_base'), False),
         ],
         required_together=[
             ('sn_user', 'sn_pass','sn_base'),
         ],
     )
 
+    #Requests, retries and backoff time of every call made by this run
+    result["http_stats"] = get_client(**module.params).stats
+
     if module.check_mode:
+        module.exit_json(**result)
+    elif module.params["state"] == "overview":
+        document = validateOptions(module)
+        result['message'] = document
+
+        if any(isinstance(value, dict) and "mensaje" in value for value in document.values()):
+            module.fail_json(msg="Some parts of the overview could not be read", **result)
+        if document["release"] is None:
+            module.fail_json(msg="Release not found: "+str(module.params["release"]), **result)
+
+        result['changed'] = True
+        module.exit_json(**result)
+    elif module.params["releases"]:
+        records = validateOptions(module)
+        result['message'] = records
+        result['not_found'] = [number for number, record in records.items() if record is None]
+        result['changed'] = any(record is not None for record in records.values())
+
+        if any(record and "mensaje" in record for record in records.values()):
+            module.fail_json(msg="Some releases could not be read", **result)
+
         module.exit_json(**result)
     else:
         response = validateOptions(module)
 
-    result["message"] = json.loads(response.text)
+    #Request errors come back as {"mensaje": ...} instead of a response
+    if isinstance(response, dict):
+        result["message"] = response
+        module.fail_json(msg="Response generic error", **result)
+
+    try:
+        result["message"] = json.loads(response.text)
+    except ValueError:
+        result["message"] = response.text
 
     if response.status_code == 200 or response.status_code == 201:
  
@@ -0,0 +1,188 @@
+#!/usr/bin/python
+# coding=utf-8
+
+from __future__ import (absolute_import, division, print_function)
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.sgt_client import current_budget, get_client, sgt_argument_spec
+from ansible.module_utils.sgt_controller import run_sgt_module
+from ansible.module_utils.sgt_pipeline import run_pipeline, build_graph
+import os
+
+
+###DOCUMENTATION = r'''
+###---
+###module: sgt_release_pipeline
+###
+###short_description: Ejecuta los pasos de una release como un grafo de dependencias
+###
+###version_added: "1.0.0"
+###
+###description: Corre sgt_release_create, sgt_task_create, sgt_release_delegate,
+###    sgt_upload, sgt_approve... en paralelo cuando no dependen entre si. Solo
+###    corre en el controller (action plugin, sgt_controller_mode persistent o local).
+###
+###options:
+###    steps:
+###        description: Lista de pasos {name, module, args, needs}. Un valor
+###            "${paso.campo}" en args toma el resultado de otro paso
+###            (${release.sys_id} es ${release.message.sys_id}) y lo hace dependencia.
+###        required: true
+###        type: list
+###    workers:
+###        description: Pasos en ejecucion a la vez
+###        required: false
+###        type: int
+###
+###author:
+###    - Marco Rea (@x25241)
+###'''
+###
+###EXAMPLES = r'''
+###- name: Release with its tasks, delegated test and evidence
+###  sgt_release_pipeline:
+###    sn_user: "{{ snow_specs.pre.user }}"
+###    sn_pass: "{{ snow_specs.pre.pass }}"
+###    sn_base: https://santandertest.service-now.com
+###    steps:
+###      - name: release
+###        module: sgt_release_create
+###        args: "{{ release_args }}"
+###      - name: task_db
+###        module: sgt_task_create
+###        args: "{{ task_db_args | combine({'release': '${release.number}'}) }}"
+###      - name: task_app
+###        module: sgt_task_create
+###        args: "{{ task_app_args | combine({'release': '${release.number}'}) }}"
+###      - name: test
+###        module: sgt_release_delegate
+###        args: {state: delegate_test, release: "${release.number}"}
+###      - name: evidence
+###        module: sgt_upload
+###        args: {id_record: "${test.sys_id}", filename: evidence.pdf}
+###'''
+###
+###RETURN = r'''
+###steps:
+###    description: Resultado de cada paso por nombre
+###    type: dict
+###pipeline:
+###    description: elapsed, steps_time, critical_path, critical_path_time, timings y started
+###    type: dict
+###'''
+
+STEP_MODULES = (
+    "sgt_release_create", "sgt_release_info", "sgt_release_delegate", "sgt_task_create",
+    "sgt_task_info", "sgt_task_update", "sgt_upload", "sgt_approve"
+)
+
+#Connection options every step gets unless it sets its own
+SHARED_ARGS = ("sn_user", "sn_pass", "sn_base", "timeout") + tuple(sgt_argument_spec())
+
+def step_module_path(step, **module_args):
+    library_dir = module_args["library_dir"] or os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(library_dir, step["module"] + ".py")
+
+def validate_steps(step_list, **module_args):
+    errors = []
+
+    for step in step_list:
+        if step.get("module") not in STEP_MODULES:
+            errors.append("step %s: module must be one of %s" % (step.get("name"), ", ".join(STEP_MODULES)))
+        elif not os.path.isfile(step_module_path(step, **module_args)):
+            errors.append("step %s: %s not found, sgt_release_pipeline runs on the controller only (sgt_controller_mode persistent or local) or needs library_dir" % (step.get("name"), step["module"]))
+
+    try:
+        build_graph(step_list)
+    except ValueError as e:
+        errors.append(str(e))
+
+    return errors
+
+def run_steps(step_list, **module_args):
+    shared = dict((arg, module_args[arg]) for arg in SHARED_ARGS if module_args.get(arg) is not None)
+    shared["pool_maxsize"] = max(module_args.get("pool_maxsize") or 10, module_args["workers"])
+    budget = current_budget()
+
+    def run_step(step, args):
+        step_args = dict(shared)
+        step_args.update(args)
+
+        #Each step gets what is left of the pipeline deadline as its own
+        remaining = budget.remaining() if budget is not None else None
+        if remaining is not None:
+            if remaining <= 0:
+                return {"failed": True, "msg": "Step not started, deadline of %ss exceeded" % budget.deadline}
+            step_args["deadline"] = min(step_args.get("deadline") or remaining, remaining)
+
+        return run_sgt_module(step_module_path(step, **module_args), step_args)
+
+    return run_pipeline(step_list, run_step, module_args["workers"])
+
+def steps_http_stats(steps):
+    # Requests, retries and backoff time of every call made by the steps
+    total = {}
+    for step in steps.values():
+        for name, value in (step.get("http_stats") or {}).items():
+            if isinstance(value, list):
+                total.setdefault(name, []).extend(value)
+            elif isinstance(value, (int, float)):
+                total[name] = round(total.get(name, 0) + value, 3)
+    return total
+
+def run_module():
+
+    module_args = {
+        "sn_user": {"required": True, "type": "str"},
+        "sn_pass": {"required": True, "type": "str", "no_log": True},
+        "sn_base": {"required": True, "type": "str"},
+        "timeout": {"required": False, "type": "int", "default": 300},
+
+        "steps": {"required": True, "type": "list", "elements": "dict"},
+        "workers": {"type": "int", "default": 4},
+        "library_dir": {"type": "path"},
+    }
+
+    module_args.update(sgt_argument_spec())
+
+    result = dict(
+        changed=False,
+        original_message="",
+        message=""
+    )
+
+    module = AnsibleModule(
+        argument_spec=module_args,
+        supports_check_mode=True
+    )
+
+    errors = validate_steps(module.params["steps"], **module.params)
+    if errors:
+        module.fail_json(msg="Invalid pipeline: " + "; ".join(errors), **result)
+
+    #Check mode only validates the plan, the steps need each other's results
+    if module.check_mode:
+        result["message"] = "Pipeline plan is valid: %d steps" % len(module.params["steps"])
+        module.exit_json(**result)
+
+    #Starts the pipeline deadline; every step runs with its own http_stats
+    get_client(**module.params)
+
+    steps, report = run_steps(module.params["steps"], **module.params)
+    result["http_stats"] = steps_http_stats(steps)
+    result["steps"] = steps
+    result["pipeline"] = report
+    result["changed"] = any(step.get("changed") for step in steps.values())
+
+    failed = sorted(name for name, step in steps.items() if step.get("failed") or step.get("skipped"))
+    if failed:
+        module.fail_json(msg="Pipeline steps did not succeed: " + ", ".join(failed), **result)
+
+    result["message"] = "Pipeline finished in %ss, critical path %s (%ss)" % (
+        report["elapsed"], " -> ".join(report["critical_path"]), report["critical_path_time"])
+    module.exit_json(**result)
+
+def main():
+    run_module()
+
+if __name__ == '__main__':
+    main()
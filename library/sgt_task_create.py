@@ -4,7 +4,10 @@
 # GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
 from __future__ import (absolute_import, division, print_function)
 from ansible.module_utils.basic import AnsibleModule
-import requests
+from ansible.module_utils.sgt_client import get_client, sgt_argument_spec
+from ansible.module_utils.sgt_cache import lookup_sys_id, remember_response, remember_sys_ids
+from ansible.module_utils.sgt_record import correlation_key, create_once, key_lookup, sparse_update
+from ansible.module_utils.sgt_reference import resolve_references
 import json
 from datetime import datetime
 
@@ -73,15 +76,17 @@ from datetime import datetime
 ###    sample: 'goodbye'
 ###'''
 
+TASK_REQUIRED_ARGS = ('release', 'start_date', 'end_date', 'short_description', 'state_resolve', 'type', 'application', 'group', 'description', 'technology')
+TASK_ITEM_ARGS = TASK_REQUIRED_ARGS + ('order', 'version', 'correlation_key')
+
 def info(task_number, **module_args):
     response = None
     endpoint = module_args["sn_base"] + module_args["sn_uri"] 
     params={"sysparm_query": "number="+str(task_number) }
 
     try:
-        response = requests.get(
+        response = get_client(**module_args).get(
             url=endpoint,
-            auth=(module_args["sn_user"], module_args["sn_pass"]),
             params=params,
             timeout=module_args["timeout"]
         )
@@ -92,10 +97,8 @@ def info(task_number, **module_args):
 
     return response
 
-def create(release_number, **module_args):
-    response = None
-    endpoint = module_args["sn_base"] + module_args["sn_uri"] 
-    data={
+def task_payload(release_number, **module_args):
+    return {
         "top_task":             release_number,
         "u_release":            release_number,
         "start_date":           module_args["start_date"],
@@ -111,64 +114,193 @@ def create(release_number, **module_args):
         "u_application":        module_args["application"]
     }
 
+def task_key(release_number, **module_args):
+    # None when creates are not idempotent for this task
+    if module_args.get("correlation_key"):
+        return module_args["correlation_key"]
+    if module_args.get("idempotent"):
+        return correlation_key(release_number, module_args["short_description"], module_args["order"])
+    return None
+
+def create(release_number, **module_args):
+    # Returns (response, existed); existed is True when the correlation key
+    # matched a task created before and nothing was written
+    response = None
+    existed = False
+    endpoint = module_args["sn_base"] + module_args["sn_uri"] 
+    payloads, errors = resolve_references([task_payload(release_number, **module_args)], "rm_task", **module_args)
+    data = payloads[0]
+    key = task_key(release_number, **module_args)
+
+    if errors[0]:
+        return {"mensaje": "ERROR, task could not created in release: "+str(release_number)+": " + "; ".join(errors[0])}, False
+
     try:
-        response = requests.post(
-            url=endpoint,
-            auth=(module_args["sn_user"], module_args["sn_pass"]),
-            #params=params,
-            data=json.dumps(data),
-            timeout=module_args["timeout"]
-        )
+        if key:
+            response, existed = create_once(endpoint, data, key, module_args["correlation_field"], **module_args)
+        else:
+            response = get_client(**module_args).post(
+                url=endpoint,
+                #params=params,
+                data=json.dumps(data),
+                timeout=module_args["timeout"]
+            )
 
     except Exception as e:
         response = {"mensaje": "ERROR, task could not created in release: "+str(release_number)+": " + str(e)}
 
-    return response
+    remember_response(response, **module_args)
+
+    return response, existed
+
+def existing_tasks(keys, **module_args):
+    # One fieldIN query per chunk of correlation keys
+    endpoint = module_args["sn_base"] + module_args["sn_uri"]
+    params = {"sysparm_exclude_reference_link": "true"}
+
+    try:
+        return key_lookup(endpoint, keys, module_args["correlation_field"], params, **module_args)
+    except ValueError as e:
+        return dict((key, {"mensaje": str(e)}) for key in keys)
+
+def task_errors(task, task_args):
+    # Items of tasks only take the task options, and with the module level
+    # values they must give everything a single create needs
+    errors = ["unknown option " + key for key in sorted(task) if key not in TASK_ITEM_ARGS]
+    missing = [arg for arg in TASK_REQUIRED_ARGS if task_args[arg] is None]
+    if missing:
+        errors.append("missing " + ", ".join(missing))
+    return errors
+
+def create_many(task_list, **module_args):
+    # Every item of task_list uses the same option names as a single create; missing
+    # keys fall back to the module level values (e.g. one release for all tasks).
+    results = [None] * len(task_list)
+    batch_size = max(module_args["batch_size"], 1)
+    endpoint = module_args["sn_base"] + module_args["batch_uri"]
+
+    task_args = []
+    for task in task_list:
+        args = dict(module_args)
+        args.update(task)
+        task_args.append(args)
+    invalid = [task_errors(task, args) for task, args in zip(task_list, task_args)]
+
+    #Names of every task are resolved together, tasks with unknown ones are not sent
+    payloads = [task_payload(args["release"], **args) for args in task_args]
+    payloads, errors = resolve_references(payloads, "rm_task", **module_args)
+    errors = [invalid[idx] or errors[idx] for idx in range(len(payloads))]
+    pending = []
+
+    #Tasks with a correlation key are looked up together and only the missing ones are sent
+    keys = [None if invalid[idx] else task_key(args["release"], **args) for idx, args in enumerate(task_args)]
+
+    existing = existing_tasks([key for key in keys if key], **module_args) if any(keys) else {}
+    seen = {}
+
+    for idx, payload in enumerate(payloads):
+        key = keys[idx]
+        if errors[idx]:
+            results[idx] = {"status_code": None, "result": {"mensaje": "ERROR, task could not created: " + "; ".join(errors[idx])}}
+        elif key and existing.get(key):
+            results[idx] = {"status_code": 200 if "mensaje" not in existing[key] else None, "result": existing[key], "existing": True}
+        elif key and key in seen:
+            #Same task twice in the list, it is created once
+            continue
+        else:
+            if key:
+                payload[module_args["correlation_field"]] = key
+                seen[key] = idx
+            pending.append(idx)
+
+    for start in range(0, len(pending), batch_size):
+        chunk = pending[start:start + batch_size]
+        rest_requests = [{"method": "POST", "url": module_args["sn_uri"], "body": payloads[idx]} for idx in chunk]
+
+        try:
+            responses = get_client(**module_args).batch(
+                endpoint,
+                rest_requests,
+                timeout=module_args["timeout"]
+            )
+
+        except Exception as e:
+            responses = [
+                {"status_code": None, "body": {"mensaje": "ERROR, task could not created in batch: " + str(e)}}
+                for _ in chunk
+            ]
+
+            #The batch may have been processed before failing, keyed tasks say so
+            chunk_keys = [keys[idx] for idx in chunk if keys[idx]]
+            if chunk_keys:
+                created = existing_tasks(chunk_keys, **module_args)
+                for pos, idx in enumerate(chunk):
+                    record = created.get(keys[idx]) if keys[idx] else None
+                    if record and "mensaje" not in record:
+                        responses[pos] = {"status_code": 201, "body": {"result": record}}
+
+        for idx, response in zip(chunk, responses):
+            body = response["body"] or {}
+            results[idx] = {
+                "status_code": response["status_code"],
+                "result": body.get("result", body)
+            }
+
+    for idx, key in enumerate(keys):
+        if results[idx] is None:
+            results[idx] = dict(results[seen[key]], existing=True)
+
+    remember_sys_ids([r["result"] for r in results], **module_args)
+
+    return results
 
 def update(task_number, **module_args):
 
-    response_info = info(task_number, **module_args).json()
-    task_id = ""
-    #old_state = ""
-    
-    if len(response_info["result"]) > 0:
-       task_id = response_info["result"][0]["sys_id"]
-       #old_state  = response_info["result"][0]["state"]
+    def fetch():
+        response = info(task_number, **module_args)
+        if isinstance(response, dict):
+            raise IOError(response["mensaje"])
+        if response.status_code != 200:
+            raise IOError("ERROR, task could not get information: "+str(task_number)+": status "+str(response.status_code))
+        records = response.json().get("result", [])
+        if len(records) > 0:
+            return records[0]["sys_id"]
+        return ""
 
-    response = None
-    endpoint = module_args["sn_base"] + module_args["sn_uri"] + "/" + task_id
-    data=module_args
+    try:
+        task_id = lookup_sys_id(task_number, fetch, **module_args)
+    except (IOError, ValueError) as e:
+        return {"mensaje": str(e)}, {}
+
+    if not task_id:
+        return {"mensaje": "ERROR, task could not update, not found: " + str(task_number)}, {}
+
+    endpoint = module_args["sn_base"] + module_args["sn_uri"]
+    payloads, errors = resolve_references([task_payload(module_args["release"], **module_args)], "rm_task", **module_args)
+    data = payloads[0]
+
+    if errors[0]:
+        return {"mensaje": "ERROR, task could not update: " + "; ".join(errors[0])}, {}
 
     try:
-        response = requests.post(
-            url=endpoint,
-            auth=(module_args["sn_user"], module_args["sn_pass"]),
-            #params=params,
-            data=json.dumps(data),
-            timeout=module_args["timeout"]
-        )
+        return sparse_update(endpoint, task_id, data, **module_args)
 
     except Exception as e:
-        response = {"mensaje": "ERROR, task could not update: " + str(e)}
-
-    return response
+        return {"mensaje": "ERROR, task could not update: " + str(e)}, {}
 
 def validateOptions(module):
 
     if module.params["state"] == "present" or module.params["state"] == "create":
-        return create(module.params["release"], **module.params)
-
-    if module.params["state"] == "present" or module.params["state"] == "create":
-        return create(**module.params)
-    elif "" != module.params["task"] or module.params["state"] == "update":
-        return update(module.params["release"], **module.params) 
+        return create(module.params["release"], **module.params)[0]
+    elif module.params["state"] == "update":
+        return update(module.params["task"], **module.params)[0]
 
 def run_module():
     
     module_args = {
         "state": {
             "default": "present",
-            "choices": ["present", "create"]
+            "choices": ["present", "create", "update"]
         },
         "sn_user": {"required": False, "type": "str"},
         "sn_pass": {"required": False, "type": "str", "no_log": True},
@@ -193,8 +325,20 @@ def run_module():
         "technology":{ "type": "str" },
         "version":{ "type": "str" },
 
+        #Idempotent creates: a task with the same correlation key is not created again
+        "idempotent": {"type": "bool", "default": False},
+        "correlation_key": {"type": "str"},
+        "correlation_field": {"type": "str", "default": "correlation_id"},
+
+        #For creating many tasks through the Batch API
+        "tasks": {"type": "list", "elements": "dict"},
+        "batch_size": {"type": "int", "default": 50},
+        "batch_uri": {"type": "str", "default": "/api/now/v1/batch"},
+
     }
 
+    module_args.update(sgt_argument_spec())
+
     result = dict(
         changed=False,
         original_message="",
@@ -205,16 +349,55 @@ def run_module():
         argument_spec=module_args,
         supports_check_mode=False,
         required_if=[
-            ('state', 'present', ('release', 'start_date', 'end_date', 'short_description', 'state_resolve', 'type', 'application' ,'group', 'description', 'technology', 'sn_user', 'sn_pass','sn_base'), False)
+            ('state', 'present', ('sn_user', 'sn_pass','sn_base'), False),
+            ('state', 'update', ('task', 'sn_user', 'sn_pass','sn_base'), False)
         ]   
     )
 
+    if module.params["tasks"] and module.params["state"] not in ("present", "create"):
+        module.fail_json(msg="tasks can only be used with state present or create", **result)
+
+    if module.params["state"] == "present" and not module.params["tasks"]:
+        missing = [arg for arg in TASK_REQUIRED_ARGS if module.params[arg] is None]
+        if missing:
+            module.fail_json(msg="state is present but all of the following are missing: " + ", ".join(missing), **result)
+
+    #Requests, retries and backoff time of every call made by this run
+    result["http_stats"] = get_client(**module.params).stats
+
     if module.check_mode:
         module.exit_json(**result)
+    elif module.params["tasks"]:
+        results = create_many(module.params["tasks"], **module.params)
+        result["message"] = results
+        result["changed"] = any(r["status_code"] in (200, 201) and not r.get("existing") for r in results)
+
+        if all(r["status_code"] in (200, 201) for r in results):
+            module.exit_json(**result)
+        else:
+            module.fail_json(msg="Some tasks could not be created", **result)
+    elif module.params["state"] == "update":
+        response, diff = update(module.params["task"], **module.params)
+        result["updated_fields"] = sorted(diff)
+
+        #Nothing differs from the instance, no write was made
+        if not diff and not isinstance(response, dict) and response.status_code == 200:
+            result["message"] = response.json()["result"]
+            module.exit_json(**result)
+    elif module.params["state"] in ("present", "create"):
+        response, result["existing"] = create(module.params["release"], **module.params)
     else:
         response = validateOptions(module)
 
-    result["message"] = json.loads(response.text)
+    #Request errors come back as {"mensaje": ...} instead of a response
+    if isinstance(response, dict):
+        result["message"] = response
+        module.fail_json(msg="Response generic error", **result)
+
+    try:
+        result["message"] = json.loads(response.text)
+    except ValueError:
+        result["message"] = response.text
     #result["message"] = json.loads(response.json())
 
     if response.status_code == 200 or response.status_code == 201:
@@ -234,7 +417,7 @@ def run_module():
 
             if "number" in resp["result"] or "sys_id" in resp["result"]:
                 result['message'] = resp["result"]
-                result['changed'] = True
+                result['changed'] = not result.get("existing")
             else:
                 result['message'] = "Action could not be executed: "+module.params["state"]
                 result['changed'] = False
@@ -4,7 +4,11 @@
 # GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
 from __future__ import (absolute_import, division, print_function)
 from ansible.module_utils.basic import AnsibleModule
-import requests
+from ansible.module_utils.sgt_client import get_client, sgt_argument_spec
+from ansible.module_utils.sgt_cache import remember_response, remember_sys_ids
+from ansible.module_utils.sgt_choice import label_records
+from ansible.module_utils.sgt_record import lookup_numbers
+from ansible.module_utils.sgt_task import TASK_STATE_RESOLVE_CODES, all_tasks_query, task_choices, tasks_stats
 import json
 from datetime import datetime
 
@@ -73,18 +77,19 @@ from datetime import datetime
 ###    sample: 'goodbye'
 ###'''
 
-TASK_STATE_CODES = { "open": 1, "pending": 5, "in_progress": 2, "closed": 3, "incomplete": 4,  "skipped": 7, "all":""  }
-TASK_STATE_RESOLVE_CODES = { "pre-production":15, "implement":9, "all":"" }
-
 def info(task_number, **module_args):
     response = None
     endpoint = module_args["sn_base"] + module_args["sn_uri"] 
     params={"sysparm_query": "number="+str(task_number) }
 
+    #Only the requested columns are asked to the instance
+    if module_args["fields"]:
+        params["sysparm_fields"] = ",".join(module_args["fields"])
+        params["sysparm_exclude_reference_link"] = "true"
+
     try:
-        response = requests.get(
+        response = get_client(**module_args).get(
             url=endpoint,
-            auth=(module_args["sn_user"], module_args["sn_pass"]),
             params=params,
             timeout=module_args["timeout"]
         )
@@ -93,50 +98,71 @@ def info(task_number, **module_args):
         response = {"mensaje": "ERROR, task could not get information: "+str(task_number)+": " + str(e)}
         #log("ERROR, no se pudo crear la release: " + str(e))
 
+    remember_response(response, **module_args)
+
     return response
 
-def info_all_tasks(release_number, **module_args):
-    response = None
-    endpoint = module_args["sn_base"] + module_args["sn_uri"] 
-    q="top_task.number="+str(release_number)+"^state=^u_state_to_resolve="
+def info_many(task_list, **module_args):
+    endpoint = module_args["sn_base"] + module_args["sn_uri"]
+    params = {}
 
-    if module_args["state_resolve"] == "all":
-        q = q.replace("^u_state_to_resolve=", TASK_STATE_RESOLVE_CODES[ module_args["state_resolve"] ])
-    else:     
-        q = q.replace("^u_state_to_resolve=", "^u_state_to_resolve="+str( TASK_STATE_RESOLVE_CODES[ module_args["state_resolve"] ] ))
-    
-    if module_args["info_tasks_filter"] == "all":       
-        q = q.replace("^state=", TASK_STATE_CODES[ module_args["info_tasks_filter"] ])
-    else:
-        q = q.replace("^state=", "^state="+str( TASK_STATE_CODES[ module_args["info_tasks_filter"] ] ))
+    if module_args["fields"]:
+        params["sysparm_fields"] = ",".join(module_args["fields"])
+        params["sysparm_exclude_reference_link"] = "true"
+
+    records = lookup_numbers(endpoint, task_list, params, **module_args)
+    remember_sys_ids([r for r in records.values() if r and "sys_id" in r], **module_args)
 
+    return records
+
+def iter_all_tasks(release_number, **module_args):
+    endpoint = module_args["sn_base"] + module_args["sn_uri"] 
     params={
-        "sysparm_display_value": "true",
-        "sysparm_query": q,
+        "sysparm_query": all_tasks_query(release_number, **module_args),
         "sysparm_fields": "number,u_state_to_resolve,state,sys_id"
     }
 
+    return get_client(**module_args).iter_records(
+        endpoint,
+        params=params,
+        page_size=module_args["page_size"],
+        max_records=module_args["max_records"],
+        timeout=module_args["timeout"]
+    )
+
+def info_all_tasks(release_number, **module_args):
+    records = []
+
     try:
-        response = requests.get(
-            url=endpoint,
-            auth=(module_args["sn_user"], module_args["sn_pass"]),
-            params=params,
-            timeout=module_args["timeout"]
-        )
+        for record in iter_all_tasks(release_number, **module_args):
+            records.append(record)
 
     except Exception as e:
-        response = {"mensaje": "ERROR, no se pudo obtener información de las tasks asociadas a "+str(release_number)+": " + str(e)}
+        return {"mensaje": "ERROR, no se pudo obtener información de las tasks asociadas a "+str(release_number)+": " + str(e)}
 
-    return response
+    remember_sys_ids(records, **module_args)
+
+    #Raw values are read and the labels are put back from the choice lists
+    return label_records(records, task_choices(**module_args))
 
 def validateOptions(module):
     
+    if module.params["state"] == "info" and module.params["tasks"]:
+        return info_many(module.params["tasks"], **module.params)
+
     if module.params["state"] == "info":
         return info(module.params["task"], **module.params)
 
     if module.params["state"] == "info_tasks":
         return info_all_tasks(module.params["release"], **module.params)
 
+    if module.params["state"] == "stats":
+        releases = module.params["releases"] or [module.params["release"]]
+        try:
+            return tasks_stats(releases, **module.params)
+        except Exception as e:
+            return {"mensaje": "ERROR, no se pudo obtener el conteo de tasks de "+", ".join(releases)+": " + str(e)}
+
 
 
 def run_module():
@@ -144,7 +170,7 @@ def run_module():
     module_args = {
         "state": {
             "default": "present",
-            "choices": ["info", "info_tasks"]
+            "choices": ["info", "info_tasks", "stats"]
         },
         "sn_user": {"required": False, "type": "str"},
         "sn_pass": {"required": False, "type": "str", "no_log": True},
@@ -154,14 +180,28 @@ def run_module():
 
         #Para info, work in progress, complete task
         "task": {"type": "str"},
+        "fields": {"type": "list", "elements": "str"},
+
+        #Many tasks at once, read with numberIN queries
+        "tasks": {"type": "list", "elements": "str"},
+        "lookup_workers": {"type": "int", "default": 4},
 
         #Para info tasks
         "release":{ "type": "str" }, 
         "info_tasks": {"type":"str"},
-        "info_tasks_filter": {"type":"str", "default":"open"}
+        "info_tasks_filter": {"type":"str"},
+        "state_resolve": {"type":"str", "default":"all", "choices": list(TASK_STATE_RESOLVE_CODES)},
+        "page_size": {"type":"int", "default": 1000},
+        "max_records": {"type":"int"},
+
+        #Para stats, conteos por release/state/state to resolve
+        "releases": {"type": "list", "elements": "str"},
+        "stats_uri": {"type": "str", "default": "/api/now/stats/rm_task"}
 
     }
 
+    module_args.update(sgt_argument_spec())
+
     result = dict(
         changed=False,
         original_message="",
@@ -172,17 +212,70 @@ def run_module():
         argument_spec=module_args,
         supports_check_mode=False,
         required_if=[
-            ('state', 'info', ('task', 'sn_user', 'sn_pass','sn_base') ),
-            ('state', 'info', ('task', 'sn_user', 'sn_pass','sn_base') )
+            ('state', 'info', ('sn_user', 'sn_pass','sn_base') ),
+            ('state', 'info', ('task', 'tasks'), True)
         ]   
     )
 
+    #stats counts every state unless asked otherwise, info_tasks only the open tasks
+    if module.params["info_tasks_filter"] is None:
+        module.params["info_tasks_filter"] = "all" if module.params["state"] == "stats" else "open"
+
+    if module.params["state"] == "stats" and not (module.params["release"] or module.params["releases"]):
+        module.fail_json(msg="state is stats but any of the following are missing: release, releases", **result)
+
+    #Requests, retries and backoff time of every call made by this run
+    result["http_stats"] = get_client(**module.params).stats
+
     if module.check_mode:
+        module.exit_json(**result)
+    elif module.params["state"] == "stats":
+        stats = validateOptions(module)
+
+        if "mensaje" in stats:
+            result['message'] = stats
+            module.fail_json(msg="Response generic error", **result)
+
+        result['message'] = stats
+        result['changed'] = False
+        module.exit_json(**result)
+    elif module.params["state"] == "info" and module.params["tasks"]:
+        records = validateOptions(module)
+        result['message'] = records
+        result['not_found'] = [number for number, record in records.items() if record is None]
+        result['changed'] = any(record is not None for record in records.values())
+
+        if any(record and "mensaje" in record for record in records.values()):
+            module.fail_json(msg="Some tasks could not be read", **result)
+
+        module.exit_json(**result)
+    elif module.params["state"] == "info_tasks":
+        records = validateOptions(module)
+
+        if isinstance(records, dict):
+            result['message'] = records
+            module.fail_json(msg="Response generic error", **result)
+
+        if len(records) > 0:
+            result['message'] = records
+            result['changed'] = True
+        else:
+            result['message'] = "No records found!"
+            result['changed'] = False
+
         module.exit_json(**result)
     else:
         response = validateOptions(module)
 
-    result["message"] = json.loads(response.text)
+    #Request errors come back as {"mensaje": ...} instead of a response
+    if isinstance(response, dict):
+        result["message"] = response
+        module.fail_json(msg="Response generic error", **result)
+
+    try:
+        result["message"] = json.loads(response.text)
+    except ValueError:
+        result["message"] = response.text
     #result["message"] = json.loads(response.json())
 
     if response.status_code == 200 or response.status_code == 201:
@@ -4,7 +4,13 @@
 # GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
 from __future__ import (absolute_import, division, print_function)
 from ansible.module_utils.basic import AnsibleModule
-import requests
+from ansible.module_utils.sgt_client import get_client, sgt_argument_spec
+from ansible.module_utils.sgt_cache import cached_sys_id, lookup_sys_id, remember_sys_ids
+from ansible.module_utils.sgt_outbox import through_outbox
+from ansible.module_utils.sgt_parallel import parallel_map
+from ansible.module_utils.sgt_reference import resolve_references
+from ansible.module_utils.sgt_choice import choice_label, choice_value
+from ansible.module_utils.sgt_task import TASK_STATE_CODES, TASK_STATE_RESOLVE_CODES, all_tasks_query, task_choices, task_state_code
 import json
 from datetime import datetime
 
@@ -73,6 +79,7 @@ from datetime import datetime
 ###    sample: 'goodbye'
 ###'''
 
+#Used when the instance's u_close_code choices can not be read
 ALLOW_CLOSE_CODES = ("Successful", "Successful automatic", "Successful with issues", "Unsuccessful", "Cancelled", "Rejected")
 
 def info(task_number, **module_args):
@@ -81,9 +88,8 @@ def info(task_number, **module_args):
     params={"sysparm_query": "number="+str(task_number) }
 
     try:
-        response = requests.get(
+        response = get_client(**module_args).get(
             url=endpoint,
-            auth=(module_args["sn_user"], module_args["sn_pass"]),
             params=params,
             timeout=module_args["timeout"]
         )
@@ -93,73 +99,168 @@ def info(task_number, **module_args):
 
     return response
 
+def task_sys_id(task_number, **module_args):
+
+    def fetch():
+        response = info(task_number, **module_args)
+        if isinstance(response, dict):
+            raise IOError(response["mensaje"])
+        if response.status_code != 200:
+            raise IOError("ERROR, task could not get information: "+str(task_number)+": status "+str(response.status_code))
+        records = response.json().get("result", [])
+        if len(records) > 0:
+            return records[0]["sys_id"]
+        return ""
+
+    return lookup_sys_id(task_number, fetch, **module_args)
+
 def update_task(task_number, task_id, data, **module_args):
-    response = None
-    endpoint = module_args["sn_base"] + module_args["sn_uri"] + "/" + task_id
+    endpoint = module_args["sn_base"] + module_args["sn_uri"] + "/" + (task_id or "")
 
     if "work_notes" in module_args:
         data.update({ "work_notes": module_args["work_notes"] })
 
-    try:
-        response = requests.put(
-            url=endpoint,
-            auth=(module_args["sn_user"], module_args["sn_pass"]),
-            data=json.dumps(data),
-            timeout=module_args["timeout"]
-        )
+    def send():
+        #Without sys_id (instance down) the write can only go to the outbox
+        if task_id is None:
+            return {"mensaje": "ERROR, task sys_id could not get: "+str(task_number)}
+        try:
+            return get_client(**module_args).put(
+                url=endpoint,
+                data=json.dumps(data),
+                timeout=module_args["timeout"]
+            )
+        except Exception as e:
+            return {"mensaje": "ERROR, task could not updated: "+str(task_number)+": " + str(e)}
 
-    except Exception as e:
-        response = {"mensaje": "ERROR, task could not updated: "+str(task_number)+": " + str(e)}
-        
-    return response
+    #The outbox keeps the number too, sgt_outbox looks the sys_id up when missing
+    entry = {"method": "PUT", "uri": module_args["sn_uri"], "body": data, "target": task_id, "number": task_number,
+             "barrier": module_args["state"] in module_args["ordered_states"]}
+    return through_outbox(send, "sgt_task_update", entry, **module_args)
 
 
-def validateOptions(module):
-    
+def journaled(module):
+    # The write goes to the outbox without trying the instance
+    return module.params["outbox"] in ("always", "buffer")
+
+def module_choices(module):
+    # Journaled writes only use the cached (or built-in) choices, queuing
+    # never waits for the instance
+    return task_choices(cached_only=journaled(module), **module.params)
+
+def transition_data(module, choices):
+    # States and close codes are sent as the raw values of the instance's
+    # choice lists. Journaled writes keep labels and names instead, sgt_outbox
+    # translates and resolves them when flushing.
     if module.params["state"] == "in_progress":
 
         module.params["status"] = "Work in Progress"
-        response = info(module.params["task"], **module.params).json()
-        task_id = ""
-        data={
-            "state": module.params["status"],
+        data = {
+            "state": task_state_code("in_progress", choices),
             "assigned_to": module.params["assigned_to"]
         }
-        
-        if len(response["result"]) > 0:
-            task_id = response["result"][0]["sys_id"]
-            
-        
-        return update_task(module.params["task"], task_id, data, **module.params)
+
+        if journaled(module):
+            data["state"] = choice_label(choices, "state", data["state"])
+            return data
+
+        payloads, errors = resolve_references([data], "rm_task", **module.params)
+
+        if errors[0]:
+            return {"mensaje": "ERROR, task could not be assigned: " + "; ".join(errors[0])}
+        return payloads[0]
     
-    else:
+    if module.params["state"] == "closed":
+        module.params["status"] = "Closed Complete"
     
-        if module.params["state"] == "closed":
-            module.params["status"] = "Closed Complete"
-        
-        if module.params["state"] == "incomplete":
-            module.params["status"] = "Closed Incomplete"
-        
-        if module.params["state"] == "skipped":
-            module.params["status"] = "skipped"
-        
-        if module.params["close_code"] not in ALLOW_CLOSE_CODES:
-            return {"result": {"mensaje":"close_code does not meet with catalog codes" } }
-        
-        response = info(module.params["task"], **module.params).json()
-        task_id = ""
-        data={
-            "state": module.params["status"],
-            "u_close_code": module.params["close_code"],
-            "close_notes": module.params["close_notes"]
-        }
+    if module.params["state"] == "incomplete":
+        module.params["status"] = "Closed Incomplete"
+    
+    if module.params["state"] == "skipped":
+        module.params["status"] = "skipped"
 
-        
-        if len(response["result"]) > 0:
-            task_id = response["result"][0]["sys_id"]
-            
-        
-        return update_task(module.params["task"], task_id, data, **module.params)
+    data = {
+        "state": task_state_code(module.params["state"], choices),
+        "u_close_code": choice_value(choices, "u_close_code", module.params["close_code"], module.params["close_code"]),
+        "close_notes": module.params["close_notes"]
+    }
+
+    if journaled(module):
+        data["state"] = choice_label(choices, "state", data["state"])
+        data["u_close_code"] = choice_label(choices, "u_close_code", data["u_close_code"])
+    return data
+
+def valid_close_code(module, choices):
+    if module.params["state"] == "in_progress":
+        return True
+
+    if choices.get("u_close_code"):
+        return choice_value(choices, "u_close_code", module.params["close_code"]) is not None
+
+    return module.params["close_code"] in ALLOW_CLOSE_CODES
+
+def update_release_tasks(release_number, data, **module_args):
+    # Every rm_task of the release matching info_tasks_filter/state_resolve gets
+    # the same transition; the sys_ids come from the query itself
+    endpoint = module_args["sn_base"] + module_args["sn_uri"]
+    params={
+        "sysparm_query": all_tasks_query(release_number, **module_args),
+        "sysparm_fields": "number,sys_id"
+    }
+
+    try:
+        tasks = list(get_client(**module_args).iter_records(endpoint, params=params, timeout=module_args["timeout"]))
+    except Exception as e:
+        return [{"number": None, "status_code": None, "result": {"mensaje": "ERROR, tasks of release could not get: "+str(release_number)+": " + str(e)}}]
+
+    remember_sys_ids(tasks, **module_args)
+
+    workers = max(module_args["update_workers"], 1)
+    module_args["pool_maxsize"] = max(module_args.get("pool_maxsize") or 10, workers)
+
+    def update_one(task):
+        response = update_task(task["number"], task["sys_id"], dict(data), **module_args)
+        item = {"number": task["number"], "sys_id": task["sys_id"], "status_code": None}
+
+        if isinstance(response, dict):
+            item["result"] = response
+            item["queued"] = "queued" in response
+        else:
+            item["status_code"] = response.status_code
+            try:
+                item["result"] = response.json().get("result", response.text)
+            except ValueError:
+                item["result"] = response.text
+
+        return item
+
+    return parallel_map(update_one, tasks, workers, **module_args)
+
+def validateOptions(module):
+    choices = module_choices(module)
+
+    if not valid_close_code(module, choices):
+        return {"result": {"mensaje":"close_code does not meet with catalog codes" } }
+
+    data = transition_data(module, choices)
+    if "mensaje" in data:
+        return data
+
+    #With the outbox the instance may be down: known sys_id or the number only
+    if module.params["outbox"] in ("always", "buffer"):
+        task_id = cached_sys_id(module.params["task"], **module.params)
+    else:
+        try:
+            task_id = task_sys_id(module.params["task"], **module.params)
+        except Exception as e:
+            if module.params["outbox"] != "on_failure":
+                return {"mensaje": str(e)}
+            task_id = None
+        #"" is a number the instance does not have, not a missing sys_id
+        if task_id == "":
+            return {"mensaje": "ERROR, task could not update, not found: "+str(module.params["task"])}
+
+    return update_task(module.params["task"], task_id, data, **module.params)
     
     
 
@@ -179,14 +280,29 @@ def run_module():
         #For updating
         "task":{ "type": "str" },
 
+        #For updating every task of a release
+        "release":{ "type": "str" },
+        "info_tasks_filter": {"type":"str", "default":"open", "choices": list(TASK_STATE_CODES)},
+        "state_resolve": {"type":"str", "default":"all", "choices": list(TASK_STATE_RESOLVE_CODES)},
+        "update_workers": {"type":"int", "default": 4},
+
         #For updating
         "assigned_to":{"type":"str"},
         "work_notes":{"type":"str"},
         "close_code":{"type":"str"},
         "close_notes":{"type":"str"},
+
+        #Writes journaled in cache_dir and sent later by sgt_outbox
+        "outbox": {"type":"str", "default":"never", "choices": ["never", "always", "on_failure", "buffer"]},
+
+        #For buffered writes: updates of a task merged into one write
+        "buffer_window": {"type":"float", "default": 30},
+        "ordered_states": {"type":"list", "elements": "str", "default": [], "choices": ["in_progress", "closed", "incomplete", "skipped"]},
         
     }
 
+    module_args.update(sgt_argument_spec())
+
     result = dict(
         changed=False,
         original_message="",
@@ -197,19 +313,60 @@ def run_module():
         argument_spec=module_args,
         supports_check_mode=False,
         required_if=[
-            ('state', 'in_progress', ('task', 'assigned_to' ), False),
-            ('state', 'closed', ('task', 'close_code', 'close_notes' ), False)
-            ('state', 'incomplete', ('task', 'close_code', 'close_notes' ), False)
-            ('state', 'skipped', ('task', 'close_code', 'close_notes' ), False)
-        ]   
+            ('state', 'in_progress', ('assigned_to', ), False),
+            ('state', 'closed', ('close_code', 'close_notes' ), False),
+            ('state', 'incomplete', ('close_code', 'close_notes' ), False),
+            ('state', 'skipped', ('close_code', 'close_notes' ), False)
+        ],
+        required_one_of=[
+            ('task', 'release'),
+        ],
+        mutually_exclusive=[
+            ('task', 'release'),
+        ]
     )
 
+    #Requests, retries and backoff time of every call made by this run
+    result["http_stats"] = get_client(**module.params).stats
+
     if module.check_mode:
         module.exit_json(**result)
+    elif module.params["release"]:
+        choices = module_choices(module)
+        if not valid_close_code(module, choices):
+            module.fail_json(msg="close_code does not meet with catalog codes", **result)
+
+        data = transition_data(module, choices)
+        if "mensaje" in data:
+            result["message"] = data
+            module.fail_json(msg="Response generic error", **result)
+
+        results = update_release_tasks(module.params["release"], data, **module.params)
+        result["message"] = results
+        result["changed"] = any(r["status_code"] in (200, 201) or r.get("queued") for r in results)
+
+        if all(r["status_code"] in (200, 201) or r.get("queued") for r in results):
+            module.exit_json(**result)
+        else:
+            module.fail_json(msg="Some tasks could not be updated", **result)
     else:
         response = validateOptions(module)
 
-    result["message"] = json.loads(response.text)
+    #Journaled writes are acknowledged, sgt_outbox sends them
+    if isinstance(response, dict) and "queued" in response:
+        result["message"] = response
+        result["changed"] = True
+        module.exit_json(**result)
+
+    #Request errors come back as {"mensaje": ...} instead of a response
+    if isinstance(response, dict):
+        result["message"] = response
+        module.fail_json(msg="Response generic error", **result)
+
+    try:
+        result["message"] = json.loads(response.text)
+    except ValueError:
+        result["message"] = response.text
     #result["message"] = json.loads(response.json())
 
     if response.status_code == 200 or response.status_code == 201:
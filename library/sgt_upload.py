@@ -3,9 +3,13 @@
 
 from __future__ import (absolute_import, division, print_function)
 from ansible.module_utils.basic import AnsibleModule
-import requests
+from ansible.module_utils.sgt_client import get_client, sgt_argument_spec
+from ansible.module_utils.sgt_parallel import parallel_map
+from ansible.module_utils.sgt_outbox import through_outbox
 import json
 import os
+import glob
+import time
 from datetime import datetime
 
 
@@ -74,7 +78,6 @@ from datetime import datetime
 ###'''
 
 def upload_file(number_id, **module_args):
-    response = None
     endpoint = module_args["sn_base"] + module_args["sn_uri"]
     headers = {"Content-Type": "*/*", "Accept":"application/json"}
     params={
@@ -83,24 +86,102 @@ def upload_file(number_id, **module_args):
         "table_sys_id":     number_id
     }
 
-    data = open(module_args["filename"], "rb").read()
+    def send():
+        try:
+            #The file object is streamed by requests in small blocks, so memory stays
+            #flat regardless of the file size
+            with open(module_args["filename"], "rb") as data:
+                size = os.fstat(data.fileno()).st_size
+                headers["Content-Length"] = str(size)
+                return get_client(**module_args).post(
+                    url=endpoint,
+                    params=params,
+                    headers=headers,
+                    #requests switches empty file objects to chunked encoding
+                    data=data if size > 0 else b"",
+                    timeout=module_args["timeout"]
+                )
 
-    try:
-        response = requests.post(
-            url=endpoint,
-            auth=(module_args["sn_user"], module_args["sn_pass"]),
-            params=params,
-            headers=headers,
-            #data=json.dumps(data),
-            data=data,
-            timeout=module_args["timeout"]
-        )
+        except Exception as e:
+            return {"mensaje": "ERROR, file could not upload: " + str(e)}
+
+    #A missing file is not an outage, it is not journaled
+    if not os.path.isfile(module_args["filename"]):
+        return send()
+
+    entry = {"method": "POST", "uri": module_args["sn_uri"], "params": params, "filename": module_args["filename"]}
+    return through_outbox(send, "sgt_upload", entry, **module_args)
+
+def expand_files(files):
+    # Returns (filenames, patterns that matched no file)
+    filenames = []
+    unmatched = []
+
+    for pattern in files:
+        pattern = os.path.expanduser(pattern)
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        if not matches:
+            unmatched.append(pattern)
+        for filename in matches:
+            if filename not in filenames:
+                filenames.append(filename)
+
+    return filenames, unmatched
+
+def upload_files(number_id, filenames, unmatched=(), **module_args):
+    workers = max(module_args["upload_workers"], 1)
+    module_args["pool_maxsize"] = max(module_args.get("pool_maxsize") or 10, workers)
 
-    except Exception as e:
-        response = {"mensaje": "ERROR, file could not upload: " + str(e)}
+    def upload_one(filename):
+        start = time.time()
+        response = upload_file(number_id, **dict(module_args, filename=filename))
+        item = {
+            "filename":     filename,
+            "status_code":  None,
+            "size_bytes":   os.path.getsize(filename) if os.path.isfile(filename) else 0,
+            "elapsed":      round(time.time() - start, 3)
+        }
 
+        if isinstance(response, dict):
+            item["result"] = response
+            item["queued"] = "queued" in response
+        else:
+            item["status_code"] = response.status_code
+            try:
+                item["result"] = response.json().get("result", response.text)
+            except ValueError:
+                item["result"] = response.text
+
+        return item
+
+    start = time.time()
+    results = parallel_map(upload_one, filenames, workers, **module_args)
+    elapsed = time.time() - start
+
+    #A pattern without files is an error of its own, not an empty success
+    results += [{
+        "filename":     pattern,
+        "status_code":  None,
+        "size_bytes":   0,
+        "elapsed":      0.0,
+        "result":       {"mensaje": "ERROR, no files match: " + pattern}
+    } for pattern in unmatched]
+
+    uploaded = [r for r in results if r["status_code"] in (200, 201)]
+    queued = [r for r in results if r.get("queued")]
+    total_bytes = sum(r["size_bytes"] for r in uploaded)
+
+    stats = {
+        "files":            len(results),
+        "uploaded":         len(uploaded),
+        "queued":           len(queued),
+        "failed":           len(results) - len(uploaded) - len(queued),
+        "bytes":            total_bytes,
+        "elapsed":          round(elapsed, 3),
+        "throughput_bps":   int(total_bytes / elapsed) if elapsed > 0 else total_bytes
+    }
 
-    return response
+    return results, stats
 
 def validateOptions(module):
     
@@ -119,7 +200,7 @@ def run_module():
         #Generals
         "sn_user": {"required": True, "type": "str"},
         "sn_pass": {"required": True, "type": "str", "no_log": True},
-        "sn_base": {"required": True, "type": "str", "default":"https://santandertest.service-now.com"},
+        "sn_base": {"required": False, "type": "str", "default":"https://santandertest.service-now.com"},
         "sn_uri":  {"required": False, "type": "str", "default": "/api/now/attachment/file"},
         "timeout": {"required": False, "type": "int", "default": 300},
         "filter":  {"required": False, "type": "bool", "default": True},
@@ -130,9 +211,18 @@ def run_module():
         "filename": {"type":"path"},
         "id_record": {"type":"str"},
 
+        #Para upload de varios ficheros en paralelo (rutas o globs)
+        "files": {"type":"list", "elements": "path"},
+        "upload_workers": {"type":"int", "default": 4},
+
+        #Writes journaled in cache_dir and sent later by sgt_outbox
+        "outbox": {"type":"str", "default":"never", "choices": ["never", "always", "on_failure"]},
+
         
 }
 
+    module_args.update(sgt_argument_spec())
+
     result = dict(
         changed=False,
         original_message="",
@@ -143,19 +233,53 @@ def run_module():
         argument_spec=module_args,
         supports_check_mode=False,
         required_if=[
-            ('state', 'upload', ('release', 'sn_user', 'sn_pass','sn_base','release'), False),
+            ('state', 'upload', ('id_record', 'sn_user', 'sn_pass','sn_base'), False),
+        ],
+        required_one_of=[
+            ('filename', 'files'),
+        ],
+        mutually_exclusive=[
+            ('filename', 'files'),
         ],
         required_together=[
             ('sn_user', 'sn_pass','sn_base'),
         ],
     )
 
+    #Requests, retries and backoff time of every call made by this run
+    result["http_stats"] = get_client(**module.params).stats
+
     if module.check_mode:
         module.exit_json(**result)
+    elif module.params["files"]:
+        filenames, unmatched = expand_files(module.params["files"])
+        results, stats = upload_files(module.params["id_record"], filenames, unmatched, **module.params)
+        result["message"] = results
+        result["stats"] = stats
+        result["changed"] = stats["uploaded"] + stats["queued"] > 0
+
+        if stats["failed"] == 0:
+            module.exit_json(**result)
+        else:
+            module.fail_json(msg="Some files could not be uploaded", **result)
     else:
         response = validateOptions(module)
 
-    result["message"] = json.loads(response.text)
+    #Journaled writes are acknowledged, sgt_outbox sends them
+    if isinstance(response, dict) and "queued" in response:
+        result["message"] = response
+        result["changed"] = True
+        module.exit_json(**result)
+
+    #Request errors come back as {"mensaje": ...} instead of a response
+    if isinstance(response, dict):
+        result["message"] = response
+        module.fail_json(msg="Response generic error", **result)
+
+    try:
+        result["message"] = json.loads(response.text)
+    except ValueError:
+        result["message"] = response.text
 
     if response.status_code == 200 or response.status_code == 201:
  
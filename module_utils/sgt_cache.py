@@ -0,0 +1,154 @@
+# coding=utf-8
+
+from __future__ import (absolute_import, division, print_function)
+import fcntl
+import json
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+
+class SgtDiskCache(object):
+    # Small JSON key/value store shared by every module process on the host.
+    # Readers take a shared flock and writers an exclusive one, and the file is
+    # replaced atomically so a crashed writer never leaves it half written.
+
+    def __init__(self, cache_dir, name):
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.path = os.path.join(self.cache_dir, name + ".json")
+        self.lock_path = self.path + ".lock"
+
+    @contextmanager
+    def _locked(self, exclusive):
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir, 0o700)
+
+        with open(self.lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _write(self, entries):
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=".tmp-")
+        with os.fdopen(fd, "w") as f:
+            json.dump(entries, f)
+        os.rename(tmp_path, self.path)
+
+    def get(self, key):
+        # Returns {"value": ..., "ts": ...} or None when the key is unknown
+        with self._locked(False):
+            return self._read().get(key)
+
+    def set_many(self, values):
+        now = time.time()
+        with self._locked(True):
+            entries = self._read()
+            for key, value in values.items():
+                entries[key] = {"value": value, "ts": now}
+            self._write(entries)
+
+    def set(self, key, value):
+        self.set_many({key: value})
+
+    def delete(self, key):
+        with self._locked(True):
+            entries = self._read()
+            if entries.pop(key, None) is not None:
+                self._write(entries)
+
+
+def table_from_uri(sn_uri):
+    return sn_uri.rstrip("/").split("/")[-1]
+
+
+def sys_id_key(table, number, **module_args):
+    return "|".join([module_args["sn_base"].rstrip("/"), table, str(number)])
+
+
+def lookup_sys_id(number, fetch, **module_args):
+    # sys_ids never change, so a cached value is used as is. A number that was
+    # not found is remembered only for negative_cache_ttl seconds. fetch() is
+    # called on a miss and must return the sys_id or "".
+    if not module_args.get("sys_id_cache"):
+        return fetch()
+
+    cache = SgtDiskCache(module_args["cache_dir"], "sys_id")
+    key = sys_id_key(table_from_uri(module_args["sn_uri"]), number, **module_args)
+
+    try:
+        entry = cache.get(key)
+    except (IOError, OSError):
+        return fetch()
+
+    if entry is not None:
+        if entry["value"]:
+            return entry["value"]
+        if time.time() - entry["ts"] <= module_args.get("negative_cache_ttl", 60):
+            return ""
+
+    sys_id = fetch()
+
+    try:
+        cache.set(key, sys_id or None)
+    except (IOError, OSError):
+        pass
+
+    return sys_id
+
+
+def cached_sys_id(number, **module_args):
+    # sys_id already known for number, or "" (nothing is asked to the instance)
+    if not module_args.get("sys_id_cache"):
+        return ""
+
+    try:
+        entry = SgtDiskCache(module_args["cache_dir"], "sys_id").get(sys_id_key(table_from_uri(module_args["sn_uri"]), number, **module_args))
+    except (IOError, OSError):
+        return ""
+
+    return (entry or {}).get("value") or ""
+
+
+def remember_sys_ids(records, **module_args):
+    # Feeds number/sys_id pairs seen in responses (creates, info calls) to the
+    # cache so later writes on the same records skip the lookup.
+    if not module_args.get("sys_id_cache"):
+        return
+
+    if isinstance(records, dict):
+        records = [records]
+
+    table = table_from_uri(module_args["sn_uri"])
+    values = {}
+
+    for record in records or []:
+        if isinstance(record, dict) and record.get("number") and record.get("sys_id"):
+            values[sys_id_key(table, record["number"], **module_args)] = record["sys_id"]
+
+    if values:
+        try:
+            SgtDiskCache(module_args["cache_dir"], "sys_id").set_many(values)
+        except (IOError, OSError):
+            pass
+
+
+def remember_response(response, **module_args):
+    if not module_args.get("sys_id_cache") or isinstance(response, dict):
+        return
+
+    try:
+        records = response.json().get("result")
+    except (ValueError, AttributeError):
+        return
+
+    remember_sys_ids(records, **module_args)
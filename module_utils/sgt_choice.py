@@ -0,0 +1,122 @@
+# coding=utf-8
+
+from __future__ import (absolute_import, division, print_function)
+import time
+
+from ansible.module_utils.sgt_cache import SgtDiskCache
+from ansible.module_utils.sgt_client import get_client
+
+
+# Choice lists come from sys_choice, so queries and writes use the raw values of
+# the instance and reads skip sysparm_display_value (labels are put back here).
+# Tables inherit the choices of their parents unless they redefine the field.
+TABLE_PARENTS = {
+    "rm_task":      ("rm_task", "planned_task", "task"),
+    "rm_release":   ("rm_release", "planned_task", "task"),
+}
+
+
+def _normalize(text):
+    return " ".join(str(text).lower().replace("_", " ").replace("-", " ").split())
+
+
+def _fetch_choices(table, **module_args):
+    endpoint = module_args["sn_base"] + "/api/now/v2/table/sys_choice"
+    tables = TABLE_PARENTS.get(table, (table, ))
+    params = {
+        "sysparm_query": "nameIN" + ",".join(tables) + "^inactive=false^language=" + module_args.get("choice_language", "en"),
+        "sysparm_fields": "name,element,value,label"
+    }
+
+    by_table = {}
+    for record in get_client(**module_args).iter_records(endpoint, params=params, timeout=module_args["timeout"]):
+        by_table.setdefault(record["name"], {}).setdefault(record["element"], {})[record["value"]] = record["label"]
+
+    #The closest table defining a field wins
+    choices = {}
+    for name in reversed(tables):
+        choices.update(by_table.get(name, {}))
+
+    return choices
+
+
+def _with_defaults(choices, defaults):
+    # A field the instance returned is used as it is (its codes may differ
+    # from the built-in ones); defaults only stand in for missing fields
+    merged = dict((field, dict(values)) for field, values in (defaults or {}).items())
+    for field, values in choices.items():
+        merged[field] = dict(values)
+    return merged
+
+
+def load_choices(table, defaults=None, **module_args):
+    # Returns {field: {value: label}} for table, cached on disk for
+    # choice_cache_ttl seconds. defaults fills in the fields sys_choice does
+    # not have, or everything when it can not be read.
+    cache = SgtDiskCache(module_args["cache_dir"], "choices")
+    key = "|".join((module_args["sn_base"].rstrip("/"), table, module_args.get("choice_language", "en")))
+
+    try:
+        entry = cache.get(key)
+    except (IOError, OSError):
+        entry = None
+
+    if entry is not None and time.time() - entry["ts"] <= module_args.get("choice_cache_ttl", 86400):
+        return _with_defaults(entry["value"], defaults)
+
+    try:
+        choices = _fetch_choices(table, **module_args)
+    except Exception:
+        return _with_defaults({}, defaults)
+
+    #An empty list (no read access, wrong language) is asked again next time
+    if choices:
+        try:
+            cache.set(key, choices)
+        except (IOError, OSError):
+            pass
+
+    return _with_defaults(choices, defaults)
+
+
+def cached_choices(table, defaults=None, **module_args):
+    # load_choices without asking the instance: the cached list, however old,
+    # or defaults. For writes that are journaled instead of sent.
+    key = "|".join((module_args["sn_base"].rstrip("/"), table, module_args.get("choice_language", "en")))
+
+    try:
+        entry = SgtDiskCache(module_args["cache_dir"], "choices").get(key)
+    except (IOError, OSError):
+        entry = None
+
+    return _with_defaults(entry["value"] if entry is not None else {}, defaults)
+
+
+def choice_value(choices, field, name, fallback=None):
+    # Raw value of a choice given its value, its label or a name like
+    # "in_progress" for "In Progress"; fallback when the list has no match
+    values = choices.get(field) or {}
+
+    if name in values:
+        return name
+
+    for value, label in values.items():
+        if _normalize(label) == _normalize(name):
+            return value
+
+    return fallback
+
+
+def choice_label(choices, field, value):
+    return (choices.get(field) or {}).get(str(value), value)
+
+
+def label_records(records, choices):
+    # Replaces the raw value of every choice field of the records by its label,
+    # the same as sysparm_display_value=true does on the instance
+    for record in records:
+        for field, value in record.items():
+            if field in choices and isinstance(value, str):
+                record[field] = choice_label(choices, field, value)
+
+    return records
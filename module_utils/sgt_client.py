@@ -0,0 +1,465 @@
+# coding=utf-8
+
+from __future__ import (absolute_import, division, print_function)
+import base64
+import contextvars
+import copy
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from email.utils import parsedate_tz, mktime_tz
+import requests
+from requests.adapters import HTTPAdapter
+
+from ansible.module_utils.sgt_ratelimit import rate_limiter
+
+
+# Sessions are kept per instance and user for the life of the process, so every
+# call made by a module (info + update, info + approve, ...) reuses the same
+# keep-alive connection instead of paying a new TCP + TLS handshake.
+_CLIENTS = {}
+
+# Throttling and gateway errors worth another attempt. Non idempotent requests
+# (POST) are only retried on 429 and connect timeouts, where the instance never
+# processed them.
+RETRY_STATUS = (429, 502, 503, 504)
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "PATCH", "DELETE")
+
+# Options, time budget and counters of the module run in progress (see SgtRun).
+# A context variable rather than client attributes: the persistent daemon
+# shares clients between module runs, and every run starts in a fresh context.
+_RUN = contextvars.ContextVar("sgt_run", default=None)
+
+
+def sgt_argument_spec():
+    # Connection options shared by every sgt_* module
+    return {
+        "pool_connections": {"required": False, "type": "int", "default": 1},
+        "pool_maxsize":     {"required": False, "type": "int", "default": 10},
+        "cache_dir":        {"required": False, "type": "path", "default": "~/.ansible/sgt_cache"},
+        "sys_id_cache":     {"required": False, "type": "bool", "default": True},
+        "negative_cache_ttl": {"required": False, "type": "int", "default": 60},
+        "retries":          {"required": False, "type": "int", "default": 3},
+        "backoff_factor":   {"required": False, "type": "float", "default": 0.5},
+        "backoff_max":      {"required": False, "type": "float", "default": 30},
+        "coalesce_window":  {"required": False, "type": "float", "default": 2},
+        "resolve_references": {"required": False, "type": "bool", "default": True},
+        "reference_cache_ttl": {"required": False, "type": "int", "default": 86400},
+        "reference_tables": {"required": False, "type": "dict", "default": {}},
+        "choice_cache_ttl": {"required": False, "type": "int", "default": 86400},
+        "choice_language":  {"required": False, "type": "str", "default": "en"},
+        "rate_limit":       {"required": False, "type": "float", "default": 0},
+        "rate_burst":       {"required": False, "type": "float"},
+        "adaptive_concurrency": {"required": False, "type": "bool", "default": False},
+        "adaptive_max_workers": {"required": False, "type": "int", "default": 16},
+        "connect_timeout":  {"required": False, "type": "float", "default": 10},
+        "read_timeout":     {"required": False, "type": "float"},
+        "deadline":         {"required": False, "type": "float", "default": 0},
+    }
+
+
+class _Flight(object):
+    # One GET shared by every caller asking for the same url and params
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.response = None
+        self.error = None
+        self.finished = None
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class SgtBudget(object):
+    # Connect/read timeouts and overall deadline of one module run. Every
+    # attempt gets what is left of the deadline as its ceiling, and no retry
+    # backs off past it.
+
+    def __init__(self, deadline=0, connect_timeout=None, read_timeout=None):
+        self.deadline = deadline or 0
+        self.deadline_at = time.time() + deadline if deadline and deadline > 0 else None
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+
+    def remaining(self):
+        if self.deadline_at is None:
+            return None
+        return self.deadline_at - time.time()
+
+    def ends_before(self, delay):
+        remaining = self.remaining()
+        return remaining is not None and delay >= remaining
+
+    def check(self):
+        remaining = self.remaining()
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceeded("deadline of %ss exceeded" % self.deadline)
+        return remaining
+
+    def timeouts(self, timeout):
+        # (connect, read) for requests; timeout is the one given by the caller
+        remaining = self.check()
+        connect = self.connect_timeout or timeout
+        read = self.read_timeout or timeout
+
+        if remaining is not None:
+            connect = min(connect, remaining) if connect else remaining
+            read = min(read, remaining) if read else remaining
+        return (connect, read)
+
+
+class SgtRun(object):
+    # Retry, coalescing and rate limit options, budget and http_stats of one
+    # module run. Taken from the options of the first get_client call of the
+    # run, so a shared client never keeps the options of an earlier task.
+
+    def __init__(self, **module_args):
+        self.timeout = module_args.get("timeout") or 300
+        self.retries = module_args.get("retries", 3)
+        self.backoff_factor = module_args.get("backoff_factor", 0.5)
+        self.backoff_max = module_args.get("backoff_max", 30)
+        self.coalesce_window = module_args.get("coalesce_window", 2)
+        self.rate_limiter = rate_limiter(**module_args)
+        self.budget = SgtBudget(
+            module_args.get("deadline"),
+            module_args.get("connect_timeout"),
+            module_args.get("read_timeout")
+        )
+
+        self.stats = {"requests": 0, "retries": 0, "backoff_time": 0.0, "coalesced": 0, "rate_limited": 0, "rate_wait_time": 0.0,
+                      "deadline_exceeded": 0}
+        self.lock = threading.Lock()
+
+
+def current_run():
+    return _RUN.get()
+
+
+def current_budget():
+    run = _RUN.get()
+    return run.budget if run is not None else None
+
+
+def retry_after_seconds(value):
+    # Retry-After is either a number of seconds or an HTTP date
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        return max(0.0, mktime_tz(parsedate_tz(value)) - time.time())
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+
+class SgtClient(object):
+
+    def __init__(self, sn_base, sn_user, sn_pass, pool_connections=1, pool_maxsize=10):
+        self.sn_base = sn_base
+        self.session = requests.Session()
+        self.session.auth = (sn_user, sn_pass)
+        self.mount_pool(pool_connections, pool_maxsize)
+
+        #Options for calls made outside of a module run
+        self.defaults = SgtRun()
+
+        self._flights = {}
+        self._flights_lock = threading.Lock()
+
+    def mount_pool(self, pool_connections, pool_maxsize):
+        self.pool_maxsize = pool_maxsize
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _run(self):
+        return _RUN.get() or self.defaults
+
+    @property
+    def stats(self):
+        # Counters of the calling module run only
+        return self._run().stats
+
+    def _count(self, retried=False, delay=0.0, coalesced=False, waited=0.0, expired=False):
+        run = self._run()
+        with run.lock:
+            if expired:
+                run.stats["deadline_exceeded"] += 1
+            elif waited > 0:
+                run.stats["rate_limited"] += 1
+                run.stats["rate_wait_time"] = round(run.stats["rate_wait_time"] + waited, 3)
+            elif coalesced:
+                run.stats["coalesced"] += 1
+            elif retried:
+                run.stats["retries"] += 1
+                run.stats["backoff_time"] = round(run.stats["backoff_time"] + delay, 3)
+            else:
+                run.stats["requests"] += 1
+
+    def _backoff(self, attempt, retry_after=None):
+        run = self._run()
+        delay = retry_after_seconds(retry_after)
+        if delay is None:
+            #Full jitter over an exponential ceiling
+            delay = random.uniform(0, min(run.backoff_max, run.backoff_factor * (2 ** attempt)))
+        return delay
+
+    def request(self, method, url, idempotent=None, **kwargs):
+        if method.upper() in ("GET", "HEAD"):
+            return self._send(method, url, idempotent, **kwargs)
+
+        try:
+            return self._send(method, url, idempotent, **kwargs)
+        finally:
+            self._invalidate(url)
+
+    def _invalidate(self, url):
+        # Reads of a table are not reused after a write to it; writes outside
+        # the Table API (batch, attachments) drop every reusable read
+        match = re.match(r"(.*/table/[^/?]+)", url)
+        prefix = match.group(1) if match else ""
+
+        with self._flights_lock:
+            for key in [k for k in self._flights if k[0].startswith(prefix)]:
+                if self._flights[key].event.is_set():
+                    del self._flights[key]
+
+    def _single_flight(self, url, **kwargs):
+        # Concurrent identical GETs share one request, and its response is
+        # reused for coalesce_window seconds. Every caller gets its own copy.
+        key = (url, json.dumps(kwargs.get("params") or {}, sort_keys=True))
+        window = self._run().coalesce_window
+
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            if flight is not None and flight.event.is_set() and time.time() - flight.finished > window:
+                flight = None
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if leader:
+            try:
+                flight.response = self._send("GET", url, None, **kwargs)
+                flight.response.content
+            except Exception as e:
+                flight.error = e
+            finally:
+                flight.finished = time.time()
+                flight.event.set()
+
+            #Only successful reads are reused
+            if flight.error is not None or flight.response.status_code != 200:
+                with self._flights_lock:
+                    if self._flights.get(key) is flight:
+                        del self._flights[key]
+        else:
+            budget = self._run().budget
+            if not flight.event.wait(budget.remaining()):
+                self._count(expired=True)
+                raise DeadlineExceeded("deadline of %ss exceeded" % budget.deadline)
+            self._count(coalesced=True)
+
+            #The leader ran out of its own budget, not of this caller's
+            if isinstance(flight.error, DeadlineExceeded):
+                return self._send("GET", url, None, **kwargs)
+
+        if flight.error is not None:
+            raise flight.error
+
+        return copy.copy(flight.response)
+
+    def _send(self, method, url, idempotent=None, **kwargs):
+        run = self._run()
+        timeout = kwargs.pop("timeout", None) or run.timeout
+        budget = run.budget
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+
+        #File bodies are rewound before a new attempt
+        body = kwargs.get("data")
+        body_start = body.tell() if hasattr(body, "seek") else None
+        attempt = 0
+
+        while True:
+            #Every attempt, retries included, takes a token of the shared bucket,
+            #unless waiting for it would go past the deadline
+            waited = run.rate_limiter.acquire(budget.remaining()) if run.rate_limiter is not None else 0.0
+            if waited is None:
+                self._count(expired=True)
+                raise DeadlineExceeded("deadline of %ss exceeded waiting for the rate limit" % budget.deadline)
+            if waited > 0:
+                self._count(waited=waited)
+
+            try:
+                kwargs["timeout"] = budget.timeouts(timeout)
+            except DeadlineExceeded:
+                self._count(expired=True)
+                raise
+
+            self._count()
+            try:
+                response = self.session.request(method, url, **kwargs)
+
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                retryable = idempotent or isinstance(e, requests.exceptions.ConnectTimeout)
+                if not retryable or attempt >= run.retries:
+                    raise
+                delay = self._backoff(attempt)
+
+                #No retry is worth waiting past the deadline
+                if budget.ends_before(delay):
+                    self._count(expired=True)
+                    raise DeadlineExceeded("deadline of %ss exceeded, last error: %s" % (budget.deadline, e))
+
+            else:
+                retryable = response.status_code in RETRY_STATUS and (idempotent or response.status_code == 429)
+                if not retryable or attempt >= run.retries:
+                    return response
+                delay = self._backoff(attempt, response.headers.get("Retry-After"))
+                #A Retry-After longer than backoff_max (or the deadline) is
+                #handed to the caller instead of being slept
+                if delay > run.backoff_max or budget.ends_before(delay):
+                    return response
+                response.close()
+
+            self._count(retried=True, delay=delay)
+            time.sleep(delay)
+            if body_start is not None:
+                body.seek(body_start)
+            attempt += 1
+
+    def get(self, url, **kwargs):
+        window = self._run().coalesce_window
+        if window is None or window < 0:
+            return self.request("GET", url, **kwargs)
+        return self._single_flight(url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request("PUT", url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self.request("PATCH", url, **kwargs)
+
+    def iter_records(self, url, params=None, page_size=1000, max_records=None, **kwargs):
+        # Yields table records page by page. Pages are chained with a keyset on
+        # sys_id (sys_id>last^ORDERBYsys_id) instead of sysparm_offset, so deep
+        # pages cost the same as the first one, and no total count is asked for.
+        params = dict(params or {})
+        query = params.get("sysparm_query", "")
+        fields = params.get("sysparm_fields")
+        if fields and "sys_id" not in fields.split(","):
+            params["sysparm_fields"] = fields + ",sys_id"
+        params["sysparm_no_count"] = "true"
+
+        last_sys_id = None
+        returned = 0
+
+        while True:
+            limit = page_size if max_records is None else min(page_size, max_records - returned)
+            if limit <= 0:
+                return
+
+            keyset = "sys_id>" + last_sys_id if last_sys_id else ""
+            params["sysparm_query"] = "^".join([c for c in (query, keyset, "ORDERBYsys_id") if c])
+            params["sysparm_limit"] = str(limit)
+
+            response = self.get(url, params=params, **kwargs)
+            response.raise_for_status()
+            records = response.json().get("result", [])
+
+            for record in records:
+                yield record
+
+            returned += len(records)
+            if len(records) < limit:
+                return
+            last_sys_id = records[-1]["sys_id"]
+
+    def batch(self, url, rest_requests, **kwargs):
+        # rest_requests: [{"method": "POST", "url": "/api/now/...", "body": {...}}, ...]
+        # Returns one {"status_code", "body"} per request, in input order.
+        payload = {
+            "batch_request_id": str(uuid.uuid4()),
+            "exclude_response_headers": True,
+            "rest_requests": []
+        }
+
+        for idx, rest_request in enumerate(rest_requests):
+            item = {
+                "id":       str(idx),
+                "method":   rest_request["method"],
+                "url":      rest_request["url"],
+                "headers":  [
+                    {"name": "Content-Type", "value": "application/json"},
+                    {"name": "Accept", "value": "application/json"}
+                ]
+            }
+            if rest_request.get("body") is not None:
+                item["body"] = base64.b64encode(json.dumps(rest_request["body"]).encode("utf-8")).decode("ascii")
+            payload["rest_requests"].append(item)
+
+        response = self.post(
+            url,
+            headers={"Content-Type": "application/json", "Accept": "application/json"},
+            data=json.dumps(payload),
+            **kwargs
+        )
+        response.raise_for_status()
+        content = response.json()
+
+        results = [{"status_code": None, "body": None} for _ in rest_requests]
+
+        for item in content.get("serviced_requests", []):
+            body = item.get("body")
+            if body:
+                body = json.loads(base64.b64decode(body).decode("utf-8"))
+            results[int(item["id"])] = {"status_code": item.get("status_code"), "body": body}
+
+        for item in content.get("unserviced_requests", []):
+            idx = item["id"] if isinstance(item, dict) else item
+            results[int(idx)] = {"status_code": None, "body": {"mensaje": "ERROR, request was not serviced by batch"}}
+
+        return results
+
+    def close(self):
+        self.session.close()
+
+
+def get_client(**module_args):
+    # The first call of a module run fixes its options and starts its budget
+    if _RUN.get() is None:
+        _RUN.set(SgtRun(**module_args))
+
+    key = (module_args["sn_base"], module_args["sn_user"])
+    client = _CLIENTS.get(key)
+
+    if client is None:
+        client = SgtClient(
+            module_args["sn_base"],
+            module_args["sn_user"],
+            module_args["sn_pass"],
+            pool_connections=module_args.get("pool_connections") or 1,
+            pool_maxsize=module_args.get("pool_maxsize") or 10
+        )
+        _CLIENTS[key] = client
+    else:
+        client.session.auth = (module_args["sn_user"], module_args["sn_pass"])
+
+        #Bulk modes ask for a bigger pool than the one the client started with
+        if (module_args.get("pool_maxsize") or 0) > client.pool_maxsize:
+            client.mount_pool(module_args.get("pool_connections") or 1, module_args["pool_maxsize"])
+
+    return client
@@ -0,0 +1,285 @@
+# coding=utf-8
+
+# Controller side runner for the sgt_* modules, used by the action plugins in
+# action_plugins/. It is never shipped to a target.
+#
+# Ansible forks a new worker process for every task, so a session opened there
+# dies with the task. To keep one pooled session for the whole play the modules
+# are run by a small local daemon (one per controller user), started on first
+# use and stopped after idle_timeout seconds without calls. The action plugins
+# talk to it over a unix socket in a 0700 directory.
+
+from __future__ import (absolute_import, division, print_function)
+import fcntl
+import hashlib
+import contextvars
+import importlib.abc
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.common.parameters import remove_values
+
+
+MODULE_UTILS_DIR = os.path.dirname(os.path.abspath(__file__))
+CONTROLLER_DIR = os.path.expanduser("~/.ansible/sgt_controller")
+
+_MODULES = {}
+_MODULES_LOCK = threading.Lock()
+
+
+class _SgtModuleUtilsFinder(importlib.abc.MetaPathFinder):
+    # Resolves ansible.module_utils.sgt_* from this directory, the same way
+    # AnsiballZ does when it packs them for a target
+
+    def find_spec(self, fullname, path=None, target=None):
+        prefix = "ansible.module_utils."
+        if not fullname.startswith(prefix + "sgt_"):
+            return None
+
+        filename = os.path.join(MODULE_UTILS_DIR, fullname[len(prefix):] + ".py")
+        if not os.path.isfile(filename):
+            return None
+
+        return importlib.util.spec_from_file_location(fullname, filename)
+
+
+def install_module_utils_finder():
+    if not any(isinstance(finder, _SgtModuleUtilsFinder) for finder in sys.meta_path):
+        sys.meta_path.insert(0, _SgtModuleUtilsFinder())
+
+
+class ModuleExit(Exception):
+
+    def __init__(self, result):
+        super(ModuleExit, self).__init__()
+        self.result = result
+
+
+class ControllerModule(AnsibleModule):
+    # AnsibleModule that takes its arguments from the caller and hands the
+    # result back instead of printing it and exiting the process
+
+    _args = threading.local()
+
+    def _load_params(self):
+        self.params = dict(ControllerModule._args.value)
+
+    def _log_invocation(self):
+        pass
+
+    def _controller_result(self, kwargs):
+        kwargs.setdefault("invocation", {"module_args": self.params})
+        return remove_values(kwargs, self.no_log_values)
+
+    def exit_json(self, **kwargs):
+        raise ModuleExit(self._controller_result(kwargs))
+
+    def fail_json(self, msg, **kwargs):
+        kwargs["failed"] = True
+        kwargs["msg"] = msg
+        kwargs.pop("exception", None)
+        raise ModuleExit(self._controller_result(kwargs))
+
+
+def load_module(module_path):
+    install_module_utils_finder()
+    mtime = os.path.getmtime(module_path)
+
+    with _MODULES_LOCK:
+        cached = _MODULES.get(module_path)
+        if cached is None or cached[0] != mtime:
+            name = "sgt_controller_" + os.path.splitext(os.path.basename(module_path))[0]
+            spec = importlib.util.spec_from_file_location(name, module_path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            module.AnsibleModule = ControllerModule
+            cached = _MODULES[module_path] = (mtime, module)
+
+    return cached[1]
+
+
+def run_sgt_module(module_path, args):
+    module = load_module(module_path)
+    ControllerModule._args.value = args
+
+    #A fresh context per run: budgets and other per run state start empty
+    try:
+        contextvars.Context().run(module.main)
+    except ModuleExit as e:
+        return e.result
+    except SystemExit:
+        pass
+    except Exception as e:
+        return {"failed": True, "msg": "Module raised an exception: %s" % e}
+    finally:
+        ControllerModule._args.value = None
+
+    return {"failed": True, "msg": "Module finished without a result"}
+
+
+def _daemon_paths():
+    key = hashlib.sha1((sys.executable + MODULE_UTILS_DIR).encode("utf-8")).hexdigest()[:16]
+    base = os.path.join(CONTROLLER_DIR, key)
+    return base + ".sock", base + ".key", base + ".lock"
+
+
+def _authkey(key_path):
+    if not os.path.exists(key_path):
+        fd = os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(os.urandom(32))
+
+    with open(key_path, "rb") as f:
+        return f.read()
+
+
+def _connect(socket_path, authkey):
+    try:
+        return Client(socket_path, family="AF_UNIX", authkey=authkey)
+    except (IOError, OSError, EOFError, AuthenticationError):
+        return None
+
+
+def _start_daemon(idle_timeout):
+    socket_path, key_path, lock_path = _daemon_paths()
+
+    if not os.path.isdir(CONTROLLER_DIR):
+        os.makedirs(CONTROLLER_DIR, 0o700)
+
+    #Many forks may get here at once, only one of them starts the daemon
+    with open(lock_path, "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        authkey = _authkey(key_path)
+
+        conn = _connect(socket_path, authkey)
+        if conn is not None:
+            return conn
+
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+        with open(os.devnull, "r+b") as devnull:
+            subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), "serve", str(idle_timeout)],
+                stdin=devnull, stdout=devnull, stderr=devnull,
+                close_fds=True, start_new_session=True
+            )
+
+        deadline = time.time() + 10
+        while time.time() < deadline:
+            conn = _connect(socket_path, authkey)
+            if conn is not None:
+                return conn
+            time.sleep(0.05)
+
+    return None
+
+
+def run(module_path, args, mode="persistent", idle_timeout=300):
+    # mode is "persistent" (shared daemon) or "local" (this process)
+    args = json.loads(json.dumps(args))
+
+    if mode == "persistent":
+        socket_path, key_path, lock_path = _daemon_paths()
+        conn = None
+
+        if os.path.exists(key_path):
+            conn = _connect(socket_path, _authkey(key_path))
+        if conn is None:
+            conn = _start_daemon(idle_timeout)
+
+        if conn is not None:
+            try:
+                try:
+                    conn.send((module_path, args))
+                except (IOError, OSError):
+                    return run_sgt_module(module_path, args)
+
+                #Once sent the module may have run, so it is never repeated here
+                try:
+                    return conn.recv()
+                except (IOError, OSError, EOFError) as e:
+                    return {"failed": True, "msg": "Lost connection with the sgt controller daemon: %s" % e}
+            finally:
+                conn.close()
+
+    return run_sgt_module(module_path, args)
+
+
+def run_action(action, task_vars, reads_target_files=False):
+    # Body shared by the sgt_* action plugins. sgt_controller_mode selects where
+    # the module runs: persistent (default), local or remote (plain module).
+    task_vars = task_vars or {}
+    mode = task_vars.get("sgt_controller_mode", "persistent")
+
+    #Modules reading files run on the controller only when it is the target
+    if reads_target_files and action._play_context.connection != "local" and mode != "remote":
+        #Their outbox would be journaled on the target, while sgt_outbox
+        #flushes the journal of the controller
+        if action._task.args.get("outbox", "never") != "never":
+            return {"failed": True, "msg": "outbox needs %s to run on the controller (connection local), "
+                    "or sgt_controller_mode remote for every sgt_* task" % action._task.action}
+        mode = "remote"
+
+    if mode == "remote":
+        return action._execute_module(task_vars=task_vars)
+
+    module_path = action._shared_loader_obj.module_loader.find_plugin(action._task.action, mod_type=".py")
+    args = dict(action._task.args)
+    args["_ansible_check_mode"] = action._play_context.check_mode
+    args["_ansible_diff"] = action._play_context.diff
+    args["_ansible_no_log"] = action._play_context.no_log
+
+    return run(module_path, args, mode, int(task_vars.get("sgt_controller_idle_timeout", 300)))
+
+
+def serve(idle_timeout):
+    socket_path, key_path, lock_path = _daemon_paths()
+    listener = Listener(socket_path, family="AF_UNIX", authkey=_authkey(key_path))
+    state = {"last": time.time(), "active": 0}
+    state_lock = threading.Lock()
+
+    def watchdog():
+        while True:
+            time.sleep(1)
+            with state_lock:
+                if state["active"] == 0 and time.time() - state["last"] > idle_timeout:
+                    listener.close()
+                    os._exit(0)
+
+    def handle(conn):
+        try:
+            module_path, args = conn.recv()
+            conn.send(run_sgt_module(module_path, args))
+        except (IOError, OSError, EOFError):
+            pass
+        finally:
+            conn.close()
+            with state_lock:
+                state["active"] -= 1
+                state["last"] = time.time()
+
+    threading.Thread(target=watchdog, daemon=True).start()
+
+    while True:
+        try:
+            conn = listener.accept()
+        except Exception:
+            #Failed handshakes (wrong authkey, client gone) are not fatal
+            continue
+
+        with state_lock:
+            state["active"] += 1
+        threading.Thread(target=handle, args=(conn, ), daemon=True).start()
+
+
+if __name__ == "__main__" and len(sys.argv) == 3 and sys.argv[1] == "serve":
+    serve(int(sys.argv[2]))
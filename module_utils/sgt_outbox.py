@@ -0,0 +1,526 @@
+# coding=utf-8
+
+# Write-ahead outbox for the sgt_* writes. With outbox: always (or on_failure,
+# when the instance is down or throttling) a write is appended to a SQLite
+# journal in cache_dir and acknowledged at once. sgt_outbox flushes the journal
+# later: in order, updates of the same record merged into one, JSON writes sent
+# through the Batch API and files one by one.
+#
+# outbox: buffer (sgt_task_update) uses the same journal as a write buffer: the
+# updates of a task are held for buffer_window seconds and then sent as one
+# write, by the next buffered write or by a timer of the persistent controller
+# daemon. Those flushes only take buffered entries (module "buffer"); queued
+# writes and files wait for sgt_outbox, which flushes everything.
+
+from __future__ import (absolute_import, division, print_function)
+import fcntl
+import json
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import closing, contextmanager
+
+try:
+    from urllib.parse import urlencode
+except ImportError:
+    from urllib import urlencode
+
+from ansible.module_utils.sgt_choice import choice_value, load_choices
+from ansible.module_utils.sgt_client import get_client
+from ansible.module_utils.sgt_record import lookup_numbers
+from ansible.module_utils.sgt_reference import resolve_references
+from ansible.module_utils.sgt_task import TASK_CHOICES
+
+
+# Statuses and errors after which the write is kept for a later flush
+OUTBOX_RETRY_STATUS = (429, 500, 502, 503, 504)
+
+# Journal fields are appended to, never replaced, when updates are merged
+JOURNAL_FIELDS = ("work_notes", "comments")
+
+# Built-in choices of the tables written through the outbox, used when
+# sys_choice can not be read at flush time
+FLUSH_CHOICES = {
+    "rm_task":      TASK_CHOICES,
+}
+
+SCHEMA = """CREATE TABLE IF NOT EXISTS entries (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    created     REAL NOT NULL,
+    sn_base     TEXT NOT NULL,
+    sn_user     TEXT NOT NULL,
+    module      TEXT NOT NULL,
+    method      TEXT NOT NULL,
+    uri         TEXT NOT NULL,
+    target      TEXT,
+    number      TEXT,
+    params      TEXT,
+    body        TEXT,
+    filename    TEXT,
+    key_field   TEXT,
+    key         TEXT,
+    barrier     INTEGER NOT NULL DEFAULT 0,
+    state       TEXT NOT NULL DEFAULT 'pending',
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    result      TEXT
+)"""
+
+COLUMNS = ("id", "created", "sn_base", "sn_user", "module", "method", "uri", "target", "number",
+           "params", "body", "filename", "key_field", "key", "barrier", "state", "attempts", "result")
+
+# Module name of the entries journaled by outbox: buffer
+BUFFER_MODULE = "buffer"
+
+# Flush timers of the buffered writes, one per outbox, instance and user
+_TIMERS = {}
+_TIMERS_LOCK = threading.Lock()
+
+
+class OutboxBusy(Exception):
+    pass
+
+
+class SgtOutbox(object):
+    # Every append is committed with synchronous=FULL, so an acknowledged write
+    # is on disk before the module returns
+
+    def __init__(self, cache_dir):
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.path = os.path.join(self.cache_dir, "outbox.db")
+        self.spool_dir = os.path.join(self.cache_dir, "outbox_files")
+
+    def _connect(self):
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir, 0o700)
+
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=FULL")
+        conn.execute(SCHEMA)
+
+        #Journals written before barrier existed
+        if "barrier" not in [column[1] for column in conn.execute("PRAGMA table_info(entries)")]:
+            conn.execute("ALTER TABLE entries ADD COLUMN barrier INTEGER NOT NULL DEFAULT 0")
+        return conn
+
+    def append(self, entry):
+        fields = [field for field in COLUMNS if field in entry]
+
+        with closing(self._connect()) as conn:
+            with conn:
+                cursor = conn.execute(
+                    "INSERT INTO entries (created, " + ", ".join(fields) + ") VALUES (?" + ", ?" * len(fields) + ")",
+                    [time.time()] + [entry[field] for field in fields]
+                )
+                return cursor.lastrowid
+
+    def pending(self, sn_base, sn_user, limit=None):
+        query = "SELECT " + ", ".join(COLUMNS) + " FROM entries WHERE state = 'pending' AND sn_base = ? AND sn_user = ? ORDER BY id"
+        if limit:
+            query += " LIMIT %d" % int(limit)
+
+        with closing(self._connect()) as conn:
+            return [dict(zip(COLUMNS, row)) for row in conn.execute(query, (sn_base, sn_user))]
+
+    def finish(self, ids, state, result=None):
+        # state is done or failed; pending keeps the entries for the next flush
+        with closing(self._connect()) as conn:
+            with conn:
+                conn.executemany(
+                    "UPDATE entries SET state = ?, result = ?, attempts = attempts + 1 WHERE id = ?",
+                    [(state, json.dumps(result), entry_id) for entry_id in ids]
+                )
+
+    def counts(self, sn_base, sn_user):
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT state, COUNT(*) FROM entries WHERE sn_base = ? AND sn_user = ? GROUP BY state", (sn_base, sn_user))
+            return dict(rows)
+
+    def failed(self, sn_base, sn_user):
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT " + ", ".join(COLUMNS) + " FROM entries WHERE state = 'failed' AND sn_base = ? AND sn_user = ? ORDER BY id", (sn_base, sn_user))
+            return [dict(zip(COLUMNS, row)) for row in rows]
+
+    def purge(self, sn_base, sn_user, states):
+        with closing(self._connect()) as conn:
+            with conn:
+                marks = ", ".join("?" * len(states))
+                rows = conn.execute("SELECT filename FROM entries WHERE sn_base = ? AND sn_user = ? AND state IN (" + marks + ")", [sn_base, sn_user] + list(states))
+                for (filename, ) in rows.fetchall():
+                    if filename and os.path.exists(filename):
+                        os.unlink(filename)
+                return conn.execute("DELETE FROM entries WHERE sn_base = ? AND sn_user = ? AND state IN (" + marks + ")", [sn_base, sn_user] + list(states)).rowcount
+
+    @contextmanager
+    def flushing(self):
+        # Only one flush at a time per outbox
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir, 0o700)
+
+        with open(self.path + ".flush.lock", "a") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError):
+                raise OutboxBusy("another flush of %s is running" % self.path)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def outbox_failure(response):
+    # True when a write failed in a way worth keeping it for later: no answer
+    # at all (the request raised) or a throttling/unavailable status
+    if isinstance(response, dict):
+        return "mensaje" in response
+    return getattr(response, "status_code", None) in OUTBOX_RETRY_STATUS
+
+
+def enqueue(module_name, entry, **module_args):
+    # Appends one write ({"method", "uri", "body", "params", "target", "number",
+    # "filename", "key", "key_field"}) to the outbox and returns the
+    # acknowledgement the module reports. Files are copied to the spool so the
+    # originals can go away before the flush.
+    outbox = SgtOutbox(module_args["cache_dir"])
+    filename = entry.get("filename")
+
+    if filename:
+        if not os.path.isdir(outbox.spool_dir):
+            os.makedirs(outbox.spool_dir, 0o700)
+        spooled = os.path.join(outbox.spool_dir, uuid.uuid4().hex + "-" + os.path.basename(filename))
+        shutil.copyfile(filename, spooled)
+        with open(spooled, "rb") as f:
+            os.fsync(f.fileno())
+        filename = spooled
+
+    entry_id = outbox.append({
+        "sn_base":      module_args["sn_base"],
+        "sn_user":      module_args["sn_user"],
+        "module":       module_name,
+        "method":       entry["method"],
+        "uri":          entry["uri"],
+        "target":       entry.get("target") or None,
+        "number":       entry.get("number"),
+        "params":       json.dumps(entry["params"]) if entry.get("params") else None,
+        "body":         json.dumps(entry["body"]) if entry.get("body") is not None else None,
+        "filename":     filename,
+        "key_field":    entry.get("key_field"),
+        "key":          entry.get("key"),
+        "barrier":      1 if entry.get("barrier") else 0
+    })
+
+    return {
+        "queued":   entry_id,
+        "outbox":   outbox.path,
+        "method":   entry["method"],
+        "uri":      entry["uri"],
+        "target":   entry.get("target") or entry.get("number")
+    }
+
+
+def through_outbox(send, module_name, entry, **module_args):
+    # Runs send() according to the outbox option of the module: never (plain
+    # write), always (journaled without trying), buffer (journaled and sent
+    # with the other updates of the record after buffer_window seconds) or
+    # on_failure (journaled when the instance did not answer or was
+    # throttling). Returns the response or the {"queued": ...} acknowledgement.
+    mode = module_args.get("outbox") or "never"
+    if mode == "always":
+        return enqueue(module_name, entry, **module_args)
+
+    if mode == "buffer":
+        queued = enqueue(BUFFER_MODULE, entry, **module_args)
+        queued["flushed"] = flush_due(**module_args)
+        schedule_flush(**module_args)
+        return queued
+
+    response = send()
+    if mode == "on_failure" and outbox_failure(response):
+        queued = enqueue(module_name, entry, **module_args)
+        queued["failure"] = response if isinstance(response, dict) else {"status_code": response.status_code}
+        return queued
+
+    return response
+
+
+def _merge(body, update):
+    for field, value in update.items():
+        if field in JOURNAL_FIELDS and body.get(field) and value:
+            body[field] = body[field] + "\n\n" + value
+        elif value is not None or field not in body:
+            body[field] = value
+    return body
+
+
+def _operations(rows):
+    # Updates of the same record become one write at the position of the
+    # first of them, and creates with the same correlation key one create;
+    # everything else keeps its own place. A barrier update (a state that must
+    # reach the instance before the next one) ends the merge at the next
+    # change of state.
+    operations = []
+    updates = {}
+    creates = {}
+
+    for row in rows:
+        body = json.loads(row["body"]) if row["body"] else None
+
+        if row["method"] in ("PUT", "PATCH") and row["target"]:
+            key = (row["uri"], row["target"])
+            merged = updates.get(key)
+            if merged and (not merged["barrier"] or (body or {}).get("state") == merged["body"].get("state")):
+                _merge(merged["body"], body or {})
+                merged["ids"].append(row["id"])
+                merged["barrier"] = merged["barrier"] or row["barrier"]
+                continue
+            operation = updates[key] = dict(row, body=body or {}, ids=[row["id"]])
+        elif row["method"] == "POST" and row["key"]:
+            key = (row["uri"], row["key_field"], row["key"])
+            if key in creates:
+                creates[key]["ids"].append(row["id"])
+                continue
+            operation = creates[key] = dict(row, body=body, ids=[row["id"]])
+        else:
+            operation = dict(row, body=body, ids=[row["id"]])
+
+        operations.append(operation)
+
+    return operations
+
+
+def _url(operation):
+    url = operation["uri"] + ("/" + operation["target"] if operation["target"] else "")
+    if operation["params"]:
+        url += "?" + urlencode(json.loads(operation["params"]))
+    return url
+
+
+def _buffered(row):
+    return row["module"] == BUFFER_MODULE and row["method"] in ("PUT", "PATCH")
+
+
+def _due(rows, due_before):
+    # Buffered updates of the records whose oldest pending update is older
+    # than due_before. A record is always flushed as a whole to keep its
+    # order, so one with other queued writes is left to sgt_outbox.
+    oldest = {}
+    others = set()
+    for row in rows:
+        key = (row["uri"], row["target"] or row["number"]) if row["method"] in ("PUT", "PATCH") else row["id"]
+        row["record"] = key
+        oldest.setdefault(key, row["created"])
+        if not _buffered(row):
+            others.add(key)
+
+    return [row for row in rows if row["record"] not in others and oldest[row["record"]] <= due_before]
+
+
+def _prepare(rows, **module_args):
+    # Writes are journaled with choice labels and reference names, so queuing
+    # never waits for the instance; they get their raw values and sys_ids
+    # here, one choice list and one lookup per table. Returns {id: errors}.
+    by_table = {}
+    for row in rows:
+        match = re.search(r"/table/(\w+)", row["uri"])
+        if match and row["body"] and row["method"] in ("POST", "PUT", "PATCH"):
+            by_table.setdefault(match.group(1), []).append(row)
+
+    errors = {}
+    for table, table_rows in by_table.items():
+        choices = load_choices(table, FLUSH_CHOICES.get(table), **module_args)
+        bodies = []
+        for row in table_rows:
+            body = json.loads(row["body"])
+            for field, value in body.items():
+                if field in choices and isinstance(value, str) and value:
+                    body[field] = choice_value(choices, field, value, value)
+            bodies.append(body)
+
+        bodies, table_errors = resolve_references(bodies, table, **module_args)
+        for row, body, row_errors in zip(table_rows, bodies, table_errors):
+            row["body"] = json.dumps(body)
+            if row_errors:
+                errors[row["id"]] = row_errors
+
+    return errors
+
+
+def flush(due_before=None, **module_args):
+    # Drains the pending entries of sn_base/sn_user (only the buffered records
+    # due before due_before when given). A throttled or unavailable instance stops
+    # the flush and keeps the rest for the next one; a write the instance
+    # rejects (4xx) is marked failed so it does not block the others.
+    outbox = SgtOutbox(module_args["cache_dir"])
+    base = module_args["sn_base"]
+    client = get_client(**module_args)
+    report = {"entries": 0, "writes": 0, "done": 0, "failed": 0, "stopped": None}
+
+    with outbox.flushing():
+        rows = outbox.pending(base, module_args["sn_user"], module_args.get("max_entries"))
+        if due_before is not None:
+            rows = _due(rows, due_before)
+        report["entries"] = len(rows)
+
+        #Updates queued by number get their sys_id first, one query per table
+        by_uri = {}
+        for row in rows:
+            if row["method"] in ("PUT", "PATCH") and not row["target"] and row["number"]:
+                by_uri.setdefault(row["uri"], []).append(row)
+
+        for uri, uri_rows in by_uri.items():
+            found = lookup_numbers(base + uri, [row["number"] for row in uri_rows], {"sysparm_fields": "sys_id,number"}, **module_args)
+            for row in uri_rows:
+                record = found.get(row["number"])
+                if record and "mensaje" in record:
+                    report["stopped"] = record["mensaje"]
+                    return report
+                if record:
+                    row["target"] = record["sys_id"]
+                else:
+                    outbox.finish([row["id"]], "failed", {"mensaje": "ERROR, record not found: " + str(row["number"])})
+                    report["failed"] += 1
+
+        rows = [row for row in rows if row["target"] or row["method"] not in ("PUT", "PATCH")]
+        errors = _prepare(rows, **module_args)
+        for row in rows:
+            if row["id"] in errors:
+                outbox.finish([row["id"]], "failed", {"mensaje": "ERROR, " + "; ".join(errors[row["id"]])})
+                report["failed"] += 1
+
+        operations = _operations([row for row in rows if row["id"] not in errors])
+        report["writes"] = len(operations)
+
+        #Creates with a correlation key that reached the instance before are done
+        keyed = {}
+        for operation in operations:
+            if operation["method"] == "POST" and operation["key"]:
+                keyed.setdefault((operation["uri"], operation["key_field"]), []).append(operation)
+
+        for (uri, field), keyed_operations in keyed.items():
+            found = lookup_numbers(base + uri, [op["key"] for op in keyed_operations], {"sysparm_fields": "sys_id,number," + field},
+                                   field=field, max_per_number=2, **module_args)
+            for operation in keyed_operations:
+                record = found.get(operation["key"])
+                if record and "mensaje" not in record:
+                    outbox.finish(operation["ids"], "done", {"status_code": 200, "result": record, "existing": True})
+                    operation["finished"] = True
+                    report["done"] += len(operation["ids"])
+
+        def settle(operation, status_code, body):
+            if status_code in (200, 201, 204):
+                outbox.finish(operation["ids"], "done", {"status_code": status_code, "result": (body or {}).get("result", body)})
+                report["done"] += len(operation["ids"])
+                if operation["filename"] and os.path.exists(operation["filename"]):
+                    os.unlink(operation["filename"])
+                return True
+            if status_code is None or status_code in OUTBOX_RETRY_STATUS:
+                report["stopped"] = "status %s: %s" % (status_code, body)
+                return False
+            outbox.finish(operation["ids"], "failed", {"status_code": status_code, "result": body})
+            report["failed"] += len(operation["ids"])
+            return True
+
+        def send_batch(batch):
+            try:
+                responses = client.batch(
+                    base + module_args.get("batch_uri", "/api/now/v1/batch"),
+                    [{"method": op["method"], "url": _url(op), "body": op["body"]} for op in batch],
+                    timeout=module_args["timeout"]
+                )
+            except Exception as e:
+                report["stopped"] = str(e)
+                return False
+
+            #Order matters: after the first write to stop, the rest wait too
+            for operation, response in zip(batch, responses):
+                if not settle(operation, response["status_code"], response["body"]):
+                    return False
+            return True
+
+        batch = []
+        for operation in operations:
+            if operation.get("finished"):
+                continue
+
+            if not operation["filename"]:
+                batch.append(operation)
+                if len(batch) >= max(module_args.get("batch_size", 50), 1):
+                    if not send_batch(batch):
+                        return report
+                    batch = []
+                continue
+
+            if batch and not send_batch(batch):
+                return report
+            batch = []
+
+            try:
+                with open(operation["filename"], "rb") as data:
+                    size = os.fstat(data.fileno()).st_size
+                    response = client.post(
+                        base + _url(operation),
+                        headers={"Content-Type": "*/*", "Accept": "application/json", "Content-Length": str(size)},
+                        data=data if size > 0 else b"",
+                        timeout=module_args["timeout"]
+                    )
+            except (IOError, OSError) as e:
+                if not os.path.exists(operation["filename"]):
+                    settle(operation, 400, {"mensaje": "ERROR, spooled file is gone: " + str(e)})
+                    continue
+                report["stopped"] = str(e)
+                return report
+            except Exception as e:
+                report["stopped"] = str(e)
+                return report
+
+            try:
+                body = response.json()
+            except ValueError:
+                body = response.text
+            if not settle(operation, response.status_code, body):
+                return report
+
+        if batch:
+            send_batch(batch)
+
+    return report
+
+
+def flush_due(**module_args):
+    # Sends the buffered records older than buffer_window; None when another
+    # flush holds the outbox or nothing was due
+    try:
+        report = flush(due_before=time.time() - module_args["buffer_window"], **module_args)
+    except OutboxBusy:
+        return None
+    return report if report["entries"] else None
+
+
+def schedule_flush(**module_args):
+    # Flushes again once the window of the writes just buffered is over. Only
+    # the persistent controller daemon lives that long; in short lived
+    # processes the timer dies with them and the next write or sgt_outbox
+    # flushes instead.
+    key = (module_args["cache_dir"], module_args["sn_base"], module_args["sn_user"])
+
+    def fire():
+        with _TIMERS_LOCK:
+            _TIMERS.pop(key, None)
+        try:
+            flush_due(**module_args)
+        except Exception:
+            return
+        pending = SgtOutbox(module_args["cache_dir"]).pending(module_args["sn_base"], module_args["sn_user"])
+        if any(_buffered(row) for row in pending):
+            schedule_flush(**module_args)
+
+    with _TIMERS_LOCK:
+        if key in _TIMERS:
+            return
+        timer = _TIMERS[key] = threading.Timer(max(module_args["buffer_window"], 0) + 0.1, fire)
+        timer.daemon = True
+        timer.start()
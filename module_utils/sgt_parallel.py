@@ -0,0 +1,160 @@
+# coding=utf-8
+
+from __future__ import (absolute_import, division, print_function)
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from ansible.module_utils.sgt_client import get_client
+
+
+# Results that mean the instance is overloaded: throttling, server and gateway
+# errors, or no answer at all (status_code None)
+CONGESTION_STATUS = (429, 500, 502, 503, 504)
+
+# Smoothed latency over this many times the best one seen is a spike
+LATENCY_SPIKE = 2.0
+DECREASE_FACTOR = 0.5
+
+# Adaptive runs kept in the http_stats of a module run
+CONCURRENCY_REPORTS = 10
+
+
+def in_context(func):
+    # func run in a copy of the caller's context, so the worker threads share
+    # the time budget of the module run
+    context = contextvars.copy_context()
+    return lambda *args: context.copy().run(func, *args)
+
+
+def run_parallel(func, items, workers=4):
+    # Applies func to every item with at most `workers` calls in flight and
+    # returns the results in input order. func is expected to catch its own
+    # errors and return them as part of its result.
+    items = list(items)
+    if not items:
+        return []
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(items)))) as executor:
+        return list(executor.map(in_context(func), items))
+
+
+def _congested(result):
+    if not isinstance(result, dict) or "status_code" not in result:
+        return False
+    return result["status_code"] is None or result["status_code"] in CONGESTION_STATUS
+
+
+class AimdController(object):
+    # Additive increase, multiplicative decrease of the calls in flight. Every
+    # healthy result adds 1/limit (about one more call per round of results);
+    # a congested result or a latency spike halves the limit, once per round:
+    # results of calls started before the last decrease are not counted again.
+
+    def __init__(self, initial, minimum, maximum):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.smoothed = None
+        self.baseline = None
+        self.last_decrease = 0.0
+        self.decreases = 0
+        self.start = time.time()
+        self.history = [{"t": 0.0, "limit": int(self.limit), "in_flight": 0, "reason": "start"}]
+
+    def allowed(self):
+        return int(self.limit)
+
+    def update(self, started, latency, congested, in_flight):
+        self.smoothed = latency if self.smoothed is None else 0.8 * self.smoothed + 0.2 * latency
+        spike = self.baseline is not None and self.smoothed > LATENCY_SPIKE * self.baseline
+        previous = int(self.limit)
+
+        if congested or spike:
+            if started < self.last_decrease:
+                return
+            self.limit = max(self.minimum, self.limit * DECREASE_FACTOR)
+            self.last_decrease = time.time()
+            self.decreases += 1
+            #The latency after backing off is the new reference
+            self.baseline = self.smoothed = None
+            reason = "congested" if congested else "latency"
+        else:
+            self.baseline = self.smoothed if self.baseline is None else min(self.baseline, self.smoothed)
+            self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            reason = "healthy"
+
+        if int(self.limit) != previous:
+            self.history.append({
+                "t":            round(time.time() - self.start, 3),
+                "limit":        int(self.limit),
+                "in_flight":    in_flight,
+                "reason":       reason
+            })
+
+    def report(self, items):
+        limits = [point["limit"] for point in self.history]
+        return {
+            "items":        items,
+            "initial":      limits[0],
+            "final":        int(self.limit),
+            "max":          max(limits),
+            "min":          min(limits),
+            "decreases":    self.decreases,
+            "elapsed":      round(time.time() - self.start, 3),
+            "history":      self.history
+        }
+
+
+def run_adaptive(func, items, workers=4, max_workers=16, congested=None, pressure=None):
+    # run_parallel with the calls in flight driven by an AimdController, from
+    # `workers` up to `max_workers`. congested(result) tells an overloaded
+    # answer; pressure() is a counter of throttling seen elsewhere (the client
+    # retries 429/5xx itself, so a call may succeed after backing off).
+    # Returns (results in input order, report).
+    items = list(items)
+    controller = AimdController(workers, 1, max_workers)
+    congested = congested or _congested
+    results = [None] * len(items)
+
+    if not items:
+        return results, controller.report(0)
+
+    running = {}
+    position = 0
+    func = in_context(func)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(controller.maximum, len(items)))) as executor:
+        while position < len(items) or running:
+            while position < len(items) and len(running) < controller.allowed():
+                running[executor.submit(func, items[position])] = (position, time.time(), pressure() if pressure else 0)
+                position += 1
+
+            done, not_done = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, started, seen = running.pop(future)
+                results[index] = future.result()
+                throttled = pressure is not None and pressure() > seen
+                controller.update(started, time.time() - started, congested(results[index]) or throttled, len(running))
+
+    return results, controller.report(len(items))
+
+
+def parallel_map(func, items, workers=4, **module_args):
+    # run_parallel, or run_adaptive when the module asks for
+    # adaptive_concurrency; the adaptive reports go to the run's http_stats.
+    # Only the retries of this run count as pressure.
+    if not module_args.get("adaptive_concurrency"):
+        return run_parallel(func, items, workers)
+
+    max_workers = max(module_args.get("adaptive_max_workers") or workers, workers)
+    module_args["pool_maxsize"] = max(module_args.get("pool_maxsize") or 10, max_workers)
+    client = get_client(**module_args)
+
+    results, report = run_adaptive(func, items, workers, max_workers, pressure=lambda: client.stats["retries"])
+
+    reports = client.stats.setdefault("concurrency", [])
+    reports.append(report)
+    del reports[:-CONCURRENCY_REPORTS]
+
+    return results
@@ -0,0 +1,180 @@
+# coding=utf-8
+
+# Dependency aware executor for sgt_release_pipeline. A plan is a list of steps
+# ({"name", "module", "args", "needs"}); a step runs as soon as every step it
+# needs has finished, with at most `workers` steps in flight. Step args may
+# reference the result of earlier steps as "${step.path}", which also makes
+# them a dependency.
+
+from __future__ import (absolute_import, division, print_function)
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+REFERENCE_RE = re.compile(r"\$\{([A-Za-z0-9_\-]+)((?:\.[A-Za-z0-9_\-]+)*)\}")
+
+
+def _references(value):
+    if isinstance(value, dict):
+        return set().union(*[_references(v) for v in value.values()]) if value else set()
+    if isinstance(value, (list, tuple)):
+        return set().union(*[_references(v) for v in value]) if value else set()
+    if isinstance(value, str):
+        return set(match.group(1) for match in REFERENCE_RE.finditer(value))
+    return set()
+
+
+def build_graph(steps):
+    # Returns {name: set(needs)}; raises ValueError on duplicated or unknown
+    # names and on cycles
+    graph = {}
+
+    for step in steps:
+        name = step.get("name")
+        if not name:
+            raise ValueError("every step needs a name")
+        if name in graph:
+            raise ValueError("duplicated step name: " + name)
+        graph[name] = set(step.get("needs") or []) | _references(step.get("args") or {})
+
+    for name, needs in graph.items():
+        unknown = needs - set(graph)
+        if unknown:
+            raise ValueError("step %s needs unknown steps: %s" % (name, ", ".join(sorted(unknown))))
+
+    #Kahn's algorithm, whatever is left belongs to a cycle
+    pending = dict((name, set(needs)) for name, needs in graph.items())
+    while pending:
+        ready = [name for name, needs in pending.items() if not needs]
+        if not ready:
+            raise ValueError("dependency cycle between steps: " + ", ".join(sorted(pending)))
+        for name in ready:
+            del pending[name]
+        for needs in pending.values():
+            needs.difference_update(ready)
+
+    return graph
+
+
+def _lookup(results, name, path):
+    value = results[name]
+    keys = [key for key in path.split(".") if key]
+
+    #${release.sys_id} is a shorthand for ${release.message.sys_id}
+    if keys and isinstance(value, dict) and keys[0] not in value and isinstance(value.get("message"), dict):
+        value = value["message"]
+
+    for key in keys:
+        if isinstance(value, list):
+            value = value[int(key)]
+        else:
+            value = value[key]
+
+    return value
+
+
+def resolve_args(value, results):
+    # Replaces every ${step.path} by the value found in the result of the step.
+    # A string made of a single reference takes the value as is (dict, list...).
+    if isinstance(value, dict):
+        return dict((k, resolve_args(v, results)) for k, v in value.items())
+    if isinstance(value, list):
+        return [resolve_args(v, results) for v in value]
+    if not isinstance(value, str):
+        return value
+
+    match = REFERENCE_RE.fullmatch(value)
+    if match:
+        return _lookup(results, match.group(1), match.group(2))
+
+    return REFERENCE_RE.sub(lambda m: str(_lookup(results, m.group(1), m.group(2))), value)
+
+
+def critical_path(graph, timings):
+    # Longest chain of dependent steps by run time, i.e. the lower bound of the
+    # pipeline wall time whatever the number of workers
+    finish = {}
+    previous = {}
+
+    def longest(name):
+        if name not in finish:
+            needs = [need for need in graph[name] if need in timings]
+            before = max(needs, key=longest) if needs else None
+            previous[name] = before
+            finish[name] = (longest(before) if before else 0.0) + timings.get(name, 0.0)
+        return finish[name]
+
+    names = [name for name in graph if name in timings]
+    if not names:
+        return [], 0.0
+
+    last = max(names, key=longest)
+    total = round(finish[last], 3)
+    path = []
+    while last is not None:
+        path.append(last)
+        last = previous[last]
+
+    return list(reversed(path)), total
+
+
+def run_pipeline(steps, run_step, workers=4):
+    # run_step(step, args) runs one step and returns its module result. Steps
+    # after a failed one are skipped; independent branches carry on. Returns
+    # ({name: result}, report).
+    graph = build_graph(steps)
+    by_name = dict((step["name"], step) for step in steps)
+    results = {}
+    timings = {}
+    started = {}
+    lock = threading.Lock()
+    start = time.time()
+
+    def execute(name):
+        step = by_name[name]
+        begin = time.time()
+        try:
+            result = run_step(step, resolve_args(step.get("args") or {}, results))
+        except Exception as e:
+            result = {"failed": True, "msg": "Step %s could not run: %s" % (name, e)}
+        with lock:
+            started[name] = round(begin - start, 3)
+            timings[name] = round(time.time() - begin, 3)
+        return name, result
+
+    waiting = dict((name, set(needs)) for name, needs in graph.items())
+    running = set()
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        while waiting or running:
+            for name in sorted(waiting):
+                needs = waiting[name]
+                if any(results.get(need, {}).get("failed") or results.get(need, {}).get("skipped") for need in needs):
+                    results[name] = {"skipped": True, "msg": "Skipped, a step it needs did not succeed"}
+                    del waiting[name]
+                elif not needs - set(results):
+                    running.add(executor.submit(execute, name))
+                    del waiting[name]
+
+            if not running:
+                continue
+
+            done, not_done = wait(running, return_when=FIRST_COMPLETED)
+            running = set(not_done)
+            for future in done:
+                name, result = future.result()
+                results[name] = result
+
+    path, path_time = critical_path(graph, timings)
+    report = {
+        "elapsed":              round(time.time() - start, 3),
+        "steps_time":           round(sum(timings.values()), 3),
+        "critical_path":        path,
+        "critical_path_time":   path_time,
+        "timings":              timings,
+        "started":              started
+    }
+
+    return results, report
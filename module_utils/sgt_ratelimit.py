@@ -0,0 +1,84 @@
+# coding=utf-8
+
+from __future__ import (absolute_import, division, print_function)
+import fcntl
+import hashlib
+import os
+import struct
+import time
+
+
+class SgtRateLimiter(object):
+    # Token bucket shared by every process of the host talking to the same
+    # instance as the same user (all the forks of a play). The bucket is two
+    # doubles (tokens, last refill) in a small file under an exclusive flock.
+    # A caller takes its token even when the bucket is empty and sleeps off the
+    # debt outside the lock, so waiters are served in arrival order without
+    # polling.
+
+    _FORMAT = "<dd"
+
+    def __init__(self, cache_dir, sn_base, sn_user, rate, burst):
+        self.rate = float(rate)
+        self.burst = max(float(burst), 1.0)
+        self.cache_dir = os.path.expanduser(cache_dir)
+        key = hashlib.sha1((sn_base + "|" + sn_user).encode("utf-8")).hexdigest()[:16]
+        self.path = os.path.join(self.cache_dir, "ratelimit-" + key + ".bucket")
+
+    def _reserve(self, limit=None):
+        # Takes one token and returns the seconds to wait before using it, or
+        # None without taking it when the wait would be over limit seconds
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir, 0o700)
+
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            now = time.time()
+            data = os.pread(fd, struct.calcsize(self._FORMAT), 0)
+
+            if len(data) == struct.calcsize(self._FORMAT):
+                tokens, updated = struct.unpack(self._FORMAT, data)
+                tokens = min(self.burst, tokens + max(0.0, now - updated) * self.rate)
+            else:
+                tokens = self.burst
+
+            delay = max(0.0, (1 - tokens) / self.rate)
+            if limit is not None and delay > limit:
+                return None
+
+            os.pwrite(fd, struct.pack(self._FORMAT, tokens - 1, now), 0)
+        finally:
+            os.close(fd)
+
+        return delay
+
+    def acquire(self, remaining=None):
+        # Blocks until a request may be sent; returns the seconds waited, or
+        # None at once when that would take more than remaining seconds
+        try:
+            delay = self._reserve(remaining)
+        except (IOError, OSError):
+            #A bucket that can not be shared does not stop the module
+            return 0.0
+
+        if delay is None:
+            return None
+
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+
+def rate_limiter(**module_args):
+    # Limiter for the module options, None when rate_limit is off
+    if not module_args.get("rate_limit") or module_args["rate_limit"] <= 0:
+        return None
+
+    return SgtRateLimiter(
+        module_args.get("cache_dir") or "~/.ansible/sgt_cache",
+        module_args["sn_base"],
+        module_args["sn_user"],
+        module_args["rate_limit"],
+        module_args.get("rate_burst") or module_args["rate_limit"]
+    )
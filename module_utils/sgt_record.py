@@ -0,0 +1,207 @@
+# coding=utf-8
+
+from __future__ import (absolute_import, division, print_function)
+import hashlib
+import json
+import time
+
+try:
+    from urllib.parse import quote
+except ImportError:
+    from urllib import quote
+
+import requests
+
+from ansible.module_utils.sgt_cache import SgtDiskCache, table_from_uri
+from ansible.module_utils.sgt_choice import TABLE_PARENTS
+from ansible.module_utils.sgt_client import get_client
+from ansible.module_utils.sgt_parallel import parallel_map
+
+
+# Encoded length of the numberIN list of one request, well below the URL
+# limits of the instance and of the proxies in front of it
+MAX_QUERY_LENGTH = 1500
+
+
+def field_matches(current, desired):
+    # current comes from sysparm_display_value=all, so a field matches when the
+    # desired value is either its stored value or its display value
+    if isinstance(current, dict):
+        candidates = (current.get("value"), current.get("display_value"))
+    else:
+        candidates = (current, )
+
+    return any(str(candidate) == str(desired) for candidate in candidates if candidate is not None)
+
+
+def changed_fields(current, desired):
+    return dict(
+        (field, value) for field, value in desired.items()
+        if value is not None and not field_matches(current.get(field), value)
+    )
+
+
+def sparse_update(endpoint, sys_id, desired, **module_args):
+    # Reads only the fields about to be written, and PATCHes only those that
+    # differ. Returns (response, diff); when nothing differs no write is made,
+    # diff is empty and response is the read of the record.
+    client = get_client(**module_args)
+    desired = dict((field, value) for field, value in desired.items() if value is not None)
+
+    response = client.get(
+        endpoint + "/" + sys_id,
+        params={
+            "sysparm_fields": ",".join(sorted(set(desired) | set(["sys_id", "number"]))),
+            "sysparm_display_value": "all",
+            "sysparm_exclude_reference_link": "true"
+        },
+        timeout=module_args["timeout"]
+    )
+
+    if response.status_code != 200:
+        return response, {}
+
+    diff = changed_fields(response.json()["result"], desired)
+    if not diff:
+        return response, {}
+
+    response = client.patch(
+        endpoint + "/" + sys_id,
+        data=json.dumps(diff),
+        timeout=module_args["timeout"]
+    )
+
+    return response, diff
+
+
+def number_chunks(numbers, max_length=MAX_QUERY_LENGTH):
+    # Splits numbers so that every "numberIN" list stays under max_length
+    # characters once URL encoded
+    chunks = []
+    chunk = []
+    length = 0
+
+    for number in numbers:
+        size = len(quote(str(number), safe="")) + 3
+        if chunk and length + size > max_length:
+            chunks.append(chunk)
+            chunk = []
+            length = 0
+        chunk.append(number)
+        length += size
+
+    if chunk:
+        chunks.append(chunk)
+
+    return chunks
+
+
+def lookup_numbers(endpoint, numbers, params=None, field="number", max_per_number=None, **module_args):
+    # Reads many records by number (or any other indexed field) with one
+    # numberIN query per chunk, chunks fetched concurrently. Returns
+    # {number: record} in input order, with None for the numbers that were not
+    # found and {"mensaje": ...} when the query of their chunk failed.
+    # max_per_number caps the records read per chunk: the instance ignores
+    # unknown fields in a query, which then matches the whole table.
+    numbers = list(dict.fromkeys(str(number) for number in numbers))
+    workers = max(module_args.get("lookup_workers") or 1, 1)
+    module_args["pool_maxsize"] = max(module_args.get("pool_maxsize") or 10, workers)
+    client = get_client(**module_args)
+
+    def fetch(chunk):
+        chunk_params = dict(params or {})
+        chunk_params["sysparm_query"] = field + "IN" + ",".join(chunk)
+        if chunk_params.get("sysparm_fields") and field not in chunk_params["sysparm_fields"].split(","):
+            chunk_params["sysparm_fields"] += "," + field
+
+        try:
+            return dict(
+                (record.get(field), record)
+                for record in client.iter_records(endpoint, params=chunk_params, timeout=module_args["timeout"],
+                                                  max_records=max_per_number and max_per_number * len(chunk))
+                if record.get(field) in chunk
+            )
+        except Exception as e:
+            error = {"mensaje": "ERROR, records could not get information: " + str(e)}
+            return dict((number, error) for number in chunk)
+
+    found = {}
+    for records in parallel_map(fetch, number_chunks(numbers), workers, **module_args):
+        found.update(records)
+
+    return dict((number, found.get(number)) for number in numbers)
+
+
+def correlation_key(*parts):
+    # Key derived from the fields that identify a record for the caller (e.g.
+    # release, short description and order of a task)
+    return "sgt-" + hashlib.sha1("|".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+
+
+def has_field(endpoint, field, **module_args):
+    # True or False when sys_dictionary says whether the table of endpoint (or
+    # one of its parents) has field, None when it can not be read. Cached in
+    # cache_dir for reference_cache_ttl seconds.
+    table = table_from_uri(endpoint)
+    cache = SgtDiskCache(module_args["cache_dir"], "dictionary")
+    key = "|".join((module_args["sn_base"].rstrip("/"), table, field))
+
+    try:
+        entry = cache.get(key)
+    except (IOError, OSError):
+        entry = None
+    if entry is not None and time.time() - entry["ts"] <= module_args.get("reference_cache_ttl", 86400):
+        return entry["value"]
+
+    params = {
+        "sysparm_query": "nameIN" + ",".join(TABLE_PARENTS.get(table, (table, ))) + "^element=" + field,
+        "sysparm_fields": "name,element"
+    }
+    try:
+        records = list(get_client(**module_args).iter_records(
+            module_args["sn_base"] + "/api/now/v2/table/sys_dictionary", params=params,
+            timeout=module_args["timeout"], max_records=1))
+    except Exception:
+        return None
+
+    found = any(record.get("element") == field for record in records)
+    try:
+        cache.set(key, found)
+    except (IOError, OSError):
+        pass
+    return found
+
+
+def key_lookup(endpoint, keys, field, params=None, **module_args):
+    # lookup_numbers of correlation keys, refused when sys_dictionary says the
+    # table has no such field (the query would match every record)
+    if has_field(endpoint, field, **module_args) is False:
+        raise ValueError("ERROR, %s is not a field of %s, records can not be keyed on it" % (field, table_from_uri(endpoint)))
+
+    return lookup_numbers(endpoint, keys, params, field=field, max_per_number=2, **module_args)
+
+
+def create_once(endpoint, data, key, field, **module_args):
+    # POSTs data with key stored in field unless a record with that key exists
+    # already. A timed out POST is followed by the same lookup before being sent
+    # again, so retrying never duplicates the record. Returns (response,
+    # existed); the response of an existing record looks like a create one.
+    client = get_client(**module_args)
+    data = dict(data)
+    data[field] = key
+    attempt = 0
+
+    while True:
+        found = key_lookup(endpoint, [key], field, {"sysparm_fields": "sys_id," + field}, **module_args)[key]
+        if found and "mensaje" in found:
+            return found, False
+        if found:
+            response = client.get(endpoint + "/" + found["sys_id"], timeout=module_args["timeout"])
+            return response, attempt == 0
+
+        try:
+            return client.post(endpoint, data=json.dumps(data), timeout=module_args["timeout"]), False
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
+            if attempt >= module_args.get("retries", 3):
+                raise
+            attempt += 1
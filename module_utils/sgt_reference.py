@@ -0,0 +1,195 @@
+# coding=utf-8
+
+from __future__ import (absolute_import, division, print_function)
+import re
+import time
+
+from ansible.module_utils.sgt_cache import SgtDiskCache
+from ansible.module_utils.sgt_choice import TABLE_PARENTS
+from ansible.module_utils.sgt_client import get_client
+
+
+# Base reference fields written by the modules. Their table is taken from
+# sys_dictionary (reference) of the written table; when it can not be
+# confirmed the name is left for the instance. Custom u_* fields are only
+# looked up when reference_tables names their table.
+REFERENCE_FIELDS = ("assignment_group", "assigned_to")
+
+# Columns a name given by the user may match, "name" for other tables
+REFERENCE_COLUMNS = {
+    "sys_user":     ("user_name", "name"),
+}
+
+NAMES_PER_QUERY = 100
+
+SYS_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+
+def _dictionary_tables(table, fields, **module_args):
+    # {field: referenced table} from sys_dictionary for table and its parents,
+    # cached on disk like the lookups; fields it does not confirm are left out
+    cache = SgtDiskCache(module_args["cache_dir"], "references")
+    prefix = "|".join((module_args["sn_base"].rstrip("/"), "sys_dictionary", table)) + "|"
+    ttl = module_args.get("reference_cache_ttl", 86400)
+    tables = {}
+    missing = []
+
+    for field in fields:
+        try:
+            entry = cache.get(prefix + field)
+        except (IOError, OSError):
+            entry = None
+        if entry is not None and time.time() - entry["ts"] <= (ttl if entry["value"] else module_args.get("negative_cache_ttl", 60)):
+            if entry["value"]:
+                tables[field] = entry["value"]
+        else:
+            missing.append(field)
+
+    if not missing:
+        return tables
+
+    parents = TABLE_PARENTS.get(table, (table, ))
+    endpoint = module_args["sn_base"] + "/api/now/v2/table/sys_dictionary"
+    params = {
+        "sysparm_query": "nameIN" + ",".join(parents) + "^elementIN" + ",".join(missing),
+        "sysparm_fields": "name,element,reference"
+    }
+
+    try:
+        records = list(get_client(**module_args).iter_records(endpoint, params=params, timeout=module_args["timeout"]))
+    except Exception:
+        #No read access on sys_dictionary: nothing is confirmed
+        return tables
+
+    #The closest table defining a field wins
+    found = dict((field, "") for field in missing)
+    for name in reversed(parents):
+        for record in records:
+            reference = record.get("reference")
+            reference = reference.get("value", "") if isinstance(reference, dict) else reference
+            if record.get("name") == name and record.get("element") in found and reference:
+                found[record["element"]] = reference
+
+    tables.update((field, reference) for field, reference in found.items() if reference)
+
+    try:
+        cache.set_many(dict((prefix + field, reference) for field, reference in found.items()))
+    except (IOError, OSError):
+        pass
+
+    return tables
+
+
+def _reference_tables(table, fields, **module_args):
+    # {field: (table, columns)} for the fields of the payloads that are looked up
+    explicit = module_args.get("reference_tables") or {}
+    tables = _dictionary_tables(table, sorted(f for f in fields if f in REFERENCE_FIELDS and f not in explicit), **module_args)
+    tables.update((field, explicit[field]) for field in fields if field in explicit)
+    return dict((field, (name, REFERENCE_COLUMNS.get(name, ("name", )))) for field, name in tables.items())
+
+
+def _lookup(table, columns, names, **module_args):
+    # One nameIN query per chunk of names; returns {name: [sys_id, ...]}
+    endpoint = module_args["sn_base"] + "/api/now/v2/table/" + table
+    found = dict((name, []) for name in names)
+
+    for start in range(0, len(names), NAMES_PER_QUERY):
+        chunk = names[start:start + NAMES_PER_QUERY]
+        q = "^OR".join(column + "IN" + ",".join(chunk) for column in columns)
+        params = {"sysparm_query": q, "sysparm_fields": ",".join(("sys_id", ) + columns)}
+
+        for record in get_client(**module_args).iter_records(endpoint, params=params, timeout=module_args["timeout"]):
+            for column in columns:
+                if record.get(column) in found and record["sys_id"] not in found[record[column]]:
+                    found[record[column]].append(record["sys_id"])
+
+    return found
+
+
+def resolve_references(payloads, table, **module_args):
+    # Replaces group, user and application names in the payloads for table by
+    # their sys_ids, looking up every unknown name once (cached on disk for
+    # reference_cache_ttl seconds). Returns (payloads, errors) with one list of
+    # errors per payload; a name that is not found, or matches more than one
+    # record, is an error so the write is never sent.
+    errors = [[] for _ in payloads]
+    if not module_args.get("resolve_references"):
+        return payloads, errors
+
+    fields = set()
+    for payload in payloads:
+        fields.update(field for field, value in payload.items() if _resolvable(value))
+    if not fields & (set(REFERENCE_FIELDS) | set(module_args.get("reference_tables") or {})):
+        return payloads, errors
+
+    tables = _reference_tables(table, fields, **module_args)
+    wanted = {}
+
+    for payload in payloads:
+        for field, value in payload.items():
+            if field in tables and _resolvable(value):
+                wanted.setdefault(tables[field], set()).add(value)
+
+    resolved = {}
+    cache = SgtDiskCache(module_args["cache_dir"], "references")
+    base = module_args["sn_base"].rstrip("/")
+    ttl = module_args.get("reference_cache_ttl", 86400)
+
+    for (table, columns), names in wanted.items():
+        missing = []
+
+        for name in sorted(names):
+            try:
+                entry = cache.get("|".join((base, table, name)))
+            except (IOError, OSError):
+                entry = None
+            #Names not found are kept only negative_cache_ttl seconds
+            if entry is not None and time.time() - entry["ts"] <= (ttl if entry["value"] else module_args.get("negative_cache_ttl", 60)):
+                resolved[(table, name)] = entry["value"]
+            else:
+                missing.append(name)
+
+        if not missing:
+            continue
+
+        try:
+            found = _lookup(table, columns, missing, **module_args)
+        except Exception:
+            #The instance still resolves names itself, so a failed lookup
+            #(e.g. no read access on the table) leaves the names as they are
+            continue
+
+        for name, sys_ids in found.items():
+            resolved[(table, name)] = sys_ids
+
+        try:
+            cache.set_many(dict(("|".join((base, table, name)), sys_ids) for name, sys_ids in found.items()))
+        except (IOError, OSError):
+            pass
+
+    new_payloads = []
+    for idx, payload in enumerate(payloads):
+        payload = dict(payload)
+
+        for field, value in payload.items():
+            if field not in tables or (tables[field][0], value) not in resolved:
+                continue
+
+            sys_ids = resolved[(tables[field][0], value)]
+            if len(sys_ids) == 1:
+                payload[field] = sys_ids[0]
+            elif not sys_ids:
+                errors[idx].append("%s: '%s' not found in %s" % (field, value, tables[field][0]))
+            else:
+                errors[idx].append("%s: '%s' matches %d records in %s" % (field, value, len(sys_ids), tables[field][0]))
+
+        new_payloads.append(payload)
+
+    return new_payloads, errors
+
+
+def _resolvable(value):
+    # sys_ids are sent as they are; names that would break an encoded query
+    # are left to the instance
+    return bool(value) and isinstance(value, str) and not SYS_ID_RE.match(value) \
+        and "," not in value and "^" not in value
@@ -0,0 +1,90 @@
+# coding=utf-8
+
+from __future__ import (absolute_import, division, print_function)
+
+from ansible.module_utils.sgt_choice import cached_choices, choice_label, choice_value, load_choices
+from ansible.module_utils.sgt_client import get_client
+
+
+# rm_task codes shared by sgt_task_info and sgt_task_update. The instance's own
+# choice lists (sys_choice) are used first, these are the fallback.
+TASK_STATE_CODES = { "open": 1, "pending": 5, "in_progress": 2, "closed": 3, "incomplete": 4,  "skipped": 7, "all":""  }
+TASK_STATE_RESOLVE_CODES = { "pre-production":15, "implement":9, "all":"" }
+TASK_STATE_LABELS = { "open": "Open", "pending": "Pending", "in_progress": "Work in Progress", "closed": "Closed Complete", "incomplete": "Closed Incomplete", "skipped": "Closed Skipped" }
+
+STATS_RELEASES_PER_QUERY = 100
+
+TASK_CHOICES = {
+    "state": dict((str(TASK_STATE_CODES[name]), label) for name, label in TASK_STATE_LABELS.items()),
+    "u_state_to_resolve": {"15": "Pre-production", "9": "Implement"}
+}
+
+
+def task_choices(cached_only=False, **module_args):
+    if cached_only:
+        return cached_choices("rm_task", TASK_CHOICES, **module_args)
+    return load_choices("rm_task", TASK_CHOICES, **module_args)
+
+
+def task_state_code(name, choices):
+    # name is an option value (in_progress), a label or a raw value
+    code = choice_value(choices, "state", TASK_STATE_LABELS.get(name, name))
+    if code is None:
+        code = choice_value(choices, "state", name, TASK_STATE_CODES.get(name, name))
+    return str(code)
+
+
+def task_state_resolve_code(name, choices):
+    return str(choice_value(choices, "u_state_to_resolve", name, TASK_STATE_RESOLVE_CODES.get(name, name)))
+
+
+def all_tasks_query(release_number, **module_args):
+    # release_number may also be a list of releases
+    if isinstance(release_number, (list, tuple)):
+        q = ["top_task.numberIN"+",".join(str(number) for number in release_number)]
+    else:
+        q = ["top_task.number="+str(release_number)]
+
+    if module_args["info_tasks_filter"] != "all" or module_args["state_resolve"] != "all":
+        choices = task_choices(**module_args)
+
+        if module_args["info_tasks_filter"] != "all":
+            q.append("state=" + task_state_code(module_args["info_tasks_filter"], choices))
+
+        if module_args["state_resolve"] != "all":
+            q.append("u_state_to_resolve=" + task_state_resolve_code(module_args["state_resolve"], choices))
+
+    return "^".join(q)
+
+
+def tasks_stats(release_numbers, **module_args):
+    # Task counts per release, state and state to resolve from the Aggregate
+    # API; only the counts travel, never the task rows
+    endpoint = module_args["sn_base"] + module_args["stats_uri"]
+    choices = task_choices(**module_args)
+    stats = dict((number, {"total": 0, "state": {}, "u_state_to_resolve": {}, "groups": []}) for number in release_numbers)
+
+    for start in range(0, len(release_numbers), STATS_RELEASES_PER_QUERY):
+        chunk = release_numbers[start:start + STATS_RELEASES_PER_QUERY]
+        params = {
+            "sysparm_query": all_tasks_query(list(chunk), **module_args),
+            "sysparm_group_by": "top_task.number,state,u_state_to_resolve",
+            "sysparm_count": "true"
+        }
+
+        response = get_client(**module_args).get(endpoint, params=params, timeout=module_args["timeout"])
+        response.raise_for_status()
+
+        for row in response.json().get("result", []):
+            group = dict((item["field"], item.get("value", "")) for item in row.get("groupby_fields", []))
+            count = int(row.get("stats", {}).get("count", 0))
+            release = stats.setdefault(group.get("top_task.number", ""), {"total": 0, "state": {}, "u_state_to_resolve": {}, "groups": []})
+            state = choice_label(choices, "state", group.get("state", ""))
+            state_resolve = choice_label(choices, "u_state_to_resolve", group.get("u_state_to_resolve", ""))
+
+            release["total"] += count
+            release["state"][state] = release["state"].get(state, 0) + count
+            release["u_state_to_resolve"][state_resolve] = release["u_state_to_resolve"].get(state_resolve, 0) + count
+            release["groups"].append({"state": state, "u_state_to_resolve": state_resolve, "count": count})
+
+    return stats
@@ -0,0 +1,41 @@
+# coding=utf-8
+
+from __future__ import (absolute_import, division, print_function)
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+#The modules import their helpers as ansible.module_utils.sgt_*
+import ansible.module_utils
+ansible.module_utils.__path__.append(os.path.join(ROOT, "module_utils"))
+
+from ansible.module_utils.sgt_controller import run_sgt_module
+from fake_servicenow import FakeServiceNow
+
+
+def run_module(name, args):
+    # Runs library/<name>.py in process, as the controller daemon does, and
+    # returns its result
+    return run_sgt_module(os.path.join(ROOT, "library", name + ".py"), args)
+
+
+@pytest.fixture
+def servicenow():
+    fake = FakeServiceNow().start()
+    yield fake
+    fake.stop()
+
+
+@pytest.fixture
+def sn_args(servicenow, tmp_path):
+    return {
+        "sn_user":              "tester",
+        "sn_pass":              "test-secret-42",
+        "sn_base":              servicenow.url,
+        "cache_dir":            str(tmp_path / "cache"),
+        "resolve_references":   False
+    }
@@ -0,0 +1,246 @@
+# coding=utf-8
+
+# Local stand-in for the ServiceNow REST APIs used by the sgt_* modules: Table
+# API (v1 and v2), Batch API, Aggregate API and attachments. Records live in
+# memory, every request is logged, and `config` adds latency, throttling, an
+# outage or a script of answers to send first.
+
+from __future__ import (absolute_import, division, print_function)
+import base64
+import json
+import re
+import threading
+import time
+import uuid
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+
+TABLE_PATH = re.compile(r"/api/now/(?:v\d/)?table/(\w+)/?(\w*)")
+STATS_PATH = re.compile(r"/api/now/stats/(\w+)")
+
+
+def _match(record, condition):
+    if condition.startswith("ORDERBY"):
+        return True
+    if "IN" in condition and "=" not in condition:
+        field, values = condition.split("IN", 1)
+        return str(record.get(field, "")) in values.split(",")
+    if ">" in condition:
+        field, value = condition.split(">", 1)
+        return str(record.get(field, "")) > value
+    field, value = condition.split("=", 1)
+    return str(record.get(field, "")) == value
+
+
+def matches(record, query):
+    # Encoded queries: ^ joins conditions, ^OR adds an alternative to the last one
+    groups = []
+    for condition in [c for c in query.split("^") if c]:
+        if condition.startswith("OR") and not condition.startswith("ORDERBY") and groups:
+            groups[-1].append(condition[2:])
+        else:
+            groups.append([condition])
+    return all(any(_match(record, c) for c in group) for group in groups)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _chunks(self):
+        # Request body piece by piece, so uploads are never held in memory
+        if self.headers.get("Transfer-Encoding") == "chunked":
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                if size == 0:
+                    self.rfile.readline()
+                    return
+                yield self.rfile.read(size)
+                self.rfile.readline()
+        else:
+            left = int(self.headers.get("Content-Length") or 0)
+            while left:
+                chunk = self.rfile.read(min(left, 65536))
+                left -= len(chunk)
+                yield chunk
+
+    def _reply(self, code, obj, headers=None):
+        data = json.dumps(obj).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self, method):
+        fake = self.server.fake
+        with fake.lock:
+            fake.in_flight += 1
+        try:
+            self._route(fake, method)
+        finally:
+            with fake.lock:
+                fake.in_flight -= 1
+
+    def _route(self, fake, method):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        config = fake.config
+
+        if url.path == "/api/now/attachment/file":
+            size = sum(len(chunk) for chunk in self._chunks())
+            raw = b""
+        else:
+            raw = b"".join(self._chunks())
+        fake.log.append((method, self.path, len(raw)))
+
+        #Scripted answers ({"status", "headers"}) go before everything else
+        with fake.lock:
+            scripted = config["script"].pop(0) if config.get("script") else None
+        if scripted:
+            return self._reply(scripted["status"], {"error": "scripted"}, scripted.get("headers"))
+
+        if config.get("max_inflight") and fake.in_flight > config["max_inflight"]:
+            fake.throttled += 1
+            return self._reply(429, {"error": "too many requests"}, {"Retry-After": "0"})
+        if config.get("latency"):
+            time.sleep(config["latency"])
+        if config.get("down"):
+            return self._reply(503, {"error": "maintenance"})
+
+        if url.path == "/api/now/v1/batch":
+            return self._reply(200, fake.batch(json.loads(raw)))
+
+        if url.path == "/api/now/attachment/file":
+            record = fake.insert("sys_attachment", {
+                "file_name":        query["file_name"][0],
+                "size_bytes":       str(size),
+                "table_name":       query["table_name"][0],
+                "table_sys_id":     query["table_sys_id"][0]
+            })
+            return self._reply(201, {"result": record})
+
+        if url.path == "/api/now/attachment":
+            return self._reply(*fake.table("GET", "sys_attachment", "", query, {}))
+
+        match = STATS_PATH.match(url.path)
+        if match:
+            return self._reply(200, fake.aggregate(match.group(1), query))
+
+        match = TABLE_PATH.match(url.path)
+        if match:
+            return self._reply(*fake.table(method, match.group(1), match.group(2), query, json.loads(raw) if raw else {}))
+
+        self._reply(404, {"error": "no route"})
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_PUT(self):
+        self._handle("PUT")
+
+    def do_PATCH(self):
+        self._handle("PATCH")
+
+
+class FakeServiceNow(object):
+
+    def __init__(self):
+        self.records = {}
+        self.log = []
+        self.config = {}
+        self.in_flight = 0
+        self.throttled = 0
+        self.lock = threading.Lock()
+        self._server = None
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:%d" % self._server.server_port
+
+    def start(self):
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def insert(self, table, body):
+        with self.lock:
+            record = dict(body)
+            record.setdefault("sys_id", uuid.uuid4().hex)
+            record.setdefault("number", "%s%07d" % (table[:4].upper(), sum(len(r) for r in self.records.values()) + 1))
+            self.records.setdefault(table, []).append(record)
+        return record
+
+    def requests(self, method=None, path=None):
+        return [entry for entry in self.log
+                if (method is None or entry[0] == method) and (path is None or urlparse(entry[1]).path.startswith(path))]
+
+    def table(self, method, table, sys_id, query, body):
+        rows = self.records.get(table, [])
+        fields = query.get("sysparm_fields", [None])[0]
+
+        def project(record):
+            return dict((field, record.get(field, "")) for field in fields.split(",")) if fields else dict(record)
+
+        if method == "POST" and not sys_id:
+            return 201, {"result": self.insert(table, body)}
+
+        if sys_id:
+            for record in rows:
+                if record["sys_id"] == sys_id:
+                    if method != "GET":
+                        record.update(body)
+                    return 200, {"result": project(record)}
+            return 404, {"error": {"message": "No Record found"}}
+
+        encoded = query.get("sysparm_query", [""])[0]
+        found = [record for record in rows if matches(record, encoded)]
+        order = [c[len("ORDERBY"):] for c in encoded.split("^") if c.startswith("ORDERBY")]
+        if order:
+            found.sort(key=lambda record: tuple(str(record.get(field, "")) for field in order))
+
+        offset = int(query.get("sysparm_offset", ["0"])[0])
+        limit = int(query.get("sysparm_limit", ["10000"])[0])
+        return 200, {"result": [project(record) for record in found[offset:offset + limit]]}
+
+    def batch(self, request):
+        serviced = []
+        for item in request["rest_requests"]:
+            body = json.loads(base64.b64decode(item["body"])) if item.get("body") else {}
+            match = TABLE_PATH.match(item["url"])
+            code, obj = self.table(item["method"], match.group(1), match.group(2), {}, body)
+            serviced.append({
+                "id":           item["id"],
+                "status_code":  code,
+                "body":         base64.b64encode(json.dumps(obj).encode("utf-8")).decode("ascii")
+            })
+
+        return {"batch_request_id": request["batch_request_id"], "serviced_requests": serviced, "unserviced_requests": []}
+
+    def aggregate(self, table, query):
+        encoded = query.get("sysparm_query", [""])[0]
+        group_by = query.get("sysparm_group_by", [""])[0].split(",")
+        counts = {}
+        for record in self.records.get(table, []):
+            if matches(record, encoded):
+                key = tuple(str(record.get(field, "")) for field in group_by)
+                counts[key] = counts.get(key, 0) + 1
+
+        return {"result": [
+            {"stats": {"count": str(count)}, "groupby_fields": [{"field": f, "value": v} for f, v in zip(group_by, key)]}
+            for key, count in counts.items()
+        ]}
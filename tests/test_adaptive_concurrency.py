@@ -0,0 +1,80 @@
+# coding=utf-8
+
+from __future__ import (absolute_import, division, print_function)
+
+from ansible.module_utils.sgt_parallel import AimdController
+
+from conftest import run_module
+
+
+def _release_tasks(servicenow, release, count):
+    for _ in range(count):
+        servicenow.insert("rm_task", {"state": "1", "top_task.number": release, "u_state_to_resolve": "Pre-production"})
+
+
+def _update_release(sn_args, **args):
+    return run_module("sgt_task_update", dict(
+        sn_args,
+        release="RLSE0000001",
+        state="in_progress",
+        assigned_to="deployer",
+        info_tasks_filter="all",
+        update_workers=4,
+        adaptive_concurrency=True,
+        adaptive_max_workers=24,
+        backoff_factor=0.01,
+        **args
+    ))
+
+
+def test_aimd_halves_on_congestion_and_grows_when_healthy():
+    controller = AimdController(8, 1, 16)
+
+    controller.update(0.0, 0.1, True, 8)
+    assert controller.allowed() == 4
+
+    for _ in range(8):
+        controller.update(1e12, 0.1, False, 4)
+    assert controller.allowed() == 5
+
+
+def test_aimd_counts_one_decrease_per_round():
+    controller = AimdController(8, 1, 16)
+    started = controller.start
+
+    controller.update(started, 0.1, True, 8)
+    #Results of calls started before the decrease do not halve it again
+    controller.update(started, 0.1, True, 7)
+    assert controller.allowed() == 4
+    assert controller.decreases == 1
+
+
+def test_adaptive_update_grows_on_a_healthy_instance(servicenow, sn_args):
+    _release_tasks(servicenow, "RLSE0000001", 80)
+    servicenow.config.update(latency=0.05)
+
+    result = _update_release(sn_args)
+
+    assert not result.get("failed"), result.get("msg")
+    assert [r["status_code"] for r in result["message"]] == [200] * 80
+    report = result["http_stats"]["concurrency"][-1]
+    assert report["initial"] == 4
+    assert report["final"] > report["initial"]
+    assert servicenow.throttled == 0
+
+
+def test_adaptive_update_backs_off_when_throttled(servicenow, sn_args):
+    _release_tasks(servicenow, "RLSE0000001", 120)
+    servicenow.config.update(latency=0.02, max_inflight=6)
+
+    result = _update_release(sn_args, retries=10)
+
+    assert not result.get("failed"), result.get("msg")
+    assert [r["status_code"] for r in result["message"]] == [200] * 120
+    assert servicenow.throttled > 0
+
+    report = result["http_stats"]["concurrency"][-1]
+    assert report["decreases"] > 0
+    assert report["max"] > 4
+    #Halving on every 429 keeps the limit around what the instance takes
+    assert report["final"] <= 2 * servicenow.config["max_inflight"]
@@ -0,0 +1,42 @@
+# coding=utf-8
+
+from __future__ import (absolute_import, division, print_function)
+
+from ansible.module_utils.sgt_task import task_choices, task_state_code
+
+from conftest import run_module
+
+
+def _choice(servicenow, table, element, value, label):
+    servicenow.insert("sys_choice", {"name": table, "element": element, "value": value, "label": label, "inactive": "false", "language": "en"})
+
+
+def test_instance_codes_replace_the_built_in_ones(servicenow, sn_args):
+    _choice(servicenow, "task", "state", "30", "Closed Complete")
+    _choice(servicenow, "task", "state", "20", "Work in Progress")
+
+    choices = task_choices(timeout=30, **sn_args)
+
+    assert choices["state"] == {"30": "Closed Complete", "20": "Work in Progress"}
+    assert task_state_code("closed", choices) == "30"
+    assert task_state_code("in_progress", choices) == "20"
+    #Fields the instance does not define keep the built-in codes
+    assert choices["u_state_to_resolve"] == {"15": "Pre-production", "9": "Implement"}
+
+
+def test_built_in_codes_without_sys_choice(servicenow, sn_args):
+    choices = task_choices(timeout=30, **sn_args)
+
+    assert task_state_code("closed", choices) == "3"
+
+
+def test_release_states_are_labelled_without_sys_choice(servicenow, sn_args):
+    group = servicenow.insert("sys_user_group", {"name": "release-team"})
+    servicenow.insert("rm_release", {"number": "RLSE0000001", "state": "2", "assignment_group": group["sys_id"]})
+
+    result = run_module("sgt_release_info", dict(sn_args, releases=["RLSE0000001"]))
+
+    record = result["message"]["RLSE0000001"]
+    assert record["state"] == "Work in Progress"
+    #References come back as sys_ids unless display_value is set
+    assert record["assignment_group"] == group["sys_id"]
@@ -0,0 +1,86 @@
+# coding=utf-8
+
+from __future__ import (absolute_import, division, print_function)
+import contextvars
+import time
+
+import pytest
+import requests
+
+from ansible.module_utils.sgt_client import get_client
+
+
+def _in_run(sn_args, func, **args):
+    # func(client, url) in a module run of its own, returns (result, http_stats)
+    def run():
+        client = get_client(**dict(sn_args, timeout=30, coalesce_window=-1, **args))
+        return func(client, sn_args["sn_base"] + "/api/now/v2/table/rm_task"), dict(client.stats)
+
+    return contextvars.Context().run(run)
+
+
+def _throttled(seconds):
+    return {"status": 429, "headers": {"Retry-After": str(seconds)}}
+
+
+def test_throttled_get_is_retried_after_retry_after(servicenow, sn_args):
+    servicenow.config["script"] = [_throttled(0.2), _throttled(0.2)]
+
+    start = time.time()
+    response, stats = _in_run(sn_args, lambda client, url: client.get(url))
+
+    assert response.status_code == 200
+    assert time.time() - start >= 0.4
+    assert stats["requests"] == 3
+    assert stats["retries"] == 2
+    assert stats["backoff_time"] == pytest.approx(0.4)
+
+
+def test_long_retry_after_is_not_slept(servicenow, sn_args):
+    servicenow.config["script"] = [_throttled(3600)]
+
+    start = time.time()
+    response, stats = _in_run(sn_args, lambda client, url: client.get(url), backoff_max=30)
+
+    assert response.status_code == 429
+    assert time.time() - start < 1
+    assert stats["requests"] == 1 and stats["retries"] == 0
+
+
+def test_retries_stop_at_the_limit(servicenow, sn_args):
+    servicenow.config["script"] = [{"status": 503}] * 5
+
+    response, stats = _in_run(sn_args, lambda client, url: client.get(url), retries=2, backoff_factor=0.01)
+
+    assert response.status_code == 503
+    assert stats["requests"] == 3 and stats["retries"] == 2
+    assert len(servicenow.requests("GET")) == 3
+
+
+def test_post_is_retried_on_429_only(servicenow, sn_args):
+    servicenow.config["script"] = [_throttled(0), {"status": 503}]
+
+    response, stats = _in_run(sn_args, lambda client, url: client.post(url, data="{}"), backoff_factor=0.01)
+
+    #The 503 may come after the instance processed the insert
+    assert response.status_code == 503
+    assert stats["retries"] == 1
+    assert len(servicenow.requests("POST")) == 2
+
+
+def test_post_is_not_retried_after_a_read_timeout(servicenow, sn_args):
+    servicenow.config["latency"] = 0.5
+
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        _in_run(sn_args, lambda client, url: client.post(url, data="{}"), read_timeout=0.2)
+
+    assert len(servicenow.requests("POST")) == 1
+
+
+def test_get_is_retried_after_a_read_timeout(servicenow, sn_args):
+    servicenow.config["latency"] = 0.5
+
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        _in_run(sn_args, lambda client, url: client.get(url), read_timeout=0.2, retries=2, backoff_factor=0.01)
+
+    assert len(servicenow.requests("GET")) == 3
@@ -0,0 +1,52 @@
+# coding=utf-8
+
+from __future__ import (absolute_import, division, print_function)
+import os
+from types import SimpleNamespace
+
+from ansible.module_utils.sgt_controller import run_action
+
+from conftest import ROOT
+
+
+def _action(connection, **args):
+    executed = []
+    action = SimpleNamespace(
+        _play_context=SimpleNamespace(connection=connection, check_mode=False, diff=False, no_log=False),
+        _task=SimpleNamespace(action="sgt_upload", args=args),
+        _execute_module=lambda task_vars: executed.append(task_vars) or {"changed": True}
+    )
+    return action, executed
+
+
+def test_target_files_run_on_the_target():
+    action, executed = _action("ssh", filename="/tmp/plan.pdf")
+
+    assert run_action(action, {}, reads_target_files=True) == {"changed": True}
+    assert executed
+
+
+def test_outbox_is_refused_when_forced_to_the_target():
+    action, executed = _action("ssh", filename="/tmp/plan.pdf", outbox="on_failure")
+
+    result = run_action(action, {}, reads_target_files=True)
+
+    assert result["failed"] and "outbox" in result["msg"]
+    assert not executed
+
+
+def test_outbox_runs_on_the_target_in_remote_mode():
+    action, executed = _action("ssh", filename="/tmp/plan.pdf", outbox="always")
+
+    assert run_action(action, {"sgt_controller_mode": "remote"}, reads_target_files=True) == {"changed": True}
+
+
+def test_action_plugins_share_one_action_module():
+    from ansible.plugins.loader import action_loader
+    action_loader.add_directory(os.path.join(ROOT, "action_plugins"))
+    base = action_loader.get("sgt_action", class_only=True)
+
+    for name in ("sgt_approve", "sgt_task_update", "sgt_outbox", "sgt_upload"):
+        plugin = action_loader.get(name, class_only=True)
+        assert issubclass(plugin, base)
+        assert plugin.reads_target_files == (name == "sgt_upload")
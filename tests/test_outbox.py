@@ -0,0 +1,75 @@
+# coding=utf-8
+
+from __future__ import (absolute_import, division, print_function)
+
+from ansible.module_utils.sgt_outbox import SgtOutbox
+
+from conftest import run_module
+
+
+def _update(sn_args, task, work_notes, outbox, **args):
+    return run_module("sgt_task_update", dict(
+        sn_args, task=task["number"], assigned_to="deployer", work_notes=work_notes, outbox=outbox, **args))
+
+
+def _pending(sn_args):
+    return SgtOutbox(sn_args["cache_dir"]).pending(sn_args["sn_base"], sn_args["sn_user"])
+
+
+def test_buffered_write_only_flushes_buffered_updates(servicenow, sn_args, tmp_path):
+    queued_task = servicenow.insert("rm_task", {"state": "1"})
+    buffered_task = servicenow.insert("rm_task", {"state": "1"})
+    evidence = tmp_path / "evidence.txt"
+    evidence.write_bytes(b"evidence")
+
+    _update(sn_args, queued_task, "queued", "always")
+    run_module("sgt_upload", dict(sn_args, filename=str(evidence), id_record=queued_task["sys_id"], outbox="always"))
+    _update(sn_args, buffered_task, "first", "buffer", buffer_window=60)
+    result = _update(sn_args, buffered_task, "second", "buffer", buffer_window=0)
+
+    assert not result.get("failed"), result
+    assert result["message"]["flushed"]["done"] == 2
+    assert buffered_task["work_notes"] == "first\n\nsecond"
+
+    #The queued update and the file are left to sgt_outbox
+    assert [row["module"] for row in _pending(sn_args)] == ["sgt_task_update", "sgt_upload"]
+    assert "work_notes" not in queued_task
+    assert "sys_attachment" not in servicenow.records
+
+    flushed = run_module("sgt_outbox", dict(sn_args))
+    assert flushed["message"]["done"] == 2, flushed
+    assert queued_task["work_notes"] == "queued"
+    assert servicenow.records["sys_attachment"][0]["file_name"] == "evidence.txt"
+    assert not _pending(sn_args)
+
+
+def test_buffered_write_leaves_records_with_queued_writes(servicenow, sn_args):
+    task = servicenow.insert("rm_task", {"state": "1"})
+
+    _update(sn_args, task, "queued", "always")
+    result = _update(sn_args, task, "buffered", "buffer", buffer_window=0)
+
+    #Sending the buffered update alone would overtake the queued one
+    assert result["message"]["flushed"] is None
+    assert len(_pending(sn_args)) == 2
+    assert "work_notes" not in task
+
+
+def test_journaled_write_does_not_call_the_instance(servicenow, sn_args):
+    task = servicenow.insert("rm_task", {"state": "1"})
+    servicenow.config.update(down=True)
+
+    result = _update(dict(sn_args, resolve_references=True), task, "deployed", "always", state="closed", close_code="Successful", close_notes="done")
+
+    assert not result.get("failed"), result
+    assert "queued" in result["message"]
+    assert servicenow.log == []
+
+    #Labels and names are translated by the flush, with the instance's codes
+    servicenow.config.update(down=False)
+    servicenow.insert("sys_choice", {"name": "task", "element": "state", "value": "30", "label": "Closed Complete", "inactive": "false", "language": "en"})
+    flushed = run_module("sgt_outbox", dict(sn_args))
+
+    assert flushed["message"]["done"] == 1, flushed
+    assert task["state"] == "30"
+    assert task["u_close_code"] == "Successful"
@@ -0,0 +1,94 @@
+# coding=utf-8
+
+from __future__ import (absolute_import, division, print_function)
+
+import pytest
+
+from ansible.module_utils.sgt_pipeline import build_graph, critical_path, resolve_args, run_pipeline
+
+from conftest import run_module
+
+
+def test_graph_takes_needs_and_references():
+    graph = build_graph([
+        {"name": "release"},
+        {"name": "task", "args": {"release": "${release.number}"}},
+        {"name": "approve", "needs": ["task"], "args": {"records": ["${release.sys_id}"]}},
+    ])
+
+    assert graph == {"release": set(), "task": {"release"}, "approve": {"task", "release"}}
+
+
+@pytest.mark.parametrize("steps, error", [
+    ([{"name": "a", "needs": ["b"]}, {"name": "b", "args": {"x": "${a.number}"}}], "dependency cycle between steps: a, b"),
+    ([{"name": "a", "needs": ["missing"]}], "step a needs unknown steps: missing"),
+    ([{"name": "a"}, {"name": "a"}], "duplicated step name: a"),
+    ([{"module": "sgt_task_info"}], "every step needs a name"),
+])
+def test_invalid_graphs(steps, error):
+    with pytest.raises(ValueError) as raised:
+        build_graph(steps)
+    assert str(raised.value) == error
+
+
+def test_references_are_resolved():
+    results = {"release": {"changed": True, "message": {"number": "RLSE1", "sys_id": "abc"}, "tasks": [{"number": "T1"}]}}
+
+    args = resolve_args({
+        "release": "${release.number}",
+        "record": "${release.message}",
+        "first": "${release.tasks.0.number}",
+        "text": "Release ${release.number} (${release.sys_id})",
+        "other": 3
+    }, results)
+
+    assert args == {
+        "release": "RLSE1",
+        "record": {"number": "RLSE1", "sys_id": "abc"},
+        "first": "T1",
+        "text": "Release RLSE1 (abc)",
+        "other": 3
+    }
+
+
+def test_steps_after_a_failure_are_skipped():
+    steps = [
+        {"name": "release"},
+        {"name": "task", "args": {"release": "${release.number}"}},
+        {"name": "approve", "needs": ["task"]},
+        {"name": "other"},
+    ]
+
+    def run_step(step, args):
+        if step["name"] == "release":
+            return {"failed": True, "msg": "down"}
+        return {"changed": True}
+
+    results, report = run_pipeline(steps, run_step, workers=2)
+
+    assert results["task"]["skipped"] and results["approve"]["skipped"]
+    assert results["other"] == {"changed": True}
+    assert set(report["timings"]) == {"release", "other"}
+
+
+def test_critical_path_is_the_longest_chain():
+    graph = {"release": set(), "db": {"release"}, "app": {"release"}, "approve": {"db", "app"}, "docs": set()}
+    timings = {"release": 1.0, "db": 3.0, "app": 1.5, "approve": 0.5, "docs": 4.0}
+
+    assert critical_path(graph, timings) == (["release", "db", "approve"], 4.5)
+    assert critical_path(graph, {}) == ([], 0.0)
+
+
+def test_pipeline_reports_the_http_stats_of_its_steps(servicenow, sn_args):
+    task = servicenow.insert("rm_task", {"state": "1"})
+    steps = [
+        {"name": "first", "module": "sgt_task_info", "args": {"task": task["number"], "state": "info", "sys_id_cache": False}},
+        {"name": "second", "module": "sgt_task_info", "args": {"task": task["number"], "state": "info", "sys_id_cache": False}, "needs": ["first"]},
+    ]
+
+    result = run_module("sgt_release_pipeline", dict(sn_args, steps=steps, coalesce_window=-1))
+
+    assert not result.get("failed"), result
+    step_requests = [result["steps"][name]["http_stats"]["requests"] for name in ("first", "second")]
+    assert min(step_requests) > 0
+    assert result["http_stats"]["requests"] == sum(step_requests)
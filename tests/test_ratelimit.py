@@ -0,0 +1,48 @@
+# coding=utf-8
+
+from __future__ import (absolute_import, division, print_function)
+import contextvars
+import time
+
+import pytest
+
+from ansible.module_utils.sgt_client import DeadlineExceeded, get_client
+from ansible.module_utils.sgt_ratelimit import SgtRateLimiter
+
+
+def test_bucket_spaces_requests(tmp_path):
+    limiter = SgtRateLimiter(str(tmp_path), "https://example.service-now.com", "tester", 10, 1)
+
+    assert limiter.acquire() == 0.0
+    assert 0.05 < limiter.acquire() <= 0.1
+
+
+def test_wait_past_the_remaining_time_takes_no_token(tmp_path):
+    limiter = SgtRateLimiter(str(tmp_path), "https://example.service-now.com", "tester", 1, 1)
+    limiter.acquire()
+
+    start = time.time()
+    assert limiter.acquire(0.2) is None
+    assert time.time() - start < 0.2
+    #The refused call left the bucket as it was
+    assert 0.5 < limiter.acquire(2) <= 1.0
+
+
+def _run_requests(sn_args, count, **args):
+    def run():
+        client = get_client(**dict(sn_args, **args))
+        for _ in range(count):
+            client.get(sn_args["sn_base"] + "/api/now/v2/table/rm_task", params={"sysparm_limit": "1"})
+        return client.stats
+
+    return contextvars.Context().run(run)
+
+
+def test_rate_limit_wait_respects_the_deadline(servicenow, sn_args):
+    start = time.time()
+    with pytest.raises(DeadlineExceeded):
+        _run_requests(sn_args, 2, rate_limit=0.5, rate_burst=1, deadline=1, coalesce_window=-1)
+
+    #The second request would wait 2s for its token, past the deadline
+    assert time.time() - start < 1
+    assert len(servicenow.requests("GET")) == 1
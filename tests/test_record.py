@@ -0,0 +1,53 @@
+# coding=utf-8
+
+from __future__ import (absolute_import, division, print_function)
+
+from conftest import run_module
+
+
+DELEGATE_ARGS = {
+    "release":              "RLSE0012345",
+    "short_description":    "Regression",
+    "description":          "Nightly regression",
+    "cycle":                "1",
+    "test_result":          "OK"
+}
+
+
+def _define(servicenow, table, field):
+    servicenow.insert("sys_dictionary", {"name": table, "element": field})
+
+
+def test_keyed_create_reads_only_the_key(servicenow, sn_args):
+    _define(servicenow, "u_delegated_test", "correlation_id")
+    for _ in range(50):
+        servicenow.insert("u_delegated_test", {"u_cycle": "0"})
+
+    first = run_module("sgt_release_delegate", dict(sn_args, idempotent=True, **DELEGATE_ARGS))
+    second = run_module("sgt_release_delegate", dict(sn_args, idempotent=True, **DELEGATE_ARGS))
+
+    assert first["changed"] and not second["changed"], (first, second)
+    assert len(servicenow.records["u_delegated_test"]) == 51
+    for method, path, _ in servicenow.requests("GET", "/api/now/v2/table/u_delegated_test"):
+        if "correlation_idIN" in path:
+            assert "sysparm_fields=sys_id%2Ccorrelation_id" in path
+            assert "sysparm_limit=2" in path
+
+
+def test_keyed_create_needs_the_field(servicenow, sn_args):
+    #sys_dictionary is readable but the table has no correlation_id
+    _define(servicenow, "u_delegated_test", "u_cycle")
+
+    result = run_module("sgt_release_delegate", dict(sn_args, idempotent=True, **DELEGATE_ARGS))
+
+    assert result.get("failed")
+    assert "not a field of u_delegated_test" in str(result["message"])
+    assert "u_delegated_test" not in servicenow.records
+
+
+def test_outbox_does_not_key_creates(servicenow, sn_args):
+    result = run_module("sgt_release_delegate", dict(sn_args, outbox="on_failure", **DELEGATE_ARGS))
+
+    assert not result.get("failed"), result
+    assert "correlation_id" not in servicenow.records["u_delegated_test"][0]
+    assert not servicenow.requests("GET", "/api/now/v2/table/sys_dictionary")
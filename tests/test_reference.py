@@ -0,0 +1,53 @@
+# coding=utf-8
+
+from __future__ import (absolute_import, division, print_function)
+
+from ansible.module_utils.sgt_reference import resolve_references
+
+
+def _args(sn_args, **args):
+    return dict(sn_args, resolve_references=True, timeout=30, **args)
+
+
+def _define(servicenow, table, field, reference):
+    servicenow.insert("sys_dictionary", {"name": table, "element": field, "reference": reference})
+
+
+def test_confirmed_reference_is_resolved(servicenow, sn_args):
+    _define(servicenow, "task", "assignment_group", "sys_user_group")
+    group = servicenow.insert("sys_user_group", {"name": "release-team"})
+
+    payloads, errors = resolve_references([{"assignment_group": "release-team"}], "rm_task", **_args(sn_args))
+
+    assert payloads == [{"assignment_group": group["sys_id"]}]
+    assert errors == [[]]
+
+
+def test_unknown_name_in_a_confirmed_table_fails(servicenow, sn_args):
+    _define(servicenow, "task", "assignment_group", "sys_user_group")
+
+    payloads, errors = resolve_references([{"assignment_group": "nobody"}], "rm_task", **_args(sn_args))
+
+    assert errors == [["assignment_group: 'nobody' not found in sys_user_group"]]
+
+
+def test_unconfirmed_reference_is_left_to_the_instance(servicenow, sn_args):
+    #No sys_dictionary entry: the table of the field is not known
+    payloads, errors = resolve_references([{"assignment_group": "release-team"}], "rm_task", **_args(sn_args))
+
+    assert payloads == [{"assignment_group": "release-team"}]
+    assert errors == [[]]
+    assert not servicenow.requests("GET", "/api/now/v2/table/sys_user_group")
+
+
+def test_custom_fields_are_opt_in(servicenow, sn_args):
+    _define(servicenow, "rm_task", "u_application", "cmdb_ci_appl")
+    app = servicenow.insert("cmdb_ci_business_app", {"name": "payments"})
+    payload = {"u_application": "payments"}
+
+    payloads, errors = resolve_references([payload], "rm_task", **_args(sn_args))
+    assert payloads == [payload] and errors == [[]]
+
+    payloads, errors = resolve_references([payload], "rm_task", **_args(sn_args, reference_tables={"u_application": "cmdb_ci_business_app"}))
+    assert payloads == [{"u_application": app["sys_id"]}]
+    assert errors == [[]]
@@ -0,0 +1,73 @@
+# coding=utf-8
+
+from __future__ import (absolute_import, division, print_function)
+
+from conftest import run_module
+
+
+TASK_ARGS = {
+    "release":          "RLSE0012345",
+    "start_date":       "2026-10-01 08:00:00",
+    "end_date":         "2026-10-01 10:00:00",
+    "state_resolve":    "Pre-production",
+    "type":             "Deployment",
+    "group":            "release-team",
+    "application":      "payments",
+    "technology":       "java"
+}
+
+
+def test_tasks_are_created_through_the_batch_api(servicenow, sn_args):
+    tasks = [{"short_description": "task %d" % i, "description": "step %d" % i, "order": str(i)} for i in range(5)]
+
+    result = run_module("sgt_task_create", dict(sn_args, tasks=tasks, batch_size=2, **TASK_ARGS))
+
+    assert not result.get("failed"), result
+    assert result["changed"]
+    assert [r["status_code"] for r in result["message"]] == [201] * 5
+    assert [r["result"]["short_description"] for r in result["message"]] == ["task %d" % i for i in range(5)]
+    assert len(servicenow.records["rm_task"]) == 5
+
+    #5 tasks, 2 per call: 3 calls to the Batch API and no single inserts
+    assert len(servicenow.requests("POST", "/api/now/v1/batch")) == 3
+    assert not servicenow.requests("POST", "/api/now/v2/table/rm_task")
+
+
+def test_idempotent_batch_skips_existing_tasks(servicenow, sn_args):
+    tasks = [{"short_description": "task %d" % i, "description": "step %d" % i, "order": str(i)} for i in range(3)]
+    args = dict(sn_args, tasks=tasks, idempotent=True, **TASK_ARGS)
+    servicenow.insert("sys_dictionary", {"name": "task", "element": "correlation_id"})
+
+    first = run_module("sgt_task_create", args)
+    second = run_module("sgt_task_create", args)
+
+    assert first["changed"] and not second["changed"], (first, second)
+    assert all(r.get("existing") for r in second["message"])
+    assert len(servicenow.records["rm_task"]) == 3
+
+
+def test_invalid_items_are_not_sent(servicenow, sn_args):
+    args = dict(TASK_ARGS, release=None)
+    tasks = [
+        {"short_description": "ok", "description": "d", "release": "RLSE0012345"},
+        {"short_description": "no release", "description": "d"},
+        {"short_description": "typo", "description": "d", "release": "RLSE0012345", "ordr": "1"}
+    ]
+
+    result = run_module("sgt_task_create", dict(sn_args, tasks=tasks, **args))
+
+    assert result.get("failed")
+    assert [r["status_code"] for r in result["message"]] == [201, None, None]
+    assert "missing release" in result["message"][1]["result"]["mensaje"]
+    assert "unknown option ordr" in result["message"][2]["result"]["mensaje"]
+    assert [r["short_description"] for r in servicenow.records["rm_task"]] == ["ok"]
+
+
+def test_tasks_need_a_create_state(servicenow, sn_args):
+    tasks = [{"short_description": "task", "description": "step"}]
+
+    result = run_module("sgt_task_create", dict(sn_args, tasks=tasks, state="update", task="RLSE0000001", **TASK_ARGS))
+
+    assert result.get("failed")
+    assert "state present or create" in result["msg"]
+    assert not servicenow.log
@@ -0,0 +1,16 @@
+# coding=utf-8
+
+from __future__ import (absolute_import, division, print_function)
+
+from conftest import run_module
+
+
+def test_unknown_task_is_not_updated(servicenow, sn_args):
+    servicenow.insert("rm_task", {"state": "1"})
+
+    result = run_module("sgt_task_update", dict(sn_args, task="RLSE9999999", assigned_to="deployer"))
+
+    assert result.get("failed")
+    assert result["message"]["mensaje"] == "ERROR, task could not update, not found: RLSE9999999"
+    #Nothing is written, least of all to the table URL itself
+    assert not servicenow.requests("PUT")
@@ -0,0 +1,74 @@
+# coding=utf-8
+
+from __future__ import (absolute_import, division, print_function)
+import tracemalloc
+
+import pytest
+
+from conftest import run_module
+
+
+MIB = 1024 * 1024
+
+
+def _peak_upload(sn_args, filename):
+    #Imports and the first connection are not part of the upload
+    run_module("sgt_upload", dict(sn_args, filename=str(filename) + ".warmup", id_record="abc123"))
+
+    tracemalloc.start()
+    try:
+        result = run_module("sgt_upload", dict(sn_args, filename=str(filename), id_record="abc123"))
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result, peak
+
+
+@pytest.mark.parametrize("size_mib", [1, 64])
+def test_upload_streams_the_file(servicenow, sn_args, tmp_path, size_mib):
+    filename = tmp_path / "evidence.bin"
+    with open(str(filename), "wb") as f:
+        f.truncate(size_mib * MIB)
+    (tmp_path / "evidence.bin.warmup").write_bytes(b"warmup")
+
+    result, peak = _peak_upload(sn_args, filename)
+
+    assert not result.get("failed"), result
+    assert servicenow.records["sys_attachment"][-1]["size_bytes"] == str(size_mib * MIB)
+    #The file is sent in blocks: the peak does not grow with its size
+    assert peak < MIB
+
+
+def test_upload_empty_file(servicenow, sn_args, tmp_path):
+    filename = tmp_path / "empty.txt"
+    filename.write_bytes(b"")
+
+    result = run_module("sgt_upload", dict(sn_args, filename=str(filename), id_record="abc123"))
+
+    assert not result.get("failed"), result
+    assert servicenow.records["sys_attachment"][0]["size_bytes"] == "0"
+
+
+def test_files_upload_in_parallel(servicenow, sn_args, tmp_path):
+    for name in ("a.log", "b.log", "c.log"):
+        (tmp_path / name).write_bytes(name.encode("utf-8"))
+
+    result = run_module("sgt_upload", dict(sn_args, files=[str(tmp_path / "*.log")], id_record="abc123"))
+
+    assert not result.get("failed"), result
+    assert result["stats"]["uploaded"] == 3
+    assert sorted(r["file_name"] for r in servicenow.records["sys_attachment"]) == ["a.log", "b.log", "c.log"]
+
+
+def test_pattern_without_files_fails(servicenow, sn_args, tmp_path):
+    (tmp_path / "a.log").write_bytes(b"a")
+    pattern = str(tmp_path / "*.pdf")
+
+    result = run_module("sgt_upload", dict(sn_args, files=[str(tmp_path / "*.log"), pattern], id_record="abc123"))
+
+    assert result.get("failed")
+    assert result["stats"]["files"] == 2
+    assert result["stats"]["uploaded"] == 1
+    assert result["stats"]["failed"] == 1
+    assert result["message"][-1]["filename"] == pattern
+    assert "no files match" in result["message"][-1]["result"]["mensaje"]